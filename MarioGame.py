@@ -1,130 +1,321 @@
-import pygame, sys, random, os
+import pygame, sys, random, os, argparse, hashlib
+import numpy as np
 from pygame.locals import *
 from scripts.entities import PhysicsEntity, Player
-from scripts.utils import load_image, load_images, get_image_variation, Spritesheet, Animation
+from scripts.entitystore import EntityStore
+from scripts.spawners import SpawnerIndex
+from scripts.navigation import Navigation
+from scripts.particles import Particles
+from scripts.assets import AssetManager
 from scripts.tilemap import Tilemap
-from scripts.cloud import Clouds
+from scripts.cloud import Parallax
+from scripts.renderer import Renderer
+from scripts.presenter import Presenter
+from scripts.profiler import Profiler
+from scripts.recording import Recording, Recorder
 
 WINDOW_SIZE = (640, 480)
-FPS = 60
+FPS = 144 # Cap on rendered frames per second. The simulation runs at TICK_RATE no matter how fast frames are drawn
+TICK_RATE = 60 # Simulation ticks per second. All physics constants (gravity, acceleration, speed caps) are per tick
+TICK_TIME = 1 / TICK_RATE
+MAX_TICKS_PER_FRAME = 5 # Most ticks to catch up on in one frame, so a slow frame can't snowball into ever slower frames
 COLORKEY = None
 BACKGROUND_COLOR = (7, 180, 220)
 RENDER_SCALE = 1.5
+MAP_PATH = 'maps/level_01.json'
+CLOUD_COUNT = 10
+CLOUD_LAYERS = 3
+MAX_DRAWS = 2048 # Most draw commands per frame
+PROFILE_PATH = 'profile.csv' # Where F4 exports the profiler's frames to
 
 class Game:
 
-    def __init__(self):
+    def __init__(self, map_path=MAP_PATH, headless=False, streaming=False, profile=False, seed=None, record=None, replay=None):
+        """
+        Args: map_path - path to the level to load
+              headless - run without a window (SDL dummy video driver) and don't present frames, for benchmarks and CI
+              streaming - only keep the part of the level around the camera loaded (binary .lvl levels only)
+              profile - time every frame from the start (F3 toggles it, and the overlay, while playing)
+              seed - seed for everything random in the game, or None to pick one
+              record - path to save a recording of the input to when the game quits, or None to not record
+              replay - Recording to take the input from instead of the keyboard, or None to play normally
+        """
+        self.headless = headless
+        self.map_path = map_path
+        self.streaming = streaming
+        self.seed = random.randrange(1 << 32) if seed is None else seed
+        self.tick = 0 # Simulation ticks run since the last reset
+        self.replay = replay
+        self.record_path = record
+        self.recorder = None if record is None else Recorder(Recording(map_path, self.seed, streaming))
+        self.lockstep = record is not None or replay is not None # Wait for streamed chunks instead of letting them arrive whenever, so runs repeat exactly
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy' # Must be set before the display is initialized
         pygame.init()
         
-        self.screen = pygame.display.set_mode(WINDOW_SIZE, 0, 32)
+        self.screen = pygame.display.set_mode(WINDOW_SIZE, 0, 32) # Still needed headless, for convert_alpha()
         pygame.display.set_caption('Classic Super Mario Bros Clone')
         self.display = pygame.Surface((int(WINDOW_SIZE[0] / RENDER_SCALE), int(WINDOW_SIZE[1] / RENDER_SCALE))) # This will be the main surface for rendering
 
+        self.renderer = Renderer(self.display, max_draws=MAX_DRAWS)
+        self.presenter = Presenter(self.screen, self.display)
         self.clock = pygame.time.Clock()
 
+        # Per phase frame timings and counters, free while switched off
+        self.profiler = Profiler(enabled=profile)
+        self.profiler.watch(Tilemap, 'tile_at', 'tile lookups')
+        self.profiler.watch(Tilemap, 'is_solid', 'tile lookups')
+        self.profiler.watch(Tilemap, 'is_solid_batch', 'tile lookups', weight=lambda tilemap, xs, ys: len(xs))
+        self.profiler.watch(PhysicsEntity, 'rect', 'rects')
+
         # Only code for left and right movement. Down will be gravity, and up will be temporarily reversing gravity
         self.movement = [False, False] # Left is [0], right is [1]
+        self.jump_queued = False # Jump pressed since the last tick. Input is only acted on at the start of a tick, so it can be recorded per tick
+        self.paused = False
 
-        # Add code later to load all assets
-        self.assets = {
-            'block': load_images('Tilesets/blocks', colorkey=COLORKEY),
-            'decor': load_images('Tilesets/decor', colorkey=COLORKEY),
-            'items': load_images('Misc/items', colorkey=COLORKEY),
-            'spawners': load_images('spawners')
-        }
+        # Asset groups load on demand (or in the background once requested), so only what the level uses blocks startup
+        self.assets = AssetManager()
+        self.assets.add('block', 'Tilesets/blocks', colorkey=COLORKEY)
+        self.assets.add('decor', 'Tilesets/decor', colorkey=COLORKEY)
+        self.assets.add('items', 'Misc/items', colorkey=COLORKEY)
+        self.assets.add('spawners', 'spawners')
+        self.assets.add('particles', 'Tilesets/particles')
+        self.assets.add_animations('coin', 'Misc/coin') # Load all coin assets
+        self.assets.add_animations('player', 'Characters/player') # Load all player assets
+        self.assets.add_animations('goomba', 'Characters/enemy/goomba')
+        self.assets.add_animations('koopa', 'Characters/enemy/koopas')
+        self.assets.add_animations('plant', 'Characters/enemy/plant')
+        self.assets.add('hammerbro/walk', 'Characters/enemy/hammerbro', colorkey=COLORKEY, animation=True)
+        self.assets.add('lakitu/fly', 'Characters/enemy/lakitu', colorkey=COLORKEY, animation=True)
+        self.assets.request('player/idle', 'decor')
 
         self.tilemap = Tilemap(self, tilesize=16)
+        self.reset()
+
+    # Put the level back the way it was at the start: reload the map, respawn everything and move the player back to its
+    # spawner, keeping the window and the loaded assets. With a seed, the new run uses it instead of the current one.
+    # Recordings cover the run since the game was created, so don't reset while recording or replaying
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed = seed
+        self.tick = 0
+        self.movement = [False, False]
+        self.jump_queued = False
         try:
-            self.tilemap.load('maps/level_01.json')
+            self.tilemap.load(self.map_path, streaming=self.streaming)
         except FileNotFoundError:
             pass
+        self.assets.request_all() # Everything else decodes in the background while the game starts
 
-        # Get player spawning positions
-        for loc in self.tilemap.spawners:
-            if self.tilemap.spawners[loc]['variant'] == 0: # Player
-                player_pos = (self.tilemap.spawners[loc]['pos'][0] * self.tilemap.tilesize,
-                              self.tilemap.spawners[loc]['pos'][1] * self.tilemap.tilesize)
-
-        # Load all coin assets
-        for action in next(os.walk('data/images/Misc/coin'))[1]: # Gets directory names from the directory to walk
-            self.assets['coin/' + action] = Animation(load_images('Misc/coin/' + action))
-
-        # Load all player assets
-        for action in next(os.walk('data/images/Characters/player'))[1]: # Gets directory names from the directory to walk
-            self.assets['player/' + action] = Animation(load_images('Characters/player/'+ action))
+        # Spawners sorted by x, so only the ones near the camera get looked at. Levels without a player spawner start the
+        # player just above their top left corner
+        self.spawners = SpawnerIndex(self.tilemap.spawners, self.tilemap.tilesize)
+        self.navigation = Navigation(self.tilemap) # Walkable spans and the links between them, for enemy AI
+        player_pos = self.spawners.player
+        if player_pos is None:
+            player_pos = ((self.tilemap.bounds[0] + 1) * self.tilemap.tilesize, (self.tilemap.bounds[1] - 2) * self.tilemap.tilesize)
 
         # Blocks are as follows: 00 - ground; 01 - breakable; 02 - used; 03 - mystery; 04 - static block
         self.scroll = [0, 0]
+        self.prev_scroll = [0, 0] # Scroll at the start of the last tick, for interpolating the camera
 
-        self.player_img = load_image('Characters/player/idle/00.png')
+        self.tilemap.stream(player_pos[0] - self.display.get_width(), player_pos[0] + self.display.get_width(), wait=True) # The start of a streamed level has to be there for the first tick
+
+        self.entities = EntityStore(self)
+        self.particles = Particles(self) # Effects only, nothing in the simulation depends on them
+        self.player_img = self.assets['player/idle'].images[0]
         self.player = Player(self, player_pos, (self.player_img.get_width(), self.player_img.get_height()))
+        self.spawners.update(self.entities, self.scroll[0], self.scroll[0] + self.display.get_width()) # What's in view from the start
+        self.entities.take_pickups(self.tilemap, self.tilemap.offgrid_tiles)
+
+        self.background = Parallax(self, seed=self.seed)
+        self.background.add_clouds([self.assets['decor'][2]], count=CLOUD_COUNT, layers=CLOUD_LAYERS)
+
+    # Advance the simulation one tick: camera, background, the player and the other entities
+    def update(self):
+        profiler = self.profiler
+        self.assets.poll() # Pick up asset groups that finished loading in the background
 
-        self.clouds = Clouds(self, self.assets['decor'][2], count=10)
+        if self.replay is not None:
+            self.movement[0], self.movement[1], self.jump_queued = self.replay.input(self.tick)
+        if self.recorder is not None:
+            self.recorder.record(self.tick, self.movement[0], self.movement[1], self.jump_queued)
+        if self.jump_queued:
+            self.player.jump()
+            self.jump_queued = False
+        self.prev_scroll[0] = self.scroll[0]
+        self.prev_scroll[1] = self.scroll[1]
+
+        # Don't scroll in X if in the first 50 pixels of the map of if the right-most tile is at the edge of the screen
+        # The second term of the conditional statement is the pixel position of the last tile (before the bounding wall), minus the scroll value plus the player width. Don't scroll if the last tile position on the display is less than the display width
+        if (100 < self.player.rect().centerx) and ((self.tilemap.bounds[2] - 1) * self.tilemap.tilesize - self.scroll[0] + self.player.size[0] >= self.display.get_width()):
+           self.scroll[0] += (self.player.rect().centerx - 100 - self.scroll[0])
         
-        # Get list of tile X coordinates, for camera scroll purposes
-        self.x_loc_list = []
-        for loc in list(self.tilemap.tilemap):
-            pos = self.tilemap.tilemap[loc]['pos'][0]
-            self.x_loc_list.append(pos)
-        self.x_loc_list = list(sorted(set(self.x_loc_list)))
+        # Only scroll the Y if player is above a certain height
+        if self.player.rect().centery < self.display.get_height() / 2:
+            self.scroll[1] += (self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1])
+        profiler.lap('camera')
+
+        streamed, dropped = self.tilemap.stream(self.scroll[0], self.scroll[0] + self.display.get_width(), wait=self.lockstep) # Load chunks coming into view, drop the ones left behind
+        self.entities.take_pickups(self.tilemap, streamed)
+        self.entities.drop_pickups(dropped)
+        profiler.lap('streaming')
+
+        # Spawn what the camera is coming up on, and put whatever is far off screen to sleep so it costs nothing
+        self.spawners.update(self.entities, self.scroll[0], self.scroll[0] + self.display.get_width())
+        self.entities.sleep(self.scroll[0], self.scroll[0] + self.display.get_width())
+        profiler.lap('spawning')
+
+        self.background.update()
+        profiler.lap('background update')
+        self.player.update(self.tilemap, ((self.movement[1] - self.movement[0]), 0))
+        profiler.lap('player update')
+        self.navigation.steer(self.entities, self.player)
+        profiler.lap('enemy ai')
+        self.entities.update(self.tilemap)
+        profiler.lap('entities update')
+        self.entities.collide()
+        profiler.lap('collisions')
+        self.particles.update()
+        profiler.lap('particles update')
+        self.tick += 1
+
+    # Draw the current frame onto the display surface. Alpha is how far we are between the last tick and the next one (0 to 1)
+    def render(self, alpha=1.0):
+        profiler = self.profiler
+        self.display.fill(BACKGROUND_COLOR)
+        render_scroll = (int(self.prev_scroll[0] + (self.scroll[0] - self.prev_scroll[0]) * alpha),
+                         int(self.prev_scroll[1] + (self.scroll[1] - self.prev_scroll[1]) * alpha))
+        profiler.lap('clear')
+
+        # Everything pushes draw commands with its layer, then they all get drawn in one go
+        self.background.draw(self.renderer, offset=render_scroll)
+        profiler.lap('background draw')
+        self.tilemap.draw(self.renderer, offset=render_scroll)
+        profiler.lap('tilemap draw')
+        profiler.count('offgrid tiles', self.tilemap.offgrid_count)
+        self.entities.draw(self.renderer, offset=render_scroll, alpha=alpha)
+        profiler.lap('entities draw')
+        profiler.count('particles', self.particles.draw(self.renderer, offset=render_scroll, alpha=alpha))
+        profiler.lap('particles draw')
+        self.player.draw(self.renderer, offset=render_scroll, alpha=alpha)
+        profiler.lap('player draw')
+        profiler.draw(self.renderer)
+        self.renderer.flush()
+        profiler.lap('flush')
+        profiler.count('blits', self.renderer.draws)
+        profiler.count('culled', self.renderer.culled)
+
+    # Scale the display up to the window and show the parts of it that changed
+    def present(self):
+        self.presenter.present(self.renderer.dirty)
+        self.profiler.lap('present')
+
+    # Advance one tick (and draw it) with scripted input instead of the keyboard. Used for headless runs and benchmarks
+    def step(self, left=False, right=False, jump=False):
+        self.profiler.begin_frame()
+        self.movement[0] = left
+        self.movement[1] = right
+        self.jump_queued = jump
+
+        self.update()
+        self.render()
+        if not self.headless:
+            self.present()
+        self.profiler.end_frame()
+
+    # Hash of everything the simulation depends on, to check that a replay ends up exactly where the recording did
+    def state_hash(self):
+        store = self.entities
+        alive = np.flatnonzero(store.flags[:store.count])
+        state = hashlib.sha1()
+        state.update(repr((self.tick, self.scroll, self.player.air_time, self.player.jumps, self.player.x_accel, self.player.action,
+                           sorted(self.player.collected.items()), [layer.drift for layer in self.background.layers], self.spawners.state)).encode('utf-8'))
+        for array in (store.pos, store.velocity, store.flags, store.type, store.animation, store.frame, store.timer, store.spawner):
+            state.update(alive.tobytes())
+            state.update(np.ascontiguousarray(array[alive]).tobytes())
+        return state.digest()
+
+    # Save the recording, if there is one, and exit
+    def quit(self):
+        if self.recorder is not None:
+            self.recorder.save(self.record_path, self.state_hash())
+        pygame.quit()
+        sys.exit()
+
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == QUIT:
+                self.quit()
+
+            if event.type == VIDEOEXPOSE: # Window was covered up, whatever's on it can't be trusted
+                self.presenter.invalidate()
+
+            if event.type == KEYDOWN:
+                if event.key == K_ESCAPE:
+                    self.quit()
+                if event.key == K_p:
+                    self.paused = not self.paused
+                if event.key == K_F3:
+                    self.profiler.toggle()
+                if event.key == K_F4:
+                    self.profiler.export(PROFILE_PATH)
+                if event.key == K_UP or event.key == K_w or event.key == K_SPACE:
+                    self.jump_queued = True
+                if event.key == K_DOWN or event.key == K_s:
+                    pass
+                if event.key == K_RIGHT or event.key == K_d:
+                    self.movement[1] = True
+                if event.key == K_LEFT or event.key == K_a:
+                    self.movement[0] = True
+                if event.key == K_q:
+                    pass
+
+            if event.type == KEYUP:
+                if event.key == K_UP or event.key == K_w:
+                    pass
+                if event.key == K_DOWN or event.key == K_s:
+                    pass
+                if event.key == K_RIGHT or event.key == K_d:
+                    self.movement[1] = False
+                if event.key == K_LEFT or event.key == K_a:
+                    self.movement[0] = False
 
     def run(self):
+        # Fixed timestep: real time piles up in the accumulator and is spent in TICK_TIME sized simulation ticks,
+        # then the frame is drawn interpolated between the last two ticks with whatever time is left over
+        accumulator = 0
+        self.clock.tick()
         while True: # Main game loop
-            self.display.fill(BACKGROUND_COLOR)
-            
-            # Don't scroll in X if in the first 50 pixels of the map of if the right-most tile is at the edge of the screen
-            # The second term of the conditional statement is the pixel position of the last tile (before the bounding wall), minus the scroll value plus the player width. Don't scroll if the last tile position on the display is less than the display width
-            if (100 < self.player.rect().centerx) and (self.x_loc_list[-2] * self.tilemap.tilesize - self.scroll[0] + self.player.size[0] >= self.display.get_width()):
-               self.scroll[0] += (self.player.rect().centerx - 100 - self.scroll[0])
-            
-            # Only scroll the Y if player is above a certain height
-            if self.player.rect().centery < self.display.get_height() / 2:
-                self.scroll[1] += (self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1])
-
-            render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
-
-            self.clouds.update()
-            self.clouds.render(self.display, offset=render_scroll)
-            
-            self.tilemap.render(self.display, offset=render_scroll)
-
-            self.player.update(self.tilemap, ((self.movement[1] - self.movement[0]), 0))
-            self.player.render(self.display, offset=render_scroll)
-            
-            # Get events
-            for event in pygame.event.get():
-                if event.type == QUIT:
-                    pygame.quit()
-                    sys.exit()
-
-                if event.type == KEYDOWN:
-                    if event.key == K_ESCAPE:
-                        pygame.quit()
-                        sys.exit()
-                    if event.key == K_UP or event.key == K_w or event.key == K_SPACE:
-                        self.player.jump()
-                    if event.key == K_DOWN or event.key == K_s:
-                        pass
-                    if event.key == K_RIGHT or event.key == K_d:
-                        self.movement[1] = True
-                    if event.key == K_LEFT or event.key == K_a:
-                        self.movement[0] = True
-                    if event.key == K_q:
-                        pass
-
-                if event.type == KEYUP:
-                    if event.key == K_UP or event.key == K_w:
-                        pass
-                    if event.key == K_DOWN or event.key == K_s:
-                        pass
-                    if event.key == K_RIGHT or event.key == K_d:
-                        self.movement[1] = False
-                    if event.key == K_LEFT or event.key == K_a:
-                        self.movement[0] = False
-
-            self.screen.blit(pygame.transform.scale(self.display, WINDOW_SIZE), (0, 0))
-            pygame.display.update()
-            self.clock.tick(FPS)
+            self.profiler.end_frame()
+            self.profiler.begin_frame()
+            self.handle_events()
+            self.profiler.lap('events')
+
+            accumulator += self.clock.tick(FPS) / 1000
+            self.profiler.lap('idle') # Time spent waiting on the frame cap
+            if self.paused: # Nothing moves, so the frame stays the same and there's nothing to present
+                accumulator = 0
+                self.render()
+                self.present()
+                continue
+
+            ticks = 0
+            while accumulator >= TICK_TIME and ticks < MAX_TICKS_PER_FRAME:
+                self.update()
+                accumulator -= TICK_TIME
+                ticks += 1
+            if ticks == MAX_TICKS_PER_FRAME: # Too far behind, drop the backlog instead of trying to catch up
+                accumulator = min(accumulator, TICK_TIME)
+
+            self.render(alpha=accumulator / TICK_TIME)
+            self.present()
 
 if __name__ == '__main__':
-    Game().run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Classic Super Mario Bros clone')
+    parser.add_argument('map', nargs='?', default=MAP_PATH, help='level to play (default: ' + MAP_PATH + ')')
+    parser.add_argument('--streaming', action='store_true', help='stream binary (.lvl) levels instead of loading them whole')
+    parser.add_argument('--seed', type=int, help='seed for everything random in the game')
+    parser.add_argument('--record', metavar='PATH', help='record the input to PATH (replay it with replay.py)')
+    args = parser.parse_args()
+    Game(map_path=args.map, streaming=args.streaming, seed=args.seed, record=args.record).run()
\ No newline at end of file
@@ -0,0 +1,133 @@
+import argparse, glob, multiprocessing, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+# Headless benchmark runner. Steps the game as fast as possible (no window, no frame cap) with a scripted input
+# sequence on every map, and reports frames/sec, per-frame p50/p99 latency and peak memory for each one.
+#
+# With --envs N it measures training throughput instead: env steps/sec of an EnvPool of 1, 2, 4 ... N workers on the
+# first map, and how close each comes to scaling linearly from one worker.
+#
+# Usage: python benchmark.py [--frames N] [--warmup N] [--streaming] [--profile DIR] [--envs N [--observation tiles]] [maps ...]
+
+MAPS = 'maps/*.json'
+FRAMES = 2000
+WARMUP = 60
+JUMP_EVERY = 40 # Frames between scripted jumps
+
+# Scripted input for one frame: hold right the whole time and jump every so often
+def scripted_input(frame):
+    return (False, True, frame % JUMP_EVERY == 0) # left, right, jump
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Peak resident memory of this process in MB, or None where the resource module isn't available (Windows)
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024 # Bytes on macOS, kilobytes on Linux
+
+# Runs in its own process so every map gets a clean peak memory reading
+def bench_map(map_path, frames, warmup, streaming=False, profile_dir=None):
+    from MarioGame import Game
+
+    game = Game(map_path=map_path, headless=True, streaming=streaming, profile=profile_dir is not None)
+    for frame in range(warmup):
+        game.step(*scripted_input(frame))
+    game.profiler.reset(history=frames) # Only keep the timed frames
+
+    times = []
+    start = time.perf_counter()
+    for frame in range(warmup, warmup + frames):
+        frame_start = time.perf_counter()
+        game.step(*scripted_input(frame))
+        times.append(time.perf_counter() - frame_start)
+    total = time.perf_counter() - start
+
+    if profile_dir is not None:
+        game.profiler.export(os.path.join(profile_dir, os.path.splitext(os.path.basename(map_path))[0] + '.csv'))
+
+    times.sort()
+    return {
+        'map': map_path,
+        'fps': frames / total,
+        'p50': percentile(times, 50) * 1000,
+        'p99': percentile(times, 99) * 1000,
+        'peak_mb': peak_memory_mb()
+    }
+
+def run_isolated(map_path, frames, warmup, streaming=False, profile_dir=None):
+    # A fresh spawned process per map. Not multiprocessing.Pool, whose terminate() on exit can deadlock with the worker
+    # still waiting on its task queue
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(bench_map, map_path, frames, warmup, streaming, profile_dir).result()
+
+# Env steps/sec of an EnvPool with count workers, all playing the scripted input
+def bench_envs(map_path, count, steps, warmup, streaming=False, observation='pixels'):
+    import numpy as np
+    from scripts.env import FRAME_SKIP
+    from scripts.envpool import EnvPool
+    from scripts.recording import input_bits
+
+    with EnvPool(count, map_path=map_path, streaming=streaming, observation=observation) as pool:
+        pool.reset()
+        for step in range(warmup):
+            pool.step(np.full(count, input_bits(*scripted_input(step * FRAME_SKIP))))
+        start = time.perf_counter()
+        for step in range(warmup, warmup + steps):
+            pool.step(np.full(count, input_bits(*scripted_input(step * FRAME_SKIP))))
+        return count * steps / (time.perf_counter() - start)
+
+def main_envs(map_path, max_count, steps, warmup, streaming=False, observation='pixels'):
+    counts = []
+    count = 1
+    while count < max_count:
+        counts.append(count)
+        count *= 2
+    counts.append(max_count)
+
+    print('{:<28} {:>10} {:>12} {:>10}'.format('map', 'envs', 'steps/s', 'scaling'))
+    single = None
+    for count in counts:
+        rate = bench_envs(map_path, count, steps, warmup, streaming, observation)
+        single = single or rate
+        print('{:<28} {:>10} {:>12.1f} {:>9.0f}%'.format(os.path.basename(map_path), count, rate, 100 * rate / (single * count)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless frame benchmark for every map')
+    parser.add_argument('maps', nargs='*', help='map files to run (default: ' + MAPS + ')')
+    parser.add_argument('--frames', type=int, default=FRAMES, help='frames to time per map')
+    parser.add_argument('--warmup', type=int, default=WARMUP, help='untimed frames to run first')
+    parser.add_argument('--streaming', action='store_true', help='stream binary (.lvl) maps instead of loading them whole')
+    parser.add_argument('--profile', metavar='DIR', help='profile the timed frames and write per phase timings to DIR/<map>.csv')
+    parser.add_argument('--envs', type=int, metavar='N', help='measure EnvPool throughput with up to N workers (frames are env steps here)')
+    parser.add_argument('--observation', choices=['pixels', 'tiles'], default='pixels', help='what the envs observe with --envs')
+    args = parser.parse_args()
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+
+    maps = args.maps or sorted(glob.glob(MAPS))
+    if args.envs:
+        main_envs(maps[0], args.envs, args.frames, args.warmup, args.streaming, args.observation)
+        return
+
+    print('{:<28} {:>10} {:>10} {:>10} {:>10}'.format('map', 'fps', 'p50 ms', 'p99 ms', 'peak MB'))
+    failed = False
+    for map_path in maps:
+        try:
+            result = run_isolated(map_path, args.frames, args.warmup, args.streaming, args.profile)
+        except Exception as e:
+            print('{:<28} failed: {!r}'.format(os.path.basename(map_path), e))
+            failed = True
+            continue
+        peak = 'n/a' if result['peak_mb'] is None else '{:.1f}'.format(result['peak_mb'])
+        print('{:<28} {:>10.1f} {:>10.3f} {:>10.3f} {:>10}'.format(os.path.basename(map_path), result['fps'], result['p50'], result['p99'], peak))
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
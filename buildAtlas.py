@@ -0,0 +1,11 @@
+import time
+from scripts.atlas import build, ATLAS_PATH
+from scripts.utils import BASE_IMG_PATH
+
+# Asset build step: packs the sprite folders in data/images into atlas pages plus a manifest (see scripts/atlas.py).
+# Re-run it after changing any sprites. Until then, the changed folders are loaded from the loose files
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    folders, sprites, pages = build(BASE_IMG_PATH, ATLAS_PATH)
+    print('Packed {} sprites from {} folders into {} page(s) in {} ({:.2f}s)'.format(sprites, folders, pages, ATLAS_PATH, time.perf_counter() - start))
@@ -0,0 +1,23 @@
+import sys, os, time
+from scripts.levelformat import read_map, write_map, LEVEL_EXT
+
+# Convert maps between the JSON format and the binary .lvl format (see scripts/levelformat.py)
+#
+# Usage: python convertMap.py maps/level_01.json [maps/level_01.lvl]
+#        python convertMap.py maps/level_01.lvl [maps/level_01.json]
+# Without an output path, the extension is swapped
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print('Usage: python convertMap.py <input map> [output map]')
+        sys.exit(1)
+
+    in_path = sys.argv[1]
+    if len(sys.argv) == 3:
+        out_path = sys.argv[2]
+    else:
+        out_path = os.path.splitext(in_path)[0] + ('.json' if in_path.endswith(LEVEL_EXT) else LEVEL_EXT)
+
+    start = time.perf_counter()
+    write_map(read_map(in_path), out_path)
+    print('{} ({} bytes) -> {} ({} bytes) in {:.3f}s'.format(in_path, os.path.getsize(in_path), out_path, os.path.getsize(out_path), time.perf_counter() - start))
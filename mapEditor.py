@@ -1,7 +1,10 @@
 import pygame, sys, os
 from pygame.locals import *
 from scripts.tilemap import Tilemap
-from scripts.utils import load_image, load_images
+from scripts.assets import AssetManager
+from scripts.renderer import Renderer, OVERLAY
+from scripts.presenter import Presenter
+from scripts.journal import Journal
 
 RENDER_SCALE = 1.5
 WINDOW_SIZE = (640, 480)
@@ -19,16 +22,17 @@ class Editor:
         pygame.display.set_caption('Map editor')
         self.display = pygame.Surface((int(WINDOW_SIZE[0] / RENDER_SCALE), int(WINDOW_SIZE[1] / RENDER_SCALE))) # This will be the main surface for rendering
 
+        self.renderer = Renderer(self.display)
+        self.presenter = Presenter(self.screen, self.display)
         self.clock = pygame.time.Clock()
 
-        # Add code later to load all assets
-        self.assets = {
-            'block': load_images('Tilesets/blocks', colorkey=COLORKEY),
-            'decor': load_images('Tilesets/decor', colorkey=COLORKEY),
-            'items': load_images('Misc/items', colorkey=COLORKEY),
-            'coin/collect': load_images('Misc/coin/collect'),
-            'spawners': load_images('spawners')
-        }
+        # Asset groups load on demand, and in the background once the map is loaded
+        self.assets = AssetManager()
+        self.assets.add('block', 'Tilesets/blocks', colorkey=COLORKEY)
+        self.assets.add('decor', 'Tilesets/decor', colorkey=COLORKEY)
+        self.assets.add('items', 'Misc/items', colorkey=COLORKEY)
+        self.assets.add('coin/collect', 'Misc/coin/collect')
+        self.assets.add('spawners', 'spawners')
 
         # Clicking-related attributes
         self.click = False
@@ -49,13 +53,32 @@ class Editor:
         except FileNotFoundError:
             pass
         
+        self.assets.request_all()
+
         self.tilemap.editor = True
+
+        # Edits go to a journal next to the map. One left behind means the editor quit without saving, so pick those edits back up
+        self.journal = Journal(self.tilemap, MAP_PATH + MAP_NAME)
+        recovered = self.journal.recover()
+        if recovered:
+            print('Recovered {} unsaved edits from {}'.format(recovered, self.journal.journal_path))
         self.tile_list = list(self.assets) # Gets a list of keys
         self.tile_group = 0
         self.tile_variant = 0
+        self.previews = {} # (group, variant, flip) -> see through copy of the tile, for showing what's selected
+
+    # See through copy of the selected tile, made once so an idle editor keeps drawing the same image
+    def preview(self, flip=False):
+        key = (self.tile_list[self.tile_group], self.tile_variant, flip)
+        if key not in self.previews:
+            img = pygame.transform.flip(self.assets[key[0]][key[1]], False, flip)
+            img.set_alpha(100)
+            self.previews[key] = img
+        return self.previews[key]
 
     def run(self):
         while True: # Main game loop
+            self.assets.poll() # Pick up asset groups that finished loading in the background
             self.display.fill((7, 155, 176))
             
             # Set the scroll
@@ -64,13 +87,10 @@ class Editor:
             render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
             
             # Render the tilemap
-            self.tilemap.render(self.display, offset=render_scroll)
-
-            # Get the currently selected tile, set it to be ~half transparent
-            current_tile_img = self.assets[self.tile_list[self.tile_group]][self.tile_variant].copy()
-            current_tile_img.set_alpha(100)
+            self.tilemap.draw(self.renderer, offset=render_scroll)
 
-            self.display.blit(current_tile_img, (5, 5)) # Show tile in top left corner
+            # Get the currently selected tile, ~half transparent
+            self.renderer.draw(self.preview(), (5, 5), layer=OVERLAY) # Show tile in top left corner
 
             # Get mouse position on the rendering display, the the corresponding tile coordinate
             mpos = pygame.mouse.get_pos()
@@ -80,29 +100,29 @@ class Editor:
             
             # Display the tile where the mouse is
             if self.ongrid:
-                self.display.blit(pygame.transform.flip(current_tile_img, False, self.flip),
-                                  (tile_pos[0] * self.tilemap.tilesize - self.scroll[0], 
-                                   tile_pos[1] * self.tilemap.tilesize - self.scroll[1]))
+                self.renderer.draw(self.preview(self.flip), (tile_pos[0] * self.tilemap.tilesize - self.scroll[0], 
+                                                             tile_pos[1] * self.tilemap.tilesize - self.scroll[1]), layer=OVERLAY)
             else:
-                self.display.blit(pygame.transform.flip(current_tile_img, False, self.flip), mpos)
+                self.renderer.draw(self.preview(self.flip), mpos, layer=OVERLAY)
+            self.renderer.flush()
 
             # Add tile to tilemap if click. Treat spawners, on grid, and offgrid separately
             if self.click and self.ongrid: # Tiles snapped to grid
                 if self.tile_list[self.tile_group] == 'spawners': # If it's a spawner
-                    self.tilemap.spawners[str(tile_pos[0]) + ';' + str(tile_pos[1])] = {
+                    self.journal.set_spawner({
                         'type': self.tile_list[self.tile_group],
                         'variant': self.tile_variant,
                         'pos': tile_pos    
-                    }
+                    })
                 else:
-                    self.tilemap.tilemap[str(tile_pos[0]) + ';' + str(tile_pos[1])] = {
+                    self.journal.set_tile({
                         'type': self.tile_list[self.tile_group],
                         'variant': self.tile_variant,
                         'pos': tile_pos
-                }
+                    })
 
             if self.click and not self.ongrid: # Tiles off the grid
-                self.tilemap.offgrid_tiles.append({
+                self.journal.add_offgrid({
                     'type': self.tile_list[self.tile_group],
                     'variant': self.tile_variant,
                     'pos': (mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])
@@ -110,28 +130,25 @@ class Editor:
 
             # Remove tiles from tilemap if right click
             if self.right_click:
-                tile_loc = (str(tile_pos[0]) + ';' + str(tile_pos[1]))
-
-                # Delete on grid tiles
-                if tile_loc in self.tilemap.tilemap:
-                    del self.tilemap.tilemap[tile_loc]
-
-                if tile_loc in self.tilemap.spawners:
-                    del self.tilemap.spawners[tile_loc]
+                # Delete on grid tiles and spawners
+                self.journal.remove_tile(tile_pos[0], tile_pos[1])
+                self.journal.remove_spawner(tile_pos[0], tile_pos[1])
                 
-                # Delete off grid tiles
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_img = self.assets[tile['type']][tile['variant']]
-                    tile_rect = pygame.Rect(tile['pos'][0] - self.scroll[0], tile['pos'][1] - self.scroll[1], 
-                                            tile_img.get_width(), tile_img.get_height())
-                    if tile_rect.collidepoint(mpos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                # Delete off grid tiles under the cursor
+                for tile in self.tilemap.offgrid_at((mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])):
+                    self.journal.remove_offgrid(tile)
+
+            self.journal.poll() # Autosave
 
             # Get events
             for event in pygame.event.get():
                 if event.type == QUIT:
+                    self.journal.flush()
                     pygame.quit()
                     sys.exit()
+
+                if event.type == VIDEOEXPOSE:
+                    self.presenter.invalidate()
                 
                 if event.type == MOUSEBUTTONDOWN:
                     if event.button == 1: # Left click
@@ -157,9 +174,12 @@ class Editor:
                         self.click = False
                     if event.button == 3:
                         self.right_click = False
+                    if not self.click and not self.right_click: # A whole drag is one undo step
+                        self.journal.commit()
 
                 if event.type == KEYDOWN:
                     if event.key == K_ESCAPE:
+                        self.journal.flush()
                         pygame.quit()
                         sys.exit()
                     if event.key == K_UP or event.key == K_w:
@@ -177,7 +197,11 @@ class Editor:
                     if event.key == K_g:
                         self.ongrid = not self.ongrid
                     if event.key == K_o:
-                        self.tilemap.save(MAP_PATH + MAP_NAME)
+                        self.journal.save()
+                    if event.key == K_z and event.mod & KMOD_CTRL:
+                        self.journal.undo()
+                    if event.key == K_y and event.mod & KMOD_CTRL:
+                        self.journal.redo()
 
                 if event.type == KEYUP:
                     if event.key == K_UP or event.key == K_w:
@@ -191,8 +215,7 @@ class Editor:
                     if event.key == K_LSHIFT:
                         self.shift = False
 
-            self.screen.blit(pygame.transform.scale(self.display, WINDOW_SIZE), (0, 0))
-            pygame.display.update()
+            self.presenter.present(self.renderer.dirty) # Only what changed, which is nothing while the editor sits idle
             self.clock.tick(FPS)
 
 if __name__ == '__main__':
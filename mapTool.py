@@ -0,0 +1,107 @@
+import argparse, glob, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scripts.levelformat import read_map, write_map, LEVEL_EXT
+from scripts.mapops import run, problems, MapError
+
+# Batch map processing: runs a pipeline of operations over any number of maps (JSON or binary .lvl) in parallel, i.e.
+# to migrate every level when asset names or variants change. Operations run in the order they're given. Every map is
+# validated before it's written, and written atomically, so a map is only ever replaced by a complete, valid one.
+#
+# Usage: python mapTool.py [operations] [--output DIR] [--jobs N] [--dry-run] maps or folders ...
+#   --retype OLD NEW               rename a tile type
+#   --revariant TYPE OLD NEW       renumber one variant of a type
+#   --delete TYPE                  delete every tile of a type
+#   --delete-variant TYPE VARIANT  delete one variant of a type
+#   --shift X0 Y0 X1 Y1 DX DY      move everything in a rect of tiles (inclusive) by DX, DY tiles
+#   --validate                     only check the maps (what every run does before writing anyway)
+#
+# i.e. python mapTool.py --retype coins coin/collect --delete-variant decor 5 maps/
+
+MAP_PATTERNS = ['*.json', '*' + LEVEL_EXT]
+
+# Keeps the operations in the order they were given on the command line
+class PipelineAction(argparse.Action):
+
+    def __init__(self, option_strings, dest, convert=(), operation=None, **kwargs):
+        self.convert = convert # Function for each argument, i.e. int for tile coordinates
+        self.operation = operation # Name of the operation in mapops, if it isn't the option's name
+        super().__init__(option_strings, 'pipeline', **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            args = [convert(value) for convert, value in zip(self.convert, values)]
+        except ValueError as e:
+            parser.error('{}: {}'.format(option_string, e))
+        pipeline = getattr(namespace, 'pipeline', None) or []
+        pipeline.append((self.operation or option_string.lstrip('-'), args))
+        setattr(namespace, 'pipeline', pipeline)
+
+# Map files to process: files as given, folders searched for maps (not recursively)
+def find_maps(paths):
+    maps = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in MAP_PATTERNS:
+                maps.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            maps.append(path)
+    return maps
+
+# Runs in a worker process. Returns (path, tiles changed per operation, error message or None)
+def process_map(path, pipeline, out_path, dry_run=False):
+    try:
+        map_data = read_map(path)
+        changed = run(map_data, pipeline)
+        found = problems(map_data)
+        if found:
+            raise MapError('invalid after processing: ' + '; '.join(found[:5]))
+        if not dry_run and (any(changed) or out_path != path):
+            write_map(map_data, out_path)
+        return path, changed, None
+    except (MapError, ValueError, KeyError, TypeError, OSError) as e:
+        return path, None, '{}: {}'.format(type(e).__name__, e)
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply a pipeline of operations to many maps at once')
+    parser.add_argument('maps', nargs='+', help='map files, or folders of them')
+    parser.add_argument('--retype', nargs=2, metavar=('OLD', 'NEW'), action=PipelineAction, convert=(str, str), help='rename a tile type')
+    parser.add_argument('--revariant', nargs=3, metavar=('TYPE', 'OLD', 'NEW'), action=PipelineAction, convert=(str, int, int), help='renumber a variant of a type')
+    parser.add_argument('--delete', nargs=1, metavar='TYPE', action=PipelineAction, convert=(str,), help='delete a tile type')
+    parser.add_argument('--delete-variant', nargs=2, metavar=('TYPE', 'VARIANT'), action=PipelineAction, convert=(str, int), operation='delete', help='delete one variant of a tile type')
+    parser.add_argument('--shift', nargs=6, metavar=('X0', 'Y0', 'X1', 'Y1', 'DX', 'DY'), action=PipelineAction, convert=(int,) * 6, help='move a rect of tiles')
+    parser.add_argument('--validate', nargs=0, action=PipelineAction, help='check the maps without changing them')
+    parser.add_argument('--output', metavar='DIR', help='write the results to DIR instead of over the originals')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes (default: one per CPU)')
+    parser.add_argument('--dry-run', action='store_true', help='run everything but write nothing')
+    args = parser.parse_args()
+
+    pipeline = getattr(args, 'pipeline', None) or []
+    if not pipeline:
+        parser.error('no operations given')
+
+    maps = find_maps(args.maps)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max(1, args.jobs)) as pool:
+        futures = []
+        for path in maps:
+            out_path = os.path.join(args.output, os.path.basename(path)) if args.output else path
+            futures.append(pool.submit(process_map, path, pipeline, out_path, args.dry_run))
+
+        # Report each map as soon as it's done
+        for future in as_completed(futures):
+            path, changed, error = future.result()
+            if error is not None:
+                failed += 1
+                print('{}: FAILED {}'.format(path, error))
+            else:
+                print('{}: {}'.format(path, ', '.join('{} {}'.format(name, count) for (name, op_args), count in zip(pipeline, changed))))
+
+    print('{} maps, {} failed, {:.2f}s{}'.format(len(maps), failed, time.perf_counter() - start, ' (dry run, nothing written)' if args.dry_run else ''))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse, sys, time
+from scripts.recording import Recording
+
+# Replay an input recording (made with python MarioGame.py --record PATH) against the current build. Runs headless as
+# fast as it can unless --window is given, then reports how long the replay took next to how long the recording took
+# and whether the final state hash matches the recorded one. Exits with 1 on a mismatch, so it can gate CI.
+#
+# Usage: python replay.py [--window] [--no-render] [--profile PATH] recording.rpl
+
+def replay(recording, window=False, render=True, profile_path=None):
+    from MarioGame import Game
+
+    game = Game(map_path=recording.map_path, headless=not window, streaming=recording.streaming, profile=profile_path is not None,
+                seed=recording.seed, replay=recording)
+    game.profiler.reset(history=recording.ticks)
+
+    start = time.perf_counter()
+    while not recording.finished(game.tick):
+        game.profiler.begin_frame()
+        game.update()
+        if render:
+            game.render()
+            if window:
+                game.present()
+        game.profiler.end_frame()
+    elapsed = time.perf_counter() - start
+
+    if profile_path is not None:
+        game.profiler.export(profile_path)
+    return elapsed, game.state_hash()
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay an input recording and check the final state')
+    parser.add_argument('recording', help='.rpl file to replay')
+    parser.add_argument('--window', action='store_true', help='show the replay in a window (still not frame capped)')
+    parser.add_argument('--no-render', action='store_true', help='only run the simulation, for timing game logic alone')
+    parser.add_argument('--profile', metavar='PATH', help='profile every tick and export the timings to PATH (.csv or .json)')
+    args = parser.parse_args()
+
+    recording = Recording.load(args.recording)
+    elapsed, state_hash = replay(recording, window=args.window, render=not args.no_render, profile_path=args.profile)
+
+    print('{}: {} ticks, {} inputs, seed {}'.format(recording.map_path, recording.ticks, len(recording.events), recording.seed))
+    print('replayed in {:.3f}s ({:.0f} ticks/s), recorded in {:.3f}s'.format(elapsed, recording.ticks / elapsed if elapsed else 0, recording.ms / 1000))
+    if not any(recording.state_hash):
+        print('state {} (recording has no hash to compare against)'.format(state_hash.hex()))
+        return
+    if state_hash != recording.state_hash:
+        print('state MISMATCH: got {}, recorded {}'.format(state_hash.hex(), recording.state_hash.hex()))
+        sys.exit(1)
+    print('state ok {}'.format(state_hash.hex()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import pygame, os, time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from scripts.utils import BASE_IMG_PATH, ATLAS, Animation, load_folders
+
+WORKERS = 4 # Threads decoding images
+
+# Read and decode every image of a folder. Runs on a worker thread: pygame decodes files without holding the GIL,
+# so several folders decode at once. Surfaces come back unconverted since conversion has to happen on the main thread
+def decode_folder(path):
+    start = time.perf_counter()
+    images = []
+    for image in sorted(os.listdir(BASE_IMG_PATH + path)):
+        if image[0] != '.': # skip hidden files
+            images.append(pygame.image.load(BASE_IMG_PATH + path + '/' + image))
+    return images, time.perf_counter() - start
+
+# Asset groups (a folder of images, or an animation) that load on demand. Works like the old assets dict: looking up
+# a group that isn't loaded yet loads it right there, while request() starts decoding groups in the background ahead of time
+class AssetManager(Mapping):
+
+    def __init__(self, workers=WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.groups = {} # Group name -> (folder, colorkey, whether it's an animation)
+        self.assets = {} # Group name -> loaded images or Animation
+        self.pending = {} # Group name -> (future, time requested)
+        self.timings = {} # Group name -> {'source', 'decode', 'convert', 'total'} in seconds, for loaded groups
+
+    # Register a group. Nothing is loaded until it's requested or used
+    def add(self, name, path, colorkey=None, animation=False):
+        self.groups[name] = (path, colorkey, animation)
+
+    # Register every animation folder in a folder, i.e. 'player/idle', 'player/run' for 'Characters/player'
+    def add_animations(self, prefix, path, colorkey=None):
+        for action in load_folders(path):
+            self.add(prefix + '/' + action, path + '/' + action, colorkey=colorkey, animation=True)
+
+    # Start loading groups in the background, if they aren't loaded or loading already
+    def request(self, *names):
+        for name in names:
+            if name in self.assets or name in self.pending or name not in self.groups:
+                continue
+
+            path, colorkey, animation = self.groups[name]
+            start = time.perf_counter()
+            images = ATLAS.images(path, colorkey=colorkey) # Packed atlas subsurfaces are ready straight away
+            if images is not None:
+                self.store(name, images, 'atlas', 0, time.perf_counter() - start, start)
+            else:
+                self.pending[name] = (self.pool.submit(decode_folder, path), start)
+
+    def request_all(self):
+        self.request(*self.groups)
+
+    def store(self, name, images, source, decode, convert, start):
+        self.assets[name] = Animation(images) if self.groups[name][2] else images
+        self.timings[name] = {'source': source, 'decode': decode, 'convert': convert, 'total': time.perf_counter() - start}
+
+    # Convert a decoded group on the main thread, waiting for the decode to finish if it hasn't yet
+    def finish(self, name):
+        future, start = self.pending.pop(name)
+        images, decode = future.result()
+
+        convert_start = time.perf_counter()
+        colorkey = self.groups[name][1]
+        for i, img in enumerate(images):
+            images[i] = img.convert_alpha() # Since image has transparency already in image, use convert_alpha() instead of convert()
+            images[i].set_colorkey(colorkey)
+        self.store(name, images, 'files', decode, time.perf_counter() - convert_start, start)
+
+    # Finish any groups that are done decoding, without waiting. Call once a frame while things load in the background
+    def poll(self):
+        for name in [name for name in self.pending if self.pending[name][0].done()]:
+            self.finish(name)
+
+    # Physics flags of each image of a group (i.e. ['solid']), from the atlas manifest. Empty for unknown groups
+    def physics(self, name):
+        if name not in self.groups:
+            return []
+        return ATLAS.physics(self.groups[name][0])
+
+    def loaded(self, name):
+        return name in self.assets
+
+    def __getitem__(self, name):
+        if name not in self.assets:
+            if name not in self.groups:
+                raise KeyError(name)
+            self.request(name)
+            if name in self.pending:
+                self.finish(name)
+        return self.assets[name]
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
@@ -0,0 +1,203 @@
+import pygame, os, json
+
+# Packed texture atlases. The build step (buildAtlas.py) packs every sprite folder under the image directory into a few
+# big atlas pages and writes a manifest of where each image ended up, which folders group into animations and the
+# physics flags of every image. At runtime the pages are loaded once and images are handed out as subsurfaces, so
+# startup is a couple of decodes instead of one file open and decode per sprite. Any folder that changed since the
+# build (or a missing manifest) falls back to the loose files.
+#
+# Physics flags are declared in PHYSICS_NAME in the image directory: folder -> {part of a file name, or '*' for every
+# image in the folder: [flags]}, i.e. {"Tilesets/decor": {"pipe": ["solid"]}} makes the pipes collide.
+
+ATLAS_PATH = 'data/atlas/'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 2
+PHYSICS_NAME = 'physics.json'
+PAGE_SIZE = 1024 # Width and height of each atlas page
+MAX_SPRITE_SIZE = 256 # Folders with bigger images than this (sprite sheets, references) are left as loose files
+PADDING = 1 # Empty pixels between packed images
+
+# Names of the images in a folder, the same way load_images lists them (sorted, skipping hidden files)
+def folder_names(path):
+    return sorted(name for name in os.listdir(path) if name[0] != '.')
+
+# File names, sizes and modification times of a folder, used to tell when the atlas is out of date
+def folder_signature(path):
+    signature = []
+    for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+        if entry.name[0] != '.':
+            stat = entry.stat()
+            signature.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+# Size and modification time of a file, or None if it doesn't exist
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+# The physics declarations in an image directory, {} if it has none
+def load_physics(img_path):
+    try:
+        f = open(img_path + PHYSICS_NAME, 'r')
+    except FileNotFoundError:
+        return {}
+    declarations = json.load(f)
+    f.close()
+    return declarations
+
+# Sorted physics flags of each of a folder's images (by file name), from the declarations
+def physics_flags(declarations, path, names):
+    rules = declarations.get(path, {})
+    return [sorted(set(flag for part, flags in rules.items() if part == '*' or part.lower() in name.lower() for flag in flags)) for name in names]
+
+class Atlas:
+
+    def __init__(self, img_path, atlas_path=ATLAS_PATH):
+        """
+        Args: img_path - directory the loose images live in (folder names in the manifest are relative to it)
+              atlas_path - directory holding the atlas pages and the manifest
+        """
+        self.img_path = img_path
+        self.atlas_path = atlas_path
+        self.manifest = None # Loaded on first use. False if there is no usable manifest
+        self.pages = {} # Page index -> loaded Surface
+        self.fresh = {} # Folder -> whether its manifest entry still matches the files on disk
+        self.physics_fresh = None # Whether the physics declarations are the ones the manifest was built from
+        self.declarations = None # Physics declarations, only read when the manifest's flags can't be used
+
+    def load_manifest(self):
+        if self.manifest is None:
+            try:
+                f = open(self.atlas_path + MANIFEST_NAME, 'r')
+                manifest = json.load(f)
+                f.close()
+                self.manifest = manifest if manifest.get('version') == MANIFEST_VERSION else False
+            except (FileNotFoundError, ValueError):
+                self.manifest = False
+        return self.manifest
+
+    # Manifest entry for a folder, or None if it isn't in the atlas or the files changed since the atlas was built
+    def folder(self, path):
+        manifest = self.load_manifest()
+        if not manifest or path not in manifest['folders']:
+            return None
+
+        entry = manifest['folders'][path]
+        if path not in self.fresh:
+            try:
+                self.fresh[path] = folder_signature(self.img_path + path) == entry['signature']
+            except FileNotFoundError:
+                self.fresh[path] = False
+        return entry if self.fresh[path] else None
+
+    def page(self, index):
+        if index not in self.pages:
+            self.pages[index] = pygame.image.load(self.atlas_path + self.manifest['pages'][index]).convert_alpha()
+        return self.pages[index]
+
+    # Images of a folder as subsurfaces of the atlas pages, or None if the folder has to be loaded from the loose files
+    def images(self, path, colorkey=None):
+        entry = self.folder(path)
+        if entry is None:
+            return None
+
+        images = []
+        for page, x, y, w, h in entry['frames']:
+            img = self.page(page).subsurface((x, y, w, h))
+            img.set_colorkey(colorkey)
+            images.append(img)
+        return images
+
+    # Image file names of a folder, or None if the folder isn't in the atlas (or is stale)
+    def names(self, path):
+        entry = self.folder(path)
+        return None if entry is None else [name for name, size, mtime in entry['signature']]
+
+    # Physics flags of each image of a folder (lists of strings, i.e. ['solid']). Read from the manifest, or worked out
+    # from the declarations when the folder isn't in the atlas or the folder or declarations changed since it was built
+    def physics(self, path):
+        entry = self.folder(path)
+        if entry is not None:
+            if self.physics_fresh is None:
+                self.physics_fresh = file_signature(self.img_path + PHYSICS_NAME) == self.manifest['physics']
+            if self.physics_fresh:
+                return entry['physics']
+
+        if self.declarations is None:
+            self.declarations = load_physics(self.img_path)
+        return physics_flags(self.declarations, path, folder_names(self.img_path + path))
+
+    # Names of the animation folders grouped under a folder (i.e. 'idle', 'run' under 'Characters/player'), or None if unknown or stale
+    def groups(self, path):
+        manifest = self.load_manifest()
+        if not manifest or path not in manifest['groups']:
+            return None
+
+        group = manifest['groups'][path]
+        try:
+            if os.stat(self.img_path + path).st_mtime_ns != group['mtime']: # Folders were added, removed or renamed
+                return None
+        except FileNotFoundError:
+            return None
+        return group['folders']
+
+# Pack every sprite folder under img_path into atlas pages and write the manifest
+def build(img_path, atlas_path=ATLAS_PATH):
+    # Find the folders that can be packed: every entry an image, none of them too big
+    folders = {}
+    groups = {}
+    for root, dirs, files in os.walk(img_path):
+        dirs[:] = sorted(d for d in dirs if d[0] != '.')
+        path = os.path.relpath(root, img_path).replace(os.sep, '/')
+        if path == '.':
+            continue
+        if dirs: # Folders sitting next to each other under one parent are the actions of an animated asset
+            groups[path] = {'mtime': os.stat(root).st_mtime_ns, 'folders': list(dirs)}
+            continue
+
+        names = folder_names(root)
+        if not names or not all(name.lower().endswith('.png') for name in names):
+            continue
+        images = [pygame.image.load(os.path.join(root, name)) for name in names]
+        if any(max(img.get_size()) > MAX_SPRITE_SIZE for img in images):
+            continue
+        folders[path] = images
+
+    # Shelf packing: tallest images first, left to right in rows, a new page when a page is full
+    sprites = sorted(((img.get_height(), img.get_width(), path, i) for path in folders for i, img in enumerate(folders[path])), reverse=True)
+    frames = {path: [None] * len(folders[path]) for path in folders}
+    pages = []
+    x = y = shelf = PAGE_SIZE # Forces a new page for the first sprite
+    for h, w, path, i in sprites:
+        if x + w > PAGE_SIZE:
+            x, y, shelf = 0, y + shelf + PADDING, h
+        if y + h > PAGE_SIZE:
+            pages.append(pygame.Surface((PAGE_SIZE, PAGE_SIZE), pygame.SRCALPHA))
+            x, y, shelf = 0, 0, h
+        pages[-1].blit(folders[path][i], (x, y), special_flags=pygame.BLEND_RGBA_MAX) # Copies the pixels as they are (alpha included) onto the empty page
+        frames[path][i] = [len(pages) - 1, x, y, w, h]
+        x += w + PADDING
+
+    os.makedirs(atlas_path, exist_ok=True)
+    page_names = []
+    for i, page in enumerate(pages):
+        page_names.append('atlas_{:02d}.png'.format(i))
+        pygame.image.save(page, atlas_path + page_names[-1])
+
+    declarations = load_physics(img_path)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'pages': page_names,
+        'folders': {path: {'signature': folder_signature(img_path + path), 'frames': frames[path],
+                           'physics': physics_flags(declarations, path, folder_names(img_path + path))} for path in folders},
+        'groups': groups,
+        'physics': file_signature(img_path + PHYSICS_NAME)
+    }
+    f = open(atlas_path + MANIFEST_NAME, 'w')
+    json.dump(manifest, f)
+    f.close()
+
+    return len(folders), len(sprites), len(pages)
@@ -1,54 +1,95 @@
 import pygame, random
+from scripts.renderer import BACKGROUND
 
-class Cloud:
+# Parallax background. Everything at the same depth (clouds, far off scenery) is baked into one strip surface that repeats
+# horizontally, so each layer costs one or two blits per frame however many clouds are on it
 
-    def __init__(self, pos, img, speed, depth):
-        self.pos = list(pos)
-        self.img = img
-        self.speed = speed
+CLOUD_LAYERS = 3 # Layers the clouds are spread over
+CLOUD_DEPTHS = (0.2, 0.8) # Closest and furthest cloud layer scroll factors
+CLOUD_SPEEDS = (0.05, 0.35) # Range of cloud drift speeds, in pixels per tick
+STRIP_WIDTH = 2 # Width of a layer's strip, in display widths
+
+class ParallaxLayer:
+
+    def __init__(self, surf, y, depth, speed=0):
+        """
+        Args: surf - strip with everything on the layer baked in. Repeats horizontally, must be at least as wide as the display
+              y - height the top of the strip sits at when the camera is at 0
+              depth - how much the layer moves with the camera (0 stays put, 1 moves with the map)
+              speed - how fast the layer drifts by itself, in pixels per tick
+        """
+        self.surf = surf
+        self.y = y
         self.depth = depth
-        
+        self.speed = speed
+        self.drift = 0
+
     def update(self):
-        self.pos[0] += self.speed
-
-    def render(self, surface, offset=(0, 0)):
-        # Want to render so that it loops. Get render position and modulo by the display width + img width, for looping effect
-        render_pos = (self.pos[0] - offset[0] * self.depth, self.pos[1] - offset[1] * self.depth)
-        
-        surface.blit(self.img, (render_pos[0] % (surface.get_width() + self.img.get_width()) - self.img.get_width(),
-                                  render_pos[1] % (surface.get_height() + self.img.get_height()) - self.img.get_height()))
-        
-class Clouds:
-
-    def __init__(self, game, images, count=5):
+        self.drift = (self.drift + self.speed) % self.surf.get_width()
+
+    def draw(self, renderer, offset=(0, 0)):
+        width = self.surf.get_width()
+        x = (self.drift - offset[0] * self.depth) % width
+        y = self.y - offset[1] * self.depth
+        renderer.draw(self.surf, (x - width, y), layer=BACKGROUND)
+        if x < renderer.surface.get_width(): # The strip's left edge is on screen, draw the next repeat after it
+            renderer.draw(self.surf, (x, y), layer=BACKGROUND)
+
+class Parallax:
+
+    def __init__(self, game, seed=None):
         self.game = game
-        self.images = images
- 
-        self.clouds = []
-        for i in range(count):
-            depth = random.random() * 0.6 + 0.2 # Range from 0.2 to 0.8
-            speed = random.random() * 0.3 + 0.05 # Range from 0.05 to 0.1
-            
-            # If there is more than one cloud image
-            if hasattr(self.images, '__iter__'):
-                img = random.choice(self.images)
-            else: # If only one cloud image
-                img = self.images
-
-            pos = (random.random() * 99999, random.random() * (self.game.display.get_height() - 2 * self.game.tilemap.tilesize))
-            self.clouds.append(Cloud(pos, img, speed, depth))
-
-        self.clouds.sort(key=lambda x: x.depth, reverse=True) # Sorting clouds. Sort by depth to layer it properly
+        self.random = random.Random(seed) # Own generator, so the same seed always lays the sky out the same way
+        self.layers = [] # Furthest away first
 
-    def update(self):
-        for cloud in self.clouds:
-            cloud.update()
-    
-    def render(self, surface, offset=(0, 0)):
-        for cloud in self.clouds:
-            cloud.render(surface, offset=offset)
+    # Bake images placed at (x, y) strip positions into a strip the given width, wrapping anything hanging off the right
+    # edge around to the left so the strip repeats seamlessly, and add it as a layer
+    def add_layer(self, placements, width, depth, speed=0):
+        if not placements:
+            return None
+
+        top = min(y for img, x, y in placements)
+        bottom = max(y + img.get_height() for img, x, y in placements)
+        surf = pygame.Surface((width, bottom - top), pygame.SRCALPHA)
+        for img, x, y in placements:
+            surf.blit(img, (x, y - top))
+            if x + img.get_width() > width:
+                surf.blit(img, (x - width, y - top))
+
+        layer = ParallaxLayer(surf.convert_alpha(), top, depth, speed)
+        self.layers.append(layer)
+        self.layers.sort(key=lambda x: x.depth) # Far layers get drawn first
+        return layer
 
+    # Scatter count clouds over the sky, spread across a number of layers between the furthest and closest cloud depths
+    def add_clouds(self, images, count=10, layers=CLOUD_LAYERS):
+        display = self.game.display
+        width = display.get_width() * STRIP_WIDTH
+        for i in range(layers):
+            depth = CLOUD_DEPTHS[0] + (CLOUD_DEPTHS[1] - CLOUD_DEPTHS[0]) * (i + 0.5) / layers
+            speed = self.random.random() * (CLOUD_SPEEDS[1] - CLOUD_SPEEDS[0]) + CLOUD_SPEEDS[0]
 
+            placements = []
+            for j in range(i, count, layers): # Clouds dealt out to the layers in turn
+                img = self.random.choice(images)
+                placements.append((img, int(self.random.random() * width), int(self.random.random() * (display.get_height() - 2 * self.game.tilemap.tilesize - img.get_height()))))
+            self.add_layer(placements, width, depth, speed)
+
+    # Repeat scenery (i.e. mountains and bushes) along a strip, bottoms lined up at y, spacing pixels apart on average
+    def add_scenery(self, images, y, depth, spacing=200):
+        width = self.game.display.get_width() * STRIP_WIDTH
+        placements = []
+        x = self.random.random() * spacing
+        while x < width:
+            img = self.random.choice(images)
+            placements.append((img, int(x), y - img.get_height()))
+            x += img.get_width() + self.random.random() * spacing
+        return self.add_layer(placements, width, depth)
+
+    def update(self):
+        for layer in self.layers:
+            layer.update()
 
-    
-        
\ No newline at end of file
+    def draw(self, renderer, offset=(0, 0)):
+        for layer in self.layers:
+            layer.draw(renderer, offset=offset)
@@ -1,13 +1,21 @@
 import pygame
+from scripts.utils import AnimationState
+from scripts.entitystore import TOUCH, STOMP_TYPES, PICKUP_TYPES
+from scripts.renderer import ENTITIES, PLAYER
 
+STOMP_BOUNCE = 3 # Upwards speed after stomping on an enemy
+STOMP_TIME = 30 # Ticks a stomped enemy stays on screen
+
+# An entity with its own update code. Its position, velocity and size live in a row of the game's EntityStore (so
+# batched code like collision queries sees it with everything else), and pos, prev_pos and velocity are views of that row
 class PhysicsEntity:
 
     def __init__ (self, game, e_type, pos, size):
         self.game = game
         self.type = e_type
-        self.pos = list(pos)
+        self.store = game.entities
+        self.index = self.store.add(pos, size, e_type=e_type, flags=TOUCH)
         self.size = size
-        self.velocity = [0, 0]
         self.collisions = {
             'up': False,
             'down': False,
@@ -15,25 +23,44 @@ class PhysicsEntity:
             'right': False
         }
         self.action = ''
+        self.animation = AnimationState()
         self.set_action('idle')
         self.flip = False
         self.anim_offset = (-2, -2)
 
+    @property
+    def pos(self):
+        return self.store.pos[self.index]
+
+    @property
+    def prev_pos(self): # Position at the start of the last simulation tick, for interpolating between ticks when rendering
+        return self.store.prev_pos[self.index]
+
+    @property
+    def velocity(self):
+        return self.store.velocity[self.index]
+
     def rect(self):
         return pygame.Rect(self.pos[0], self.pos[1], self.size[0], self.size[1])
     
+    # Position to draw at, alpha of the way from the previous tick's position to the current one
+    def render_pos(self, alpha=1.0):
+        return (self.prev_pos[0] + (self.pos[0] - self.prev_pos[0]) * alpha,
+                self.prev_pos[1] + (self.pos[1] - self.prev_pos[1]) * alpha)
+
     def set_action(self, action):
         if action != self.action:
             self.action = action
-            self.animation = self.game.assets[self.type + '/' + self.action].copy()
+            self.animation.set(self.game.assets[self.type + '/' + self.action])
 
     def update(self, tilemap, movement=(0, 0)): # Add back tilemap
-        self.collisions = {
-            'up': False,
-            'down': False,
-            'left': False,
-            'right': False
-        }
+        self.prev_pos[0] = self.pos[0]
+        self.prev_pos[1] = self.pos[1]
+
+        self.collisions['up'] = False
+        self.collisions['down'] = False
+        self.collisions['left'] = False
+        self.collisions['right'] = False
 
         # Move the entity, check for collisions
         frame_movement = (self.velocity[0] + movement[0], self.velocity[1] + movement[1])
@@ -45,32 +72,21 @@ class PhysicsEntity:
 
         # Handle movement and collisions for x and y axis separately
         #
-        # An interesting problem: If the player rect is much bigger than a tile (in the case I had a problem with, tiles are 16x16
-        # and the player rect was 32x32), then the "tiles around" won't be calculated correctly because the nearby tiles are only
-        # found around a rect with a size the same as the tile size
-        self.pos[0] += frame_movement[0]
-        entity_rect = self.rect()
-        for tile in tilemap.tile_rects_around(entity_rect.center): # Check left/right collisions
-            if entity_rect.colliderect(tile):
-                if frame_movement[0] < 0:
-                    self.collisions['left'] = True
-                    entity_rect.left = tile.right
-                if frame_movement[0] > 0:
-                    self.collisions['right'] = True
-                    entity_rect.right = tile.left
-                self.pos[0] = entity_rect.x
-
-        self.pos[1] += frame_movement[1]
-        entity_rect = self.rect()
-        for tile in tilemap.tile_rects_around(entity_rect.center): # Check top/bottom collisions
-            if entity_rect.colliderect(tile):
-                if frame_movement[1] < 0:
-                    self.collisions['up'] = True
-                    entity_rect.top = tile.bottom
-                if frame_movement[1] > 0:
-                    self.collisions['down'] = True
-                    entity_rect.bottom = tile.top
-                self.pos[1] = entity_rect.y
+        # The tilemap sweeps the whole entity box along its movement against the collision grid, so entities bigger than
+        # a tile (big Mario, 32x32 enemies) and fast movement collide properly
+        self.pos[0], hit = tilemap.sweep_x(self.pos[0], self.pos[1], self.size[0], self.size[1], frame_movement[0])
+        if hit: # Check left/right collisions
+            if frame_movement[0] < 0:
+                self.collisions['left'] = True
+            else:
+                self.collisions['right'] = True
+
+        self.pos[1], hit = tilemap.sweep_y(self.pos[0], self.pos[1], self.size[0], self.size[1], frame_movement[1])
+        if hit: # Check top/bottom collisions
+            if frame_movement[1] < 0:
+                self.collisions['up'] = True
+            else:
+                self.collisions['down'] = True
 
         self.last_movement = list(movement)
 
@@ -83,8 +99,9 @@ class PhysicsEntity:
 
         self.animation.update()
         
-    def render(self, surface, offset=(0, 0)):
-        surface.blit(pygame.transform.flip(self.animation.img(), self.flip, False), (self.pos[0] - offset[0], self.pos[1] - offset[1]))
+    def draw(self, renderer, offset=(0, 0), alpha=1.0, layer=ENTITIES):
+        pos = self.render_pos(alpha)
+        renderer.draw(self.animation.img(self.flip), (pos[0] - offset[0], pos[1] - offset[1]), layer=layer)
 
 class Player(PhysicsEntity):
 
@@ -96,6 +113,10 @@ class Player(PhysicsEntity):
         self.x_accel = 0 # Tracking variable for speedup/slowdown
         self.last_accel = 0 # Tracking variable for acceleration and turning
         self.speed = 2 # Max player speed
+        self.collected = {} # Pickup name -> how many were collected
+
+        self.store.on('player', STOMP_TYPES, self.stomp)
+        self.store.on('player', PICKUP_TYPES, self.collect)
 
     def jump(self):
         if self.jumps and self.air_time < 5:
@@ -106,6 +127,29 @@ class Player(PhysicsEntity):
         
     
     
+    # Landing on top of an enemy squashes it and bounces the player back up. Anything else about touching enemies is up to the enemy
+    def stomp(self, player, enemy):
+        store = self.store
+        if self.velocity[1] > 0 and store.prev_pos[player][1] + store.size[player][1] <= store.prev_pos[enemy][1]: # Was above it at the start of the tick
+            store.clear_flags(enemy, TOUCH)
+            store.velocity[enemy][0] = 0
+            store.set_animation(enemy, store.types[store.type[enemy]] + '/die')
+            store.timer[enemy] = STOMP_TIME
+            self.velocity[1] = -STOMP_BOUNCE
+            self.game.particles.emit('stomp', (store.pos[enemy][0], store.pos[enemy][1] + store.size[enemy][1]), (store.size[enemy][0], 0))
+
+    def collect(self, player, pickup):
+        store = self.store
+        name = store.types[store.type[pickup]]
+        self.collected[name] = self.collected.get(name, 0) + 1
+        if name == 'coin': # Coins spin away before disappearing
+            store.clear_flags(pickup, TOUCH)
+            store.set_animation(pickup, 'coin/collect')
+            store.timer[pickup] = store.animation_lengths[store.animation[pickup]]
+            self.game.particles.emit('sparkle', store.pos[pickup], store.size[pickup])
+        else:
+            store.remove(pickup)
+
     def update(self, tilemap, movement=(0, 0)):
         super().update(tilemap, movement=(self.x_accel, movement[1]))
         
@@ -142,12 +186,13 @@ class Player(PhysicsEntity):
         
         self.last_accel = self.x_accel # Tracking variable for turning 
         
-    def render(self, surface, offset=(0, 0)):
+    def draw(self, renderer, offset=(0, 0), alpha=1.0, layer=PLAYER):
         if self.action == 'idle':
-            super().render(surface, offset=offset)
+            super().draw(renderer, offset=offset, alpha=alpha, layer=layer)
         else:
+            pos = self.render_pos(alpha)
             # Because the 'turn' animation is flipped compared to the others
             if self.action == 'turn':
-                surface.blit(pygame.transform.flip(self.animation.img(), not self.flip, False), (self.pos[0] - offset[0] + self.anim_offset[0], self.pos[1] - offset[1]))
+                renderer.draw(self.animation.img(not self.flip), (pos[0] - offset[0] + self.anim_offset[0], pos[1] - offset[1]), layer=layer)
             else: 
-                surface.blit(pygame.transform.flip(self.animation.img(), self.flip, False), (self.pos[0] - offset[0] + self.anim_offset[0], self.pos[1] - offset[1]))
+                renderer.draw(self.animation.img(self.flip), (pos[0] - offset[0] + self.anim_offset[0], pos[1] - offset[1]), layer=layer)
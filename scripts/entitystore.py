@@ -0,0 +1,297 @@
+import numpy as np
+from collections import namedtuple
+from scripts.utils import Animation
+from scripts.spatialhash import SpatialHash
+from scripts.renderer import ENTITIES
+
+# Entity state kept as a struct of arrays: one NumPy array per field with a row per entity, so everything the store
+# moves itself (enemies) goes through gravity, movement and tile collisions as a handful of array operations per tick
+# instead of a Python update per entity. Entities with their own update code (the player) still get a row, which
+# their object reads and writes through properties.
+
+# Flags
+ALIVE = 1 << 0
+BATCH = 1 << 1 # Moved, animated and drawn by the store. Entities without it are updated and drawn by their own object
+GRAVITY = 1 << 2
+FLIP = 1 << 3
+UP = 1 << 4 # Collisions from the last tick
+DOWN = 1 << 5
+LEFT = 1 << 6
+RIGHT = 1 << 7
+COLLISIONS = UP | DOWN | LEFT | RIGHT
+TOUCH = 1 << 8 # Collides with other entities (see collide())
+SLEEP = 1 << 9 # Too far off screen to matter: not updated, drawn or collided with until it wakes up (see sleep())
+PATROL = 1 << 10 # Turns around at ledges instead of walking off them (see Navigation)
+CHASE = 1 << 11 # Heads for the player, jumping between platforms to get there (see Navigation)
+
+GRAVITY_ACCEL = 0.2 # Same gravity and falling speed cap as PhysicsEntity
+MAX_FALL = 5
+FALL_OUT = 4 # Tiles below the bottom of the level before a falling entity is removed
+SLEEP_MARGIN = 64 # Pixels past the edges of the screen before an entity falls asleep
+
+# Enemies by spawner variant. Speed is how fast it walks (0 stays put), gravity whether it falls, stomp whether the
+# player can stomp on it (stomped enemies play their 'die' animation), ai the behaviour flags it gets
+Enemy = namedtuple('Enemy', ['type', 'action', 'speed', 'gravity', 'stomp', 'ai'])
+ENEMIES = {
+    1: Enemy('goomba', 'walk', 0.5, True, True, 0),
+    3: Enemy('koopa', 'walk', 0.5, True, True, PATROL),
+    4: Enemy('plant', 'bite', 0, False, False, 0),
+    5: Enemy('hammerbro', 'walk', 0, True, False, CHASE),
+    6: Enemy('lakitu', 'fly', 0, False, False, 0)
+}
+ENEMY_TYPES = [enemy.type for enemy in ENEMIES.values()]
+STOMP_TYPES = [enemy.type for enemy in ENEMIES.values() if enemy.stomp]
+
+# Pickups: items by variant of the 'items' tiles, and pickups by spawner variant
+ITEMS = ['mushroom', '1up', 'flower', 'star']
+PICKUPS = {2: 'star', 7: 'coin', 8: 'mushroom', 9: '1up', 10: 'flower'}
+PICKUP_TYPES = ITEMS + ['coin']
+PICKUP_TILES = {'items', 'coin/collect'} # Offgrid tiles placed in the editor that are really pickups
+
+class EntityStore:
+
+    def __init__(self, game, capacity=64):
+        self.game = game
+        self.count = 0 # Rows in use, including removed ones waiting to be reused
+        self.free = [] # Rows of removed entities
+        self.pos = np.zeros((capacity, 2))
+        self.prev_pos = np.zeros((capacity, 2)) # Position at the start of the last tick, for interpolating when rendering
+        self.velocity = np.zeros((capacity, 2))
+        self.size = np.zeros((capacity, 2))
+        self.offset = np.zeros((capacity, 2)) # Where the sprite is drawn relative to the collision box
+        self.flags = np.zeros(capacity, np.uint16)
+        self.animation = np.zeros(capacity, np.int32) # Index into self.animations
+        self.frame = np.zeros(capacity, np.int32) # Frame of the game the animation is on
+        self.type = np.zeros(capacity, np.int16) # Index into self.types
+        self.timer = np.zeros(capacity, np.int32) # Ticks until the entity is removed, 0 for never
+        self.spawner = np.zeros(capacity, np.int32) # Index of the spawner the entity came from in the game's SpawnerIndex, -1 for none
+
+        self.animations = [] # Animation objects used by the entities, shared between every entity using them
+        self.animation_ids = {} # Asset name -> index into self.animations
+        self.animation_lengths = np.zeros(0, np.int32)
+        self.boxes = {} # Animation index -> (size, offset) of the collision box, from the first frame's visible pixels
+        self.types = [] # Entity type names
+        self.type_ids = {} # Entity type name -> index into self.types
+
+        self.hash = SpatialHash(capacity)
+        self.handlers = {} # (type index, type index) -> function called with the rows of each overlapping pair of those types
+        self.taken = set() # (type, variant, x, y) of offgrid tiles turned into pickups, so streamed columns don't add them twice
+        self.pickup_rows = {} # (type, variant, x, y) of a taken offgrid tile -> row of its pickup, while the pickup is in the store
+        self.pickup_keys = {} # The other way around
+
+    # Make every array twice as long
+    def grow(self):
+        for name in ['pos', 'prev_pos', 'velocity', 'size', 'offset', 'flags', 'animation', 'frame', 'type', 'timer', 'spawner']:
+            old = getattr(self, name)
+            new = np.zeros((len(old) * 2,) + old.shape[1:], old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    # Add an entity and return its row. Rows stay the same for as long as the entity is alive
+    def add(self, pos, size, e_type='', flags=0, velocity=(0, 0), animation=None, offset=(0, 0)):
+        if self.free:
+            i = self.free.pop()
+        else:
+            if self.count == len(self.flags):
+                self.grow()
+            i = self.count
+            self.count += 1
+
+        self.pos[i] = pos
+        self.prev_pos[i] = pos
+        self.velocity[i] = velocity
+        self.size[i] = size
+        self.offset[i] = offset
+        self.flags[i] = flags | ALIVE
+        self.animation[i] = -1 if animation is None else animation
+        self.frame[i] = 0
+        self.type[i] = self.type_id(e_type)
+        self.timer[i] = 0
+        self.spawner[i] = -1
+        return i
+
+    def remove(self, i):
+        self.flags[i] = 0
+        self.free.append(i)
+        key = self.pickup_keys.pop(i, None)
+        if key is not None:
+            del self.pickup_rows[key]
+
+    def clear_flags(self, i, flags):
+        self.flags[i] &= ~np.uint16(flags)
+
+    def type_id(self, e_type):
+        if e_type not in self.type_ids:
+            self.type_ids[e_type] = len(self.types)
+            self.types.append(e_type)
+        return self.type_ids[e_type]
+
+    # Index of an animation asset in self.animations, loading it the first time. With a variant, a still image out of an
+    # image group (i.e. one of the items) is used as a one frame animation
+    def animation_id(self, name, variant=None):
+        key = name if variant is None else (name, variant)
+        if key not in self.animation_ids:
+            self.animation_ids[key] = len(self.animations)
+            self.animations.append(self.game.assets[name] if variant is None else Animation([self.game.assets[name][variant]]))
+            self.animation_lengths = np.append(self.animation_lengths, self.animations[-1].length).astype(np.int32)
+        return self.animation_ids[key]
+
+    # Collision box of an animation: the size and offset of the visible part of its first frame (enemy sprites have empty space around them)
+    def box(self, animation):
+        if animation not in self.boxes:
+            rect = self.animations[animation].images[0].get_bounding_rect()
+            self.boxes[animation] = ((rect.width, rect.height), (-rect.x, -rect.y))
+        return self.boxes[animation]
+
+    # Switch an entity to another animation from the start
+    def set_animation(self, i, name):
+        self.animation[i] = self.animation_id(name)
+        self.frame[i] = 0
+
+    # Call handler(a, b) every tick for each overlapping pair of entities with types in types_a and types_b (names or lists of names)
+    def on(self, types_a, types_b, handler):
+        for type_a in ([types_a] if isinstance(types_a, str) else types_a):
+            for type_b in ([types_b] if isinstance(types_b, str) else types_b):
+                self.handlers[(self.type_id(type_a), self.type_id(type_b))] = handler
+
+    # Add the enemy or pickup for a spawner tile and return its row, or None for spawners that aren't either (the player).
+    # Enemies stand on the bottom of their tile
+    def spawn(self, spawner):
+        tilesize = self.game.tilemap.tilesize
+        x, y = spawner['pos'][0] * tilesize, spawner['pos'][1] * tilesize
+        if spawner['variant'] in PICKUPS:
+            return self.add_pickup(PICKUPS[spawner['variant']], (x, y))
+
+        enemy = ENEMIES.get(spawner['variant'])
+        if enemy is None:
+            return None
+
+        animation = self.animation_id(enemy.type + '/' + enemy.action)
+        size, offset = self.box(animation)
+        return self.add((x, y + tilesize - size[1]), size, e_type=enemy.type, flags=BATCH | TOUCH | (GRAVITY if enemy.gravity else 0) | enemy.ai,
+                        velocity=(-enemy.speed, 0), animation=animation, offset=offset)
+
+    def add_pickup(self, name, pos):
+        animation = self.animation_id('coin/idle') if name == 'coin' else self.animation_id('items', ITEMS.index(name))
+        size, offset = self.box(animation)
+        return self.add((pos[0] - offset[0], pos[1] - offset[1]), size, e_type=name, flags=BATCH | TOUCH, animation=animation, offset=offset)
+
+    # Turn pickup tiles placed as offgrid decor (items and coins) into pickups, taking them out of the tilemap. Ones placed
+    # inside a block are left alone, they're what the block holds
+    def take_pickups(self, tilemap, tiles):
+        taken = set()
+        for tile in tiles:
+            if tile['type'] not in PICKUP_TILES:
+                continue
+            img = tilemap.image(tile['type'], tile['variant'])
+            if tilemap.is_solid(int(tile['pos'][0] + img.get_width() / 2) // tilemap.tilesize, int(tile['pos'][1] + img.get_height() / 2) // tilemap.tilesize):
+                continue
+
+            tilemap.remove_offgrid(tile)
+            key = (tile['type'], tile['variant'], tile['pos'][0], tile['pos'][1])
+            if key not in self.taken: # Not already added (or collected) the last time its column was streamed in
+                row = self.add_pickup('coin' if tile['type'] == 'coin/collect' else ITEMS[tile['variant']], tile['pos'])
+                self.pickup_rows[key] = row
+                self.pickup_keys[row] = key
+                taken.add(key)
+        self.taken |= taken
+
+    # Take the pickups of offgrid tiles whose streamed column was dropped back out of the store, so a long level doesn't
+    # pile them up, and let the column turn them into pickups again when it comes back. Collected ones stay gone
+    def drop_pickups(self, tiles):
+        for tile in tiles:
+            key = (tile['type'], tile['variant'], tile['pos'][0], tile['pos'][1])
+            row = self.pickup_rows.get(key)
+            if row is not None and self.flags[row] & TOUCH: # Coins still spinning away have been collected already
+                self.remove(row)
+                self.taken.discard(key)
+
+    # Put every BATCH entity further than SLEEP_MARGIN outside the pixel columns left to right to sleep, and wake up the
+    # ones back inside. The sleeping ones stop where they are, so whatever the player hasn't reached yet waits for them
+    def sleep(self, left, right):
+        idx = np.flatnonzero(self.flags[:self.count] & BATCH)
+        if not len(idx):
+            return
+        x = self.pos[idx, 0]
+        asleep = (x + self.size[idx, 0] < left - SLEEP_MARGIN) | (x > right + SLEEP_MARGIN)
+        self.flags[idx] = np.where(asleep, self.flags[idx] | SLEEP, self.flags[idx] & ~np.uint16(SLEEP)).astype(np.uint16)
+
+    # Update the spatial hash with every TOUCH entity that's awake and call the handlers of the pairs that overlap
+    def collide(self):
+        ids = np.flatnonzero((self.flags[:self.count] & (TOUCH | SLEEP)) == TOUCH)
+        self.hash.update(ids, np.concatenate((self.pos[ids], self.size[ids]), axis=1))
+        if not self.handlers:
+            return
+
+        actors = np.array(sorted(set(key[0] for key in self.handlers)), np.int16) # Types on the left of a handler, every handled pair involves one of them
+        pairs = self.hash.pairs(ids[np.isin(self.type[ids], actors)].tolist())
+        types = self.type[:self.count].tolist() if pairs else []
+        for a, b in pairs:
+            if not (self.flags[a] & self.flags[b] & TOUCH): # One of them was taken out by an earlier pair this tick
+                continue
+            handler = self.handlers.get((types[a], types[b]))
+            if handler is not None:
+                handler(a, b)
+            else:
+                handler = self.handlers.get((types[b], types[a]))
+                if handler is not None:
+                    handler(b, a)
+
+    # One tick for every BATCH entity that's awake: move along x then y with tile collisions, apply gravity, turn walkers around at walls, animate
+    def update(self, tilemap):
+        idx = np.flatnonzero((self.flags[:self.count] & (BATCH | SLEEP)) == BATCH)
+        if not len(idx):
+            return
+
+        pos = self.pos[idx]
+        velocity = self.velocity[idx]
+        size = self.size[idx]
+        flags = self.flags[idx] & ~np.uint16(COLLISIONS)
+        self.prev_pos[idx] = pos
+
+        pos[:, 0], hit = tilemap.sweep_batch(0, pos, size, velocity[:, 0])
+        flags |= np.where(hit, np.where(velocity[:, 0] < 0, LEFT, RIGHT), 0).astype(np.uint16)
+        pos[:, 1], hit = tilemap.sweep_batch(1, pos, size, velocity[:, 1])
+        flags |= np.where(hit, np.where(velocity[:, 1] < 0, UP, DOWN), 0).astype(np.uint16)
+
+        # Gravity, then stop falling (or rising) on hitting something
+        falls = (flags & GRAVITY) != 0
+        velocity[:, 1] = np.where(falls, np.minimum(MAX_FALL, velocity[:, 1] + GRAVITY_ACCEL), velocity[:, 1])
+        velocity[:, 1] = np.where((flags & (UP | DOWN)) != 0, 0, velocity[:, 1])
+
+        # Walk the other way after bumping into a wall. Enemy sprites face left, so they're flipped while walking right
+        velocity[:, 0] = np.where((flags & (LEFT | RIGHT)) != 0, -velocity[:, 0], velocity[:, 0])
+        flags = np.where(velocity[:, 0] > 0, flags | FLIP, np.where(velocity[:, 0] < 0, flags & ~np.uint16(FLIP), flags)).astype(np.uint16)
+
+        self.pos[idx] = pos
+        self.velocity[idx] = velocity
+        self.flags[idx] = flags
+
+        animated = idx[self.animation[idx] >= 0]
+        self.frame[animated] = (self.frame[animated] + 1) % self.animation_lengths[self.animation[animated]]
+
+        # Remove whatever fell out of the bottom of the level or ran out of time
+        timed = self.timer[idx] > 0
+        self.timer[idx[timed]] -= 1
+        for i in idx[(pos[:, 1] > (tilemap.bounds[3] + FALL_OUT) * tilemap.tilesize) | (timed & (self.timer[idx] == 0))]:
+            self.remove(i)
+
+    # Push every BATCH entity that's awake and on screen onto a Renderer in one batch, interpolated alpha of the way between the last two ticks
+    def draw(self, renderer, offset=(0, 0), alpha=1.0):
+        idx = np.flatnonzero((self.flags[:self.count] & (BATCH | SLEEP)) == BATCH)
+        idx = idx[self.animation[idx] >= 0]
+        if not len(idx):
+            return
+
+        prev = self.prev_pos[idx]
+        pos = prev + (self.pos[idx] - prev) * alpha + self.offset[idx] - offset
+        margin = 2 * self.size[idx] # Sprites can be bigger than their collision box
+        width, height = renderer.surface.get_size()
+        visible = (pos[:, 0] > -margin[:, 0]) & (pos[:, 0] < width) & (pos[:, 1] > -margin[:, 1]) & (pos[:, 1] < height)
+
+        animations = self.animations
+        blits = []
+        for animation, frame, flags, x, y in zip(self.animation[idx][visible].tolist(), self.frame[idx][visible].tolist(), self.flags[idx][visible].tolist(),
+                                                 pos[visible, 0].tolist(), pos[visible, 1].tolist()):
+            blits.append((animations[animation].img(frame, (flags & FLIP) != 0), (x, y)))
+        renderer.draw_batch(blits, layer=ENTITIES)
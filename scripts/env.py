@@ -0,0 +1,98 @@
+import random
+import numpy as np
+import pygame
+from scripts.entitystore import FALL_OUT
+from scripts.recording import LEFT, RIGHT, JUMP
+from scripts.observation import TileObserver
+
+# Step/reset environment around a headless Game, for training agents. An action is the same input bits a recording
+# stores (LEFT | RIGHT | JUMP, so 0 to 7), held for FRAME_SKIP ticks with the jump pressed on the first of them. The
+# observation is either the frame the player would see, or with observation='tiles' the TileObserver's grid of tile
+# classes around the player, which skips rendering altogether. The reward is mostly for getting further right than ever
+# before in the episode. An episode ends when the player falls out of the level, gets to the end of it, or runs out of time.
+
+FRAME_SKIP = 4 # Ticks per step. Only the last one gets rendered
+MAX_TICKS = 60 * 60 * 3 # Episode length limit, 3 minutes of game time
+ACTIONS = 8 # Every combination of the input bits
+END_TILES = 3 # How close to the right edge of the level (in tiles) counts as getting to the end
+
+# Rewards
+PROGRESS_REWARD = 1 # Per tile further right than the episode got before
+COLLECT_REWARD = 1 # Per pickup collected
+FINISH_REWARD = 50
+FALL_REWARD = -25
+
+class GameEnv:
+
+    def __init__(self, map_path=None, seed=0, streaming=False, frame_skip=FRAME_SKIP, max_ticks=MAX_TICKS, observation='pixels'):
+        """
+        Args: map_path - level to play, or None for the game's default
+              seed - seed for the sequence of episode seeds, so a run of episodes repeats exactly
+              streaming - stream binary (.lvl) levels instead of loading them whole
+              frame_skip - ticks per step
+              max_ticks - ticks before an episode is cut off
+              observation - 'pixels' for the rendered frame, 'tiles' for the grid of tile classes around the player
+        """
+        from MarioGame import Game, MAP_PATH
+
+        self.game = Game(map_path=map_path or MAP_PATH, headless=True, streaming=streaming, seed=seed)
+        self.game.lockstep = True # Streamed chunks arrive on the same tick every time, so episodes repeat exactly
+        self.random = random.Random(seed)
+        self.frame_skip = frame_skip
+        self.max_ticks = max_ticks
+        if observation == 'tiles':
+            self.observer = TileObserver(self.game)
+            self.observation_shape = self.observer.out.shape
+        elif observation == 'pixels':
+            self.observer = None
+            width, height = self.game.display.get_size()
+            self.observation_shape = (height, width, 3)
+        else:
+            raise ValueError('Unknown observation {!r}'.format(observation))
+        self.observation_dtype = np.dtype(np.uint8)
+        self.furthest = 0 # Furthest right the player got this episode, in pixels
+        self.collected = 0
+
+    # Start a new episode and return its first observation
+    def reset(self):
+        self.game.reset(seed=self.random.randrange(1 << 32))
+        self.furthest = float(self.game.player.pos[0])
+        self.collected = 0
+        return self.observe()
+
+    # Copy of the display as a (height, width, 3) array, or of the tile classes as a (rows, columns) one
+    def observe(self):
+        if self.observer is not None:
+            return self.observer.observe().copy()
+        self.game.render()
+        return pygame.surfarray.pixels3d(self.game.display).transpose(1, 0, 2).copy()
+
+    # Run one action. Returns (observation, reward, done, info). After done, call reset() before stepping again
+    def step(self, action):
+        game = self.game
+        tilemap = game.tilemap
+        game.movement[0] = (action & LEFT) != 0
+        game.movement[1] = (action & RIGHT) != 0
+        game.jump_queued = (action & JUMP) != 0
+
+        fell = finished = False
+        for tick in range(self.frame_skip):
+            game.update()
+            fell = bool(game.player.pos[1] > (tilemap.bounds[3] + FALL_OUT) * tilemap.tilesize)
+            finished = bool(game.player.pos[0] + game.player.size[0] >= (tilemap.bounds[2] - END_TILES) * tilemap.tilesize)
+            if fell or finished:
+                break
+
+        reward = max(0.0, float(game.player.pos[0] - self.furthest)) / tilemap.tilesize * PROGRESS_REWARD
+        self.furthest = max(self.furthest, float(game.player.pos[0]))
+        collected = sum(game.player.collected.values())
+        reward += (collected - self.collected) * COLLECT_REWARD
+        self.collected = collected
+        if finished:
+            reward += FINISH_REWARD
+        if fell:
+            reward += FALL_REWARD
+
+        done = fell or finished or game.tick >= self.max_ticks
+        info = {'tick': game.tick, 'x': float(game.player.pos[0]), 'collected': collected, 'fell': fell, 'finished': finished}
+        return self.observe(), reward, done, info
@@ -0,0 +1,145 @@
+import multiprocessing, traceback
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+
+# Runs a batch of GameEnvs, one per worker process, and steps them all at once. The observations, rewards, done flags and
+# actions of the whole batch live in shared memory: workers write their results straight into their slot and the pipes
+# only carry short commands and acknowledgements, so nothing big gets pickled. Workers are spawned rather than forked,
+# so each one starts its own pygame instead of inheriting the parent's. Episodes that end are reset in the worker right
+# away, so the observation returned for a done env is already the first one of its next episode.
+#
+# Usage:
+#   with EnvPool(8, map_path='maps/level_01.json') as pool:
+#       observations = pool.reset()
+#       observations, rewards, dones = pool.step(actions)
+
+# Runs in a worker process: build the env, report its observation layout, attach to the shared arrays, then follow commands
+def worker(conn, index, count, seed, env_kwargs):
+    from scripts.env import GameEnv
+
+    blocks = []
+    try:
+        env = GameEnv(seed=seed, **env_kwargs)
+        conn.send((env.observation_shape, env.observation_dtype.str))
+        blocks = [SharedMemory(name) for name in conn.recv()]
+        observations = np.ndarray((count,) + env.observation_shape, env.observation_dtype, buffer=blocks[0].buf)
+        rewards = np.ndarray(count, np.float32, buffer=blocks[1].buf)
+        dones = np.ndarray(count, bool, buffer=blocks[2].buf)
+        actions = np.ndarray(count, np.uint8, buffer=blocks[3].buf)
+        conn.send(None)
+
+        while True:
+            command = conn.recv()
+            if command == 'reset':
+                observations[index] = env.reset()
+            elif command == 'step':
+                observation, reward, done, info = env.step(int(actions[index]))
+                observations[index] = env.reset() if done else observation
+                rewards[index] = reward
+                dones[index] = done
+            elif command == 'close':
+                break
+            conn.send(None)
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception:
+        conn.send(traceback.format_exc())
+    finally:
+        for block in blocks:
+            block.close()
+        conn.close()
+
+class EnvPool:
+
+    def __init__(self, count, seed=0, **env_kwargs):
+        """
+        Args: count - how many envs (and worker processes) to run
+              seed - env i is seeded with seed + i
+              env_kwargs - passed on to every GameEnv (map_path, streaming, frame_skip, max_ticks)
+        """
+        self.count = count
+        self.blocks = []
+        self.pipes = []
+        self.processes = []
+        context = multiprocessing.get_context('spawn')
+        for i in range(count):
+            parent, child = context.Pipe()
+            process = context.Process(target=worker, args=(child, i, count, seed + i, env_kwargs), daemon=True)
+            process.start()
+            child.close()
+            self.pipes.append(parent)
+            self.processes.append(process)
+
+        try:
+            shape, dtype = self.wait()[0]
+            dtype = np.dtype(dtype)
+            for size in [count * int(np.prod(shape)) * dtype.itemsize, count * 4, count, count]:
+                self.blocks.append(SharedMemory(create=True, size=size))
+            self.observations = np.ndarray((count,) + tuple(shape), dtype, buffer=self.blocks[0].buf)
+            self.rewards = np.ndarray(count, np.float32, buffer=self.blocks[1].buf)
+            self.dones = np.ndarray(count, bool, buffer=self.blocks[2].buf)
+            self.actions = np.ndarray(count, np.uint8, buffer=self.blocks[3].buf)
+            self.send([block.name for block in self.blocks])
+            self.wait()
+        except BaseException:
+            self.close()
+            raise
+
+    def send(self, message):
+        for pipe in self.pipes:
+            pipe.send(message)
+
+    # Every worker's reply, raising if any of them failed
+    def wait(self):
+        replies = []
+        for i, pipe in enumerate(self.pipes):
+            try:
+                reply = pipe.recv()
+            except EOFError:
+                raise RuntimeError('env worker {} exited'.format(i))
+            if isinstance(reply, str):
+                raise RuntimeError('env worker {} failed:\n{}'.format(i, reply))
+            replies.append(reply)
+        return replies
+
+    # Start new episodes in every env. Returns the (count, height, width, 3) observations
+    def reset(self):
+        self.send('reset')
+        self.wait()
+        return self.observations
+
+    # Run one action per env. Returns (observations, rewards, dones). They're the shared arrays themselves, so they get
+    # overwritten by the next step: copy them to keep them around
+    def step(self, actions):
+        self.actions[:] = actions
+        self.send('step')
+        self.wait()
+        return self.observations, self.rewards, self.dones
+
+    def close(self):
+        for pipe, process in zip(self.pipes, self.processes):
+            if process.is_alive():
+                try:
+                    pipe.send('close')
+                except (BrokenPipeError, OSError):
+                    pass
+        for pipe, process in zip(self.pipes, self.processes):
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            pipe.close()
+        self.pipes = []
+        self.processes = []
+
+        # Drop the views before releasing the memory under them
+        self.observations = self.rewards = self.dones = self.actions = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,203 @@
+import json, math, os, time
+
+# Edit journal for the map editor. Every change to the map (placing or removing an on grid tile, an offgrid tile or a
+# spawner) is an operation that sets one thing to a new state, and gets appended to a journal file next to the map
+# instead of rewriting the whole map. Operations that wouldn't change anything (holding the mouse down on the same tile)
+# are dropped, and repeated changes to the same thing are coalesced before they're written. Autosaving only appends
+# what's new. Every so often the journal gets compacted: the map is written out whole and the journal starts over.
+# Operations only ever set state, so replaying a journal over a map it was already compacted into changes nothing.
+#
+# The same operations, paired with their inverses, make up the undo and redo history.
+
+JOURNAL_EXT = '.journal'
+AUTOSAVE_INTERVAL = 2 # Seconds between appending new operations to the journal file
+COMPACT_ENTRIES = 5000 # Operations in the journal file before it gets compacted into the map
+UNDO_LEVELS = 200 # Undo steps kept
+
+# Copy of a tile with only the fields that get saved
+def tile_record(tile, ongrid=True):
+    if tile is None:
+        return None
+    pos = [int(tile['pos'][0]), int(tile['pos'][1])] if ongrid else [float(tile['pos'][0]), float(tile['pos'][1])]
+    return {'type': tile['type'], 'variant': tile['variant'], 'pos': pos}
+
+class Journal:
+
+    def __init__(self, tilemap, path):
+        """
+        Args: tilemap - map being edited
+              path - where the map is saved. The journal goes next to it, with JOURNAL_EXT added
+        """
+        self.tilemap = tilemap
+        self.path = path
+        self.journal_path = path + JOURNAL_EXT
+        self.pending = [] # Operations not written to the journal file yet
+        self.written = 0 # Operations in the journal file
+        self.last_flush = time.monotonic()
+        self.group = [] # (operation, inverse) pairs of the undo step in progress
+        self.undo_stack = []
+        self.redo_stack = []
+
+    # Replay the operations of a journal left behind by an editor that didn't get to save (i.e. it crashed). Returns how many were applied
+    def recover(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        f = open(self.journal_path, 'r')
+        lines = f.readlines()
+        f.close()
+
+        applied = 0
+        for line in lines:
+            try:
+                op = json.loads(line)
+            except ValueError: # Half written last line
+                break
+            self.apply(op)
+            applied += 1
+        self.written = applied
+        return applied
+
+    # Key of the thing an operation changes. Operations with different keys don't affect each other
+    def key(self, op):
+        if op['op'] == 'offgrid':
+            tile = op['tile']
+            return ('offgrid', tile['type'], tile['variant'], tile['pos'][0], tile['pos'][1])
+        return (op['op'], op['pos'][0], op['pos'][1])
+
+    # The offgrid tiles in the map exactly matching a tile record (maps can have the same tile stacked more than once)
+    def find_offgrid(self, record):
+        x, y = math.floor(record['pos'][0]), math.floor(record['pos'][1])
+        return [tile for tile in self.tilemap.offgrid_in_rect((x - 1, y - 1, 3, 3)) if tile_record(tile, ongrid=False) == record]
+
+    # Current state of what an operation changes, in the form the operation would set it to
+    def state(self, op):
+        if op['op'] == 'tile':
+            return tile_record(self.tilemap.tile_at(op['pos'][0], op['pos'][1]))
+        if op['op'] == 'spawner':
+            return tile_record(self.tilemap.spawners.get(str(op['pos'][0]) + ';' + str(op['pos'][1])))
+        return len(self.find_offgrid(op['tile']))
+
+    def apply(self, op):
+        tilemap = self.tilemap
+        if op['op'] == 'tile':
+            if op['tile'] is None:
+                tilemap.remove_tile(op['pos'][0], op['pos'][1])
+            else:
+                tilemap.set_tile(dict(op['tile']))
+        elif op['op'] == 'spawner':
+            key = str(op['pos'][0]) + ';' + str(op['pos'][1])
+            if op['tile'] is None:
+                tilemap.spawners.pop(key, None)
+            else:
+                tilemap.spawners[key] = dict(op['tile'])
+        else:
+            tiles = self.find_offgrid(op['tile'])
+            for i in range(len(tiles), op['count']):
+                tilemap.add_offgrid(dict(op['tile']))
+            for tile in tiles[op['count']:]:
+                tilemap.remove_offgrid(tile)
+
+    # Apply an operation as part of the current undo step. Returns False (and does nothing) if it wouldn't change anything
+    def change(self, op):
+        old = self.state(op)
+        field = 'count' if op['op'] == 'offgrid' else 'tile'
+        if old == op[field]:
+            return False
+
+        inverse = dict(op)
+        inverse[field] = old
+        self.apply(op)
+        self.group.append((op, inverse))
+        self.pending.append(op)
+        self.redo_stack.clear()
+        return True
+
+    def set_tile(self, tile):
+        record = tile_record(tile)
+        return self.change({'op': 'tile', 'pos': record['pos'], 'tile': record})
+
+    def remove_tile(self, x, y):
+        return self.change({'op': 'tile', 'pos': [x, y], 'tile': None})
+
+    def set_spawner(self, tile):
+        record = tile_record(tile)
+        return self.change({'op': 'spawner', 'pos': record['pos'], 'tile': record})
+
+    def remove_spawner(self, x, y):
+        return self.change({'op': 'spawner', 'pos': [x, y], 'tile': None})
+
+    # Placing an offgrid tile exactly where the same one already is changes nothing
+    def add_offgrid(self, tile):
+        record = tile_record(tile, ongrid=False)
+        return self.change({'op': 'offgrid', 'tile': record, 'count': max(len(self.find_offgrid(record)), 1)})
+
+    def remove_offgrid(self, tile):
+        record = tile_record(tile, ongrid=False)
+        return self.change({'op': 'offgrid', 'tile': record, 'count': max(len(self.find_offgrid(record)) - 1, 0)})
+
+    # End the current undo step (i.e. when the mouse button is let go)
+    def commit(self):
+        if self.group:
+            self.undo_stack.append(self.group)
+            del self.undo_stack[:-UNDO_LEVELS]
+            self.group = []
+
+    def undo(self):
+        self.commit()
+        if not self.undo_stack:
+            return False
+        group = self.undo_stack.pop()
+        for op, inverse in reversed(group):
+            self.apply(inverse)
+            self.pending.append(inverse)
+        self.redo_stack.append(group)
+        return True
+
+    def redo(self):
+        self.commit()
+        if not self.redo_stack:
+            return False
+        group = self.redo_stack.pop()
+        for op, inverse in group:
+            self.apply(op)
+            self.pending.append(op)
+        self.undo_stack.append(group)
+        return True
+
+    # Append the pending operations to the journal file, keeping only the last one for each thing changed
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        last = {}
+        for i, op in enumerate(self.pending):
+            last[self.key(op)] = i
+        ops = [self.pending[i] for i in sorted(last.values())]
+
+        f = open(self.journal_path, 'a')
+        f.write(''.join(json.dumps(op) + '\n' for op in ops))
+        f.close()
+        self.written += len(ops)
+        self.pending = []
+
+    # Write the whole map out and start a new, empty journal. The map is written atomically (see write_map), so a crash
+    # part way through leaves the old map and the journal intact
+    def compact(self):
+        self.tilemap.save(self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.pending = []
+        self.written = 0
+        self.last_flush = time.monotonic()
+
+    def save(self):
+        self.compact()
+
+    # Autosave: call every frame. Appends new operations every AUTOSAVE_INTERVAL seconds, and compacts once the journal
+    # has grown past COMPACT_ENTRIES
+    def poll(self):
+        if time.monotonic() - self.last_flush < AUTOSAVE_INTERVAL:
+            return
+        self.flush()
+        if self.written >= COMPACT_ENTRIES:
+            self.compact()
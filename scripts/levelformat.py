@@ -0,0 +1,249 @@
+import json, math, mmap, os, struct, sys
+from array import array
+
+# Compact binary level format (.lvl). Instead of one JSON dict per tile, on grid tiles are stored as two typed arrays per
+# chunk (tile type ids and variants, EMPTY where there's no tile), with the type names in a string table. Offgrid tiles
+# and spawners get their own sections. Offgrid records are sorted by the chunk they start in, so each chunk's decor is
+# one contiguous run, and each one keeps its index in the map's offgrid list, so the order they were placed in (which
+# decides how overlapping decor is drawn) survives. Files are read through mmap, and a chunk's arrays are just views
+# into the mapped file.
+#
+# Layout (little endian):
+#   header
+#   string table - per string: u16 byte length, utf-8 bytes
+#   chunk directory - per chunk: cx, cy, offset of its tile arrays (0 if it only has offgrid tiles), first offgrid record, offgrid count
+#   chunk data - per chunk with tiles: u16 types[CHUNK_SIZE * CHUNK_SIZE], u16 variants[CHUNK_SIZE * CHUNK_SIZE]
+#   offgrid section - per tile: u16 type, u16 variant, u32 index in the map's offgrid list, f64 x, f64 y (pixels)
+#   spawners section - per spawner: u16 type, u16 variant, i32 x, i32 y (tiles)
+
+LEVEL_EXT = '.lvl'
+MAGIC = b'SMBL'
+VERSION = 2
+EMPTY = 0xFFFF # Type id of cells with no tile
+ALIGN = 8
+
+# magic, version, tilesize, chunk shift, bounds (min x, min y, max x, max y, in tiles), then (offset, count) of the
+# string table, chunk directory, offgrid section and spawners section
+HEADER = struct.Struct('<4sHHH2x4i8I')
+CHUNK_ENTRY = struct.Struct('<iiIII')
+OFFGRID = struct.Struct('<HHIdd')
+SPAWNER = struct.Struct('<HHii')
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+# Write map data (the same dict as the JSON map files: tilemap, tilesize, offgrid, spawners) as a binary level
+def write_level(map_data, path, chunk_shift=4):
+    chunk_mask = (1 << chunk_shift) - 1
+    cells = 1 << (2 * chunk_shift)
+    tilesize = map_data['tilesize']
+
+    strings = []
+    string_ids = {}
+    def string_id(name):
+        if name not in string_ids:
+            string_ids[name] = len(strings)
+            strings.append(name)
+        return string_ids[name]
+
+    # Pack on grid tiles into per chunk arrays
+    chunks = {}
+    bounds = None
+    for tile in map_data['tilemap'].values():
+        x, y = int(tile['pos'][0]), int(tile['pos'][1])
+        chunk_loc = (x >> chunk_shift, y >> chunk_shift)
+        if chunk_loc not in chunks:
+            chunks[chunk_loc] = (array('H', [EMPTY]) * cells, array('H', [0]) * cells)
+        index = ((y & chunk_mask) << chunk_shift) | (x & chunk_mask)
+        chunks[chunk_loc][0][index] = string_id(tile['type'])
+        chunks[chunk_loc][1][index] = tile['variant']
+        bounds = (x, y, x, y) if bounds is None else (min(bounds[0], x), min(bounds[1], y), max(bounds[2], x), max(bounds[3], y))
+
+    # Bucket offgrid tiles by the chunk their position falls in, with their place in the list
+    offgrid = {}
+    chunk_pixels = tilesize << chunk_shift
+    for index, tile in enumerate(map_data['offgrid']):
+        chunk_loc = (math.floor(tile['pos'][0]) // chunk_pixels, math.floor(tile['pos'][1]) // chunk_pixels)
+        offgrid.setdefault(chunk_loc, []).append((index, tile))
+
+    spawners = list(map_data.get('spawners', {}).values())
+    for tile in spawners:
+        string_id(tile['type'])
+    for tiles in offgrid.values():
+        for index, tile in tiles:
+            string_id(tile['type'])
+
+    # Work out where each section goes
+    string_data = b''.join(struct.pack('<H', len(name.encode('utf-8'))) + name.encode('utf-8') for name in strings)
+    locs = sorted(set(chunks) | set(offgrid)) # Sorted by x first, so chunks are stored in scrolling order
+    string_offset = HEADER.size
+    dir_offset = align(string_offset + len(string_data))
+    data_offset = align(dir_offset + CHUNK_ENTRY.size * len(locs))
+    offgrid_offset = data_offset + cells * 4 * len(chunks)
+    offgrid_count = sum(len(tiles) for tiles in offgrid.values())
+    spawner_offset = offgrid_offset + OFFGRID.size * offgrid_count
+
+    out = bytearray(spawner_offset + SPAWNER.size * len(spawners))
+    bounds = bounds or (0, 0, 0, 0)
+    HEADER.pack_into(out, 0, MAGIC, VERSION, tilesize, chunk_shift, *bounds,
+                     string_offset, len(strings), dir_offset, len(locs), offgrid_offset, offgrid_count, spawner_offset, len(spawners))
+    out[string_offset:string_offset + len(string_data)] = string_data
+
+    next_data = data_offset
+    next_offgrid = 0
+    for i, loc in enumerate(locs):
+        tile_offset = 0
+        if loc in chunks:
+            types, variants = chunks[loc]
+            if sys.byteorder != 'little':
+                types, variants = array('H', types), array('H', variants)
+                types.byteswap()
+                variants.byteswap()
+            tile_offset = next_data
+            out[next_data:next_data + cells * 2] = types.tobytes()
+            out[next_data + cells * 2:next_data + cells * 4] = variants.tobytes()
+            next_data += cells * 4
+
+        tiles = offgrid.get(loc, [])
+        CHUNK_ENTRY.pack_into(out, dir_offset + i * CHUNK_ENTRY.size, loc[0], loc[1], tile_offset, next_offgrid, len(tiles))
+        for index, tile in tiles:
+            OFFGRID.pack_into(out, offgrid_offset + next_offgrid * OFFGRID.size, string_ids[tile['type']], tile['variant'], index, tile['pos'][0], tile['pos'][1])
+            next_offgrid += 1
+
+    for i, tile in enumerate(spawners):
+        SPAWNER.pack_into(out, spawner_offset + i * SPAWNER.size, string_ids[tile['type']], tile['variant'], int(tile['pos'][0]), int(tile['pos'][1]))
+
+    f = open(path, 'wb')
+    f.write(out)
+    f.close()
+
+# A binary level opened through mmap. Only the header and string table are parsed up front, the chunk directory
+# and tiles are read straight out of the mapped file when they're asked for
+class LevelFile:
+
+    def __init__(self, path):
+        f = open(path, 'rb')
+        self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close() # The mapping stays valid after the file is closed
+
+        (magic, version, self.tilesize, self.chunk_shift, min_x, min_y, max_x, max_y, string_offset, string_count,
+         self.dir_offset, self.chunk_count, self.offgrid_offset, self.offgrid_count, self.spawner_offset, self.spawner_count) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(path + ' is not a binary level')
+        if version != VERSION:
+            raise ValueError('Unsupported level version {} in {}'.format(version, path))
+        self.bounds = (min_x, min_y, max_x, max_y) # Tile coordinates of the outermost on grid tiles
+        self.cells = 1 << (2 * self.chunk_shift)
+
+        self.strings = []
+        offset = string_offset
+        for i in range(string_count):
+            length = struct.unpack_from('<H', self.data, offset)[0]
+            self.strings.append(bytes(self.data[offset + 2:offset + 2 + length]).decode('utf-8'))
+            offset += 2 + length
+
+    # Chunk directory entry i: ((cx, cy), tile arrays offset, first offgrid record, offgrid count)
+    def entry(self, i):
+        cx, cy, tile_offset, first, count = CHUNK_ENTRY.unpack_from(self.data, self.dir_offset + i * CHUNK_ENTRY.size)
+        return (cx, cy), tile_offset, first, count
+
+    def entries(self):
+        for i in range(self.chunk_count):
+            yield self.entry(i)
+
+    # Directory entries of every chunk in chunk column cx. The directory is sorted by column, so this is a binary
+    # search in the mapped file rather than an index held in memory
+    def column(self, cx):
+        lo, hi = 0, self.chunk_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0][0] < cx:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        while lo < self.chunk_count and self.entry(lo)[0][0] == cx:
+            entries.append(self.entry(lo))
+            lo += 1
+        return entries
+
+    # Values of a u16 array in the file. A view into the mapping unless copy is set (copying reads the pages in right away)
+    def u16_array(self, offset, count, copy=False):
+        if sys.byteorder == 'little' and not copy:
+            return memoryview(self.data)[offset:offset + count * 2].cast('H')
+        values = array('H', self.data[offset:offset + count * 2])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    # Type ids and variants of a chunk's cells, given the tile arrays offset from its directory entry. None if the chunk has no on grid tiles
+    def chunk_arrays(self, tile_offset, copy=False):
+        if not tile_offset:
+            return None
+        return self.u16_array(tile_offset, self.cells, copy), self.u16_array(tile_offset + self.cells * 2, self.cells, copy)
+
+    # Offgrid tiles of a range of records as (index in the map's offgrid list, tile dict)
+    def offgrid_records(self, first, count):
+        records = []
+        for i in range(first, first + count):
+            type_id, variant, index, x, y = OFFGRID.unpack_from(self.data, self.offgrid_offset + i * OFFGRID.size)
+            records.append((index, {'type': self.strings[type_id], 'variant': variant, 'pos': [x, y]}))
+        return records
+
+    # Every offgrid tile as tile dicts, in the order they were placed
+    def offgrid(self):
+        records = self.offgrid_records(0, self.offgrid_count)
+        records.sort(key=lambda record: record[0])
+        return [tile for index, tile in records]
+
+    # Spawners as the same "x;y" keyed dict as the JSON maps
+    def spawners(self):
+        spawners = {}
+        for i in range(self.spawner_count):
+            type_id, variant, x, y = SPAWNER.unpack_from(self.data, self.spawner_offset + i * SPAWNER.size)
+            spawners[str(x) + ';' + str(y)] = {'type': self.strings[type_id], 'variant': variant, 'pos': [x, y]}
+        return spawners
+
+    # Decode the whole level back into JSON map data
+    def to_data(self):
+        tilemap = {}
+        chunk_mask = (1 << self.chunk_shift) - 1
+        for chunk_loc, tile_offset, first, count in self.entries():
+            arrays = self.chunk_arrays(tile_offset)
+            if arrays is None:
+                continue
+            for i, type_id in enumerate(arrays[0]):
+                if type_id != EMPTY:
+                    x = (chunk_loc[0] << self.chunk_shift) + (i & chunk_mask)
+                    y = (chunk_loc[1] << self.chunk_shift) + (i >> self.chunk_shift)
+                    tilemap[str(x) + ';' + str(y)] = {'type': self.strings[type_id], 'variant': arrays[1][i], 'pos': [x, y]}
+
+        return {
+            'tilemap': tilemap,
+            'tilesize': self.tilesize,
+            'offgrid': self.offgrid(),
+            'spawners': self.spawners()
+        }
+
+# Read map data from either format, going by the file extension
+def read_map(path):
+    if path.endswith(LEVEL_EXT):
+        return LevelFile(path).to_data()
+
+    f = open(path, 'r')
+    map_data = json.load(f)
+    f.close()
+    return map_data
+
+# Write map data in either format, going by the file extension. The map goes to a temporary file that's then moved over
+# the old one, so anything reading the map (or a crash part way through) sees either the old map or the new one whole
+def write_map(map_data, path):
+    root, ext = os.path.splitext(path)
+    temp_path = root + '.tmp' + ext
+    if path.endswith(LEVEL_EXT):
+        write_level(map_data, temp_path)
+    else:
+        f = open(temp_path, 'w')
+        json.dump(map_data, f)
+        f.close()
+    os.replace(temp_path, path)
@@ -0,0 +1,116 @@
+import math
+
+# Batch operations on map data (the JSON layout: tilemap, tilesize, offgrid, spawners), for migrating lots of levels at
+# once with mapTool.py. Each operation changes the map data in place and returns how many tiles it changed. Tile types
+# are matched across the on grid tiles, offgrid tiles and spawners alike.
+
+class MapError(ValueError):
+    pass
+
+# All the tiles of a map: on grid, offgrid and spawners
+def all_tiles(map_data):
+    yield from map_data['tilemap'].values()
+    yield from map_data['offgrid']
+    yield from map_data.get('spawners', {}).values()
+
+def tile_key(pos):
+    return str(int(pos[0])) + ';' + str(int(pos[1]))
+
+# Rename a tile type (i.e. when an asset folder gets renamed)
+def retype(map_data, old_type, new_type):
+    changed = 0
+    for tile in all_tiles(map_data):
+        if tile['type'] == old_type:
+            tile['type'] = new_type
+            changed += 1
+    return changed
+
+# Change one variant of a type to another (i.e. when the images in an asset folder get renumbered)
+def revariant(map_data, tile_type, old_variant, new_variant):
+    changed = 0
+    for tile in all_tiles(map_data):
+        if tile['type'] == tile_type and tile['variant'] == old_variant:
+            tile['variant'] = new_variant
+            changed += 1
+    return changed
+
+# Delete every tile of a type, or only one variant of it
+def delete(map_data, tile_type, variant=None):
+    def doomed(tile):
+        return tile['type'] == tile_type and (variant is None or tile['variant'] == variant)
+
+    before = sum(1 for tile in all_tiles(map_data))
+    map_data['tilemap'] = {loc: tile for loc, tile in map_data['tilemap'].items() if not doomed(tile)}
+    map_data['offgrid'] = [tile for tile in map_data['offgrid'] if not doomed(tile)]
+    map_data['spawners'] = {loc: tile for loc, tile in map_data.get('spawners', {}).items() if not doomed(tile)}
+    return before - sum(1 for tile in all_tiles(map_data))
+
+# Move everything inside a rect of tile coordinates (x0, y0, x1, y1, inclusive) by dx, dy tiles. Offgrid tiles move if
+# their position is inside the rect. Anything already where the moved tiles land gets replaced
+def shift(map_data, x0, y0, x1, y1, dx, dy):
+    tilesize = map_data['tilesize']
+
+    def inside(x, y):
+        return x0 <= x <= x1 and y0 <= y <= y1
+
+    changed = 0
+    for section in ['tilemap', 'spawners']:
+        tiles = map_data.get(section, {})
+        moving = [tile for tile in tiles.values() if inside(tile['pos'][0], tile['pos'][1])]
+        staying = {loc: tile for loc, tile in tiles.items() if not inside(tile['pos'][0], tile['pos'][1])}
+        for tile in moving:
+            tile['pos'] = [tile['pos'][0] + dx, tile['pos'][1] + dy]
+            staying[tile_key(tile['pos'])] = tile
+        map_data[section] = staying
+        changed += len(moving)
+
+    for tile in map_data['offgrid']:
+        if inside(math.floor(tile['pos'][0] / tilesize), math.floor(tile['pos'][1] / tilesize)):
+            tile['pos'] = [tile['pos'][0] + dx * tilesize, tile['pos'][1] + dy * tilesize]
+            changed += 1
+    return changed
+
+# Problems that would stop a map from loading properly, as a list of messages (empty if it's fine)
+def problems(map_data):
+    found = []
+    for key in ['tilemap', 'tilesize', 'offgrid']:
+        if key not in map_data:
+            found.append('missing ' + key)
+    if found:
+        return found
+
+    if not isinstance(map_data['tilesize'], int) or map_data['tilesize'] <= 0:
+        found.append('bad tilesize {!r}'.format(map_data['tilesize']))
+
+    for section in ['tilemap', 'spawners']:
+        for loc, tile in map_data.get(section, {}).items():
+            if not isinstance(tile.get('type'), str) or not isinstance(tile.get('variant'), int) or tile['variant'] < 0:
+                found.append('{} {}: bad type or variant'.format(section, loc))
+            elif loc != tile_key(tile['pos']) or tile['pos'][0] != int(tile['pos'][0]) or tile['pos'][1] != int(tile['pos'][1]):
+                found.append('{} {}: position {} does not match'.format(section, loc, tile['pos']))
+
+    for i, tile in enumerate(map_data['offgrid']):
+        if not isinstance(tile.get('type'), str) or not isinstance(tile.get('variant'), int) or tile['variant'] < 0:
+            found.append('offgrid {}: bad type or variant'.format(i))
+        elif not all(isinstance(value, (int, float)) and math.isfinite(value) for value in tile['pos']):
+            found.append('offgrid {}: bad position {}'.format(i, tile['pos']))
+
+    return found
+
+def validate(map_data):
+    found = problems(map_data)
+    if found:
+        raise MapError('; '.join(found[:5]) + (' (and {} more)'.format(len(found) - 5) if len(found) > 5 else ''))
+    return 0
+
+OPERATIONS = {
+    'retype': retype,
+    'revariant': revariant,
+    'delete': delete,
+    'shift': shift,
+    'validate': validate
+}
+
+# Run a pipeline of (operation name, args) over map data. Returns how many tiles each step changed
+def run(map_data, pipeline):
+    return [OPERATIONS[name](map_data, *args) for name, args in pipeline]
@@ -0,0 +1,373 @@
+import bisect
+from collections import deque
+import numpy as np
+from scripts.entitystore import BATCH, TOUCH, SLEEP, PATROL, CHASE
+
+# Navigation layer for enemy AI, worked out from the tilemap's collision grid instead of probing tiles around every
+# enemy every tick. The level is cut into spans: runs of empty cells on the same row with solid ground under every one
+# of them, i.e. stretches an enemy can walk along. Each span knows whether its ends are ledges (a drop) or walls. Spans
+# are connected by links: walking off a ledge onto the span below it, or jumping across a gap or up onto a span above.
+#
+# Every cell has the id of the span it's in, so which span an enemy stands on is an array lookup, and patrolling enemies
+# check the end of their span in one go for all of them. Chasing enemies follow a next hop table towards the player's
+# span, worked out once per span the player stands on. When the tiles change (blocks breaking, a streamed level loading or
+# dropping columns) only the runs of cells around the ones that changed get new spans, and the next time links are needed
+# only the ones off spans within reach of those cells are worked out again.
+
+# Span ends
+LEFT_LEDGE = 1
+RIGHT_LEDGE = 2
+
+# Links
+DROP = 0 # Walk off a ledge and fall onto the span below
+JUMP = 1 # Jump across a gap or up onto a higher span
+
+JUMP_UP = 4 # Most rows up a jump reaches
+JUMP_ACROSS = 1 # Widest gap (in tiles) a jump clears
+RUN_UP = 2 # Columns out from under a higher span to jump up onto it from
+JUMP_SPEED = 5.5 # Upwards speed of an enemy jump, same as the player's
+CHASE_SPEED = 0.5
+REACH = max(JUMP_ACROSS + 1, RUN_UP) # Columns out past the ends of a span its links can go to
+UNUSED = -1 << 30 # x0 of span ids that are free
+LINK_FIELDS = ['from', 'to', 'takeoff', 'landing', 'kind']
+
+# Sort ranges of columns (inclusive) and merge the ones that overlap or touch
+def merge(ranges):
+    merged = []
+    for x0, x1 in sorted(ranges):
+        if merged and x0 <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], x1)
+        else:
+            merged.append([x0, x1])
+    return merged
+
+class Navigation:
+
+    def __init__(self, tilemap):
+        self.tilemap = tilemap
+        self.version = None # Tilemap version the spans were worked out from
+        self.solid = np.zeros((0, 0), bool) # Copy of the collision grid the spans come from
+        self.gx = self.gy = 0 # Tile coordinates of its top left corner
+        self.span = np.zeros((0, 0), np.int32) # Span id of every cell, -1 where an enemy can't stand
+
+        # Span table, indexed by span id. Spans are in tile coordinates, x1 inclusive. Free ids have x0 = UNUSED
+        self.count = 0
+        self.free = []
+        self.x0 = np.zeros(0, np.int32)
+        self.x1 = np.zeros(0, np.int32)
+        self.y = np.zeros(0, np.int32)
+        self.ledges = np.zeros(0, np.uint8)
+
+        # Link table as a dict of arrays indexed by link id (see build_links), None until needed. Free ids have 'from' = -1
+        self.links = None
+        self.link_count = 0
+        self.link_free = []
+        self.outgoing = {} # Span id -> ids of the links off it
+        self.incoming = {} # Span id -> ids of the links onto it
+        self.relink = set() # Span ids that changed since the links were worked out
+        self.relink_columns = [] # Ranges of columns (inclusive) where spans changed since then
+        self.hops = (None, None) # (target span, link to take from every span to get there, -1 for none)
+        self.target = -1 # Span the player was last seen standing on
+
+    # Bring the spans up to date if the tiles changed. The new collision grid is compared with the old one (moved to where
+    # it is in the new grid, if a streamed level loaded or dropped columns), and only the cells whose standing changed
+    # get new spans
+    def refresh(self):
+        tilemap = self.tilemap
+        if tilemap.version == self.version:
+            return
+        self.version = tilemap.version
+
+        grid, gx, gy = tilemap.solid_grid()
+        solid = grid != 0
+        height, width = solid.shape
+        moved = (gx, gy, width, height) != (self.gx, self.gy, self.solid.shape[1], self.solid.shape[0])
+        if moved:
+            # Carry over the part both grids cover. Spans that were only in the part that's gone are gone too
+            old = np.zeros_like(solid)
+            span = np.full(solid.shape, -1, np.int32)
+            dx, dy = self.gx - gx, self.gy - gy # Old grid's corner in the new one
+            x0, x1 = max(dx, 0), min(dx + self.solid.shape[1], width)
+            y0, y1 = max(dy, 0), min(dy + self.solid.shape[0], height)
+            if x0 < x1 and y0 < y1:
+                old[y0:y1, x0:x1] = self.solid[y0 - dy:y1 - dy, x0 - dx:x1 - dx]
+                span[y0:y1, x0:x1] = self.span[y0 - dy:y1 - dy, x0 - dx:x1 - dx]
+            for i in np.setdiff1d(self.span, span).tolist():
+                if i >= 0:
+                    self.free_span(i)
+        else:
+            old, span = self.solid, self.span
+
+        # Cells whose standing changed: the ones that changed and the ones on top of them. The cells along an edge of the
+        # grid that moved count too, whether their spans end in a ledge depends on it
+        changed = solid != old
+        dirty = changed.copy()
+        dirty[:-1] |= changed[1:]
+        if moved:
+            dirty[:, 0] |= gx != self.gx
+            dirty[:, -1] |= gx + width != self.gx + self.solid.shape[1]
+            dirty[-1] |= gy + height != self.gy + self.solid.shape[0]
+        self.solid, self.span, self.gx, self.gy = solid, span, gx, gy
+
+        for row in np.flatnonzero(dirty.any(axis=1)).tolist():
+            standable = self.standable(row)
+            for x0, x1 in self.ranges(standable, np.flatnonzero(dirty[row])):
+                self.build_row(row, x0, x1, standable)
+                if self.links is not None:
+                    self.relink_columns.append((x0 + gx, x1 + gx))
+        if self.relink:
+            self.hops = (None, None)
+
+    def new_span(self):
+        if self.free:
+            return self.free.pop()
+        if self.count == len(self.x0):
+            for name in ['x0', 'x1', 'y', 'ledges']:
+                old = getattr(self, name)
+                new = np.zeros(max(16, len(old) * 2), old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+        self.count += 1
+        return self.count - 1
+
+    def free_span(self, i):
+        self.x0[i] = UNUSED
+        self.free.append(i)
+        self.relink.add(i)
+        if self.target == i: # Its id might belong to another span soon
+            self.target = -1
+
+    # Which cells of a row of the grid an enemy can stand in: empty, with solid ground under them
+    def standable(self, row):
+        if row + 1 >= self.solid.shape[0]: # Nothing to stand on below the grid
+            return np.zeros(self.solid.shape[1], bool)
+        return ~self.solid[row] & self.solid[row + 1]
+
+    # Ranges of a row (inclusive) to find spans in again, around the columns whose standing changed: one column past them
+    # either way, for the ledges of the spans next to them, and out to the ends of the runs of standable cells there
+    def ranges(self, standable, columns):
+        width = len(standable)
+        ranges = []
+        for group in np.split(columns, np.flatnonzero(np.diff(columns) > 1) + 1):
+            x0, x1 = max(int(group[0]) - 1, 0), min(int(group[-1]) + 1, width - 1)
+            blocked = np.flatnonzero(~standable[:x0])
+            x0 = int(blocked[-1]) + 1 if len(blocked) else 0
+            blocked = np.flatnonzero(~standable[x1 + 1:])
+            x1 = x1 + int(blocked[0]) if len(blocked) else width - 1
+            if ranges and x0 <= ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], x1))
+            else:
+                ranges.append((x0, x1))
+        return ranges
+
+    # Find the spans in columns x0 to x1 (inclusive) of one row of the grid, replacing the ones that were there
+    def build_row(self, row, x0, x1, standable):
+        for i in np.unique(self.span[row, x0:x1 + 1]).tolist():
+            if i >= 0:
+                self.free_span(i)
+        self.span[row, x0:x1 + 1] = -1
+
+        edges = np.diff(np.concatenate(([0], standable[x0:x1 + 1].astype(np.int8), [0])))
+        width = self.solid.shape[1]
+        for start, end in zip((np.flatnonzero(edges == 1) + x0).tolist(), (np.flatnonzero(edges == -1) - 1 + x0).tolist()):
+            i = self.new_span()
+            self.x0[i], self.x1[i], self.y[i] = start + self.gx, end + self.gx, row + self.gy
+            self.ledges[i] = (LEFT_LEDGE if start == 0 or not self.solid[row, start - 1] else 0) | (RIGHT_LEDGE if end == width - 1 or not self.solid[row, end + 1] else 0)
+            self.span[row, start:end + 1] = i
+            self.relink.add(i)
+
+    # Span ids at arrays of tile coordinates, -1 where there's no span
+    def span_at(self, xs, ys):
+        xs, ys = xs - self.gx, ys - self.gy
+        inside = (xs >= 0) & (xs < self.span.shape[1]) & (ys >= 0) & (ys < self.span.shape[0])
+        if not self.span.size:
+            return np.full(len(xs), -1, np.int32)
+        return np.where(inside, self.span[np.clip(ys, 0, self.span.shape[0] - 1), np.clip(xs, 0, self.span.shape[1] - 1)], -1)
+
+    # Bring the links up to date. The links off spans that changed, off spans within reach of where spans changed and onto
+    # spans that went away are worked out again (all of them the first time). Links are arrays indexed by link id: from
+    # and to span, the column to take off from and the column to land in, and the kind of link
+    def build_links(self):
+        live = self.x0[:self.count] != UNUSED
+        if self.links is None:
+            self.links = {name: np.zeros(0, np.int32) for name in LINK_FIELDS}
+            sources = set(np.flatnonzero(live).tolist())
+        else:
+            sources = set(self.relink)
+            sources.update(self.near(self.relink_columns).tolist())
+            for i in self.relink:
+                sources.update(self.links['from'][self.incoming.get(i, [])].tolist())
+        self.relink = set()
+        self.relink_columns = []
+
+        for i in sources:
+            for link in self.outgoing.pop(i, []):
+                self.incoming[int(self.links['to'][link])].remove(link)
+                self.links['from'][link] = -1
+                self.link_free.append(link)
+        sources = [i for i in sources if live[i]]
+
+        rows = {} # Row -> (x1 of the spans the sources can reach on it in order, their ids), for finding the spans near a column range
+        reachable = self.near([(int(self.x0[i]), int(self.x1[i])) for i in sources]).tolist()
+        for i in sorted(reachable, key=lambda i: (int(self.y[i]), int(self.x0[i]))):
+            ends, ids = rows.setdefault(int(self.y[i]), ([], []))
+            ends.append(int(self.x1[i]))
+            ids.append(i)
+
+        for i in sources:
+            x0, x1, y, ledges = int(self.x0[i]), int(self.x1[i]), int(self.y[i]), int(self.ledges[i])
+
+            # Off either ledge, onto the first span below the column past it
+            for side, edge, x in ((LEFT_LEDGE, x0, x0 - 1), (RIGHT_LEDGE, x1, x1 + 1)):
+                gx, gy = x - self.gx, y - self.gy
+                if ledges & side and 0 <= gx < self.span.shape[1]:
+                    below = np.flatnonzero(self.span[gy + 1:, gx] >= 0)
+                    if len(below):
+                        self.add_link(i, int(self.span[gy + 1 + below[0], gx]), edge, x, DROP)
+
+            # Across a gap on the same row, or up onto a span within reach
+            for row in range(y - JUMP_UP, y + 1):
+                if row not in rows:
+                    continue
+                ends, ids = rows[row]
+                for k in range(bisect.bisect_left(ends, x0 - REACH), len(ids)):
+                    j = ids[k]
+                    t0, t1 = int(self.x0[j]), int(self.x1[j])
+                    if t0 > x1 + REACH:
+                        break
+                    if j == i:
+                        continue
+                    # Across a gap: from the edge to the nearest end of the other span. Up: from RUN_UP columns out
+                    # from under its nearest end, so the jump clears the edge on the way up instead of bumping into it
+                    if row == y and t0 > x1:
+                        takeoff, landing = x1, t0
+                    elif row == y and t1 < x0:
+                        takeoff, landing = x0, t1
+                    elif row < y and x0 <= t0 - RUN_UP <= x1:
+                        takeoff, landing = t0 - RUN_UP, t0
+                    elif row < y and x0 <= t1 + RUN_UP <= x1:
+                        takeoff, landing = t1 + RUN_UP, t1
+                    else:
+                        continue
+                    columns = [x - self.gx for x in range(takeoff, landing, 1 if landing > takeoff else -1)] # From the takeoff up to the landing
+                    if self.solid[row - self.gy:y - self.gy + 1, columns].any(): # Something in the way
+                        continue
+                    self.add_link(i, j, takeoff, landing, JUMP)
+
+    # Ids of the spans within REACH columns of any of the ranges of columns (inclusive)
+    def near(self, ranges):
+        x0, x1 = self.x0[:self.count], self.x1[:self.count]
+        near = np.zeros(self.count, bool)
+        for start, end in merge(ranges):
+            near |= (x0 - REACH <= end) & (x1 + REACH >= start)
+        return np.flatnonzero(near & (x0 != UNUSED))
+
+    def add_link(self, source, target, takeoff, landing, kind):
+        if self.link_free:
+            link = self.link_free.pop()
+        else:
+            if self.link_count == len(self.links['from']):
+                for name in LINK_FIELDS:
+                    old = self.links[name]
+                    new = np.zeros(max(16, len(old) * 2), old.dtype)
+                    new[:len(old)] = old
+                    self.links[name] = new
+            link = self.link_count
+            self.link_count += 1
+        for name, value in zip(LINK_FIELDS, (source, target, takeoff, landing, kind)):
+            self.links[name][link] = value
+        self.outgoing.setdefault(source, []).append(link)
+        self.incoming.setdefault(target, []).append(link)
+
+    # For every span, the link to take next to get to target on the fewest links (-1 if it can't be reached)
+    def hops_to(self, target):
+        if self.hops[0] == target:
+            return self.hops[1]
+        if self.links is None or self.relink or self.relink_columns:
+            self.build_links()
+
+        hop = np.full(self.count, -1, np.int32)
+        origin = self.links['from']
+        seen = {target}
+        queue = deque([target])
+        while queue:
+            span = queue.popleft()
+            for link in self.incoming.get(span, ()):
+                source = int(origin[link])
+                if source not in seen:
+                    seen.add(source)
+                    hop[source] = link
+                    queue.append(source)
+        self.hops = (target, hop)
+        return hop
+
+    # Spans boxes are standing on (-1 for ones in the air or not on a span): the bottom edge has to be right on top of a
+    # row of cells and not moving up. The collision flags can't tell, they're only set on ticks that bumped into something
+    def standing(self, pos, size, vy):
+        ts = self.tilemap.tilesize
+        bottom = (pos[:, 1] + size[:, 1]) / ts
+        spans = self.span_at(np.floor((pos[:, 0] + size[:, 0] / 2) / ts).astype(np.int64), np.round(bottom).astype(np.int64) - 1)
+        return np.where((np.abs(bottom - np.round(bottom)) < 1e-6) & (vy >= 0), spans, -1)
+
+    # Set the walking direction of every enemy that's on the ground and has a behaviour: patrollers turn around instead
+    # of walking off ledges, chasers head for the player's span (and patrol when they can't get there)
+    def steer(self, store, player):
+        self.refresh()
+        flags = store.flags[:store.count]
+        idx = np.flatnonzero(((flags & (BATCH | TOUCH | SLEEP)) == (BATCH | TOUCH)) & ((flags & (PATROL | CHASE)) != 0)) # Awake and not stomped
+        if not len(idx):
+            return
+        spans = self.standing(store.pos[idx], store.size[idx], store.velocity[idx, 1])
+        idx, spans = idx[spans >= 0], spans[spans >= 0]
+
+        chase = (store.flags[idx] & CHASE) != 0
+        patrol = ~chase
+        if chase.any():
+            patrol[chase] = self.chase(store, idx[chase], spans[chase], player)
+        if patrol.any():
+            self.patrol(store, idx[patrol], spans[patrol])
+
+    # Turn around the ones about to walk past a ledge at the end of their span
+    def patrol(self, store, idx, spans):
+        ts = self.tilemap.tilesize
+        pos, size, vx = store.pos[idx], store.size[idx], store.velocity[idx, 0]
+        right = vx > 0
+        lead = np.where(right, pos[:, 0] + size[:, 0] + vx, pos[:, 0] + vx) # Leading edge after this tick's move
+        end = np.where(right, (self.x1[spans] + 1) * ts, self.x0[spans] * ts)
+        ledge = (self.ledges[spans] & np.where(right, RIGHT_LEDGE, LEFT_LEDGE)) != 0
+        turn = ledge & (vx != 0) & np.where(right, lead > end, lead < end)
+        store.velocity[idx[turn], 0] = -vx[turn]
+
+    # Walk towards the player, or towards the next link on the way to the player's span, and take it once there.
+    # Returns whether each one has no way to the player (and should patrol instead)
+    def chase(self, store, idx, spans, player):
+        ts = self.tilemap.tilesize
+        target = self.standing(player.pos.reshape(1, 2), np.array([player.size], float), np.array([player.velocity[1]]))[0]
+        if target >= 0: # Keep heading for where the player last stood while they're in the air
+            self.target = int(target)
+        if self.target < 0:
+            return np.ones(len(idx), bool)
+        hop = self.hops_to(self.target)
+        links = self.links
+        if not len(links['kind']):
+            links = {name: np.zeros(1, np.int32) for name in links} # So the lookups below have something to index
+
+        pos, size = store.pos[idx], store.size[idx]
+        centre = pos[:, 0] + size[:, 0] / 2
+        on_target = spans == self.target
+        link = hop[spans]
+        has_link = ~on_target & (link >= 0)
+        link = np.maximum(link, 0)
+
+        # Head for the middle of the takeoff column, then go for the landing. Jumps have to start right there, or they'd
+        # bump into the side of the span they're for. Drops can start anywhere past it, they just walk off the ledge
+        goal = np.where(on_target, player.pos[0] + player.size[0] / 2, (links['takeoff'][link] + 0.5) * ts)
+        onwards = np.sign(links['landing'][link] - links['takeoff'][link])
+        jump = links['kind'][link] == JUMP
+        at_takeoff = has_link & np.where(jump, np.abs(centre - goal) <= CHASE_SPEED, (centre - goal) * onwards >= -CHASE_SPEED)
+        direction = np.where(at_takeoff, onwards, np.sign(goal - centre))
+        store.velocity[idx[at_takeoff & jump], 1] = -JUMP_SPEED
+
+        moving = on_target | has_link
+        store.velocity[idx[moving], 0] = direction[moving] * CHASE_SPEED
+        return ~moving
@@ -0,0 +1,118 @@
+import numpy as np
+from scripts.block import BLOCKS
+from scripts.entitystore import ALIVE, BATCH, TOUCH, SLEEP, ENEMY_TYPES, PICKUP_TYPES, ENEMIES, PICKUPS
+from scripts.spawners import IDLE
+
+# Symbolic view of the level around the player, for agents and AI controllers that don't need pixels: a (rows, columns)
+# array of tile classes centred on the player's tile, worked out straight from the tilemap and the entity store. The
+# tiles of every column in the window are kept in a ring buffer (over the whole height of the level), so moving one
+# column only works out the one new column, and when tiles change (blocks breaking, a streamed level loading or dropping
+# columns) only the columns they changed in are worked out again. Entities and the spawners that haven't gone off yet are
+# laid over the top.
+
+OBS_COLUMNS = 27 # Odd, so the player is in the middle
+OBS_ROWS = 21
+
+# Tile classes
+EMPTY = 0
+SOLID = 1 # Ground, used and static blocks
+BREAKABLE = 2
+MYSTERY = 3
+PIPE = 4 # Anything else solid
+COIN = 5 # Coins and the other pickups
+ENEMY = 6 # Enemies, and enemy spawners that haven't spawned yet
+PLAYER = 7
+CLASSES = 8
+
+BLOCK_CLASSES = {BLOCKS['break']: BREAKABLE, BLOCKS['mystery']: MYSTERY}
+
+class TileObserver:
+
+    def __init__(self, game, columns=OBS_COLUMNS, rows=OBS_ROWS):
+        self.game = game
+        self.columns = columns
+        self.rows = rows
+        self.out = np.zeros((rows, columns), np.uint8)
+        self.version = None # Tilemap version the ring buffer was filled from
+        self.y0 = self.y1 = 0 # Tile rows held in the ring buffer (inclusive)
+        self.ring = np.zeros((0, columns), np.uint8) # Tile classes, column x is in slot x % columns
+        self.ring_x = np.zeros(columns, np.int64) # Which column each slot holds
+        self.type_classes = np.zeros(0, np.uint8) # Entity store type index -> class
+
+    # Class of an on grid tile, from its (type, variant). Solid cells without a block of their own are covered by a pipe
+    def tile_class(self, key, solid):
+        if key is not None and key[0] == 'block':
+            return BLOCK_CLASSES.get(key[1], SOLID)
+        return PIPE if solid else EMPTY
+
+    # Start over, i.e. after a new level was loaded or the level got taller than the rows held
+    def clear(self):
+        tilemap = self.game.tilemap
+        self.version = tilemap.version
+        self.y0, self.y1 = tilemap.bounds[1], tilemap.bounds[3] + tilemap.overhang # Pipes reach down past their own tile
+        self.ring = np.zeros((self.y1 - self.y0 + 1, self.columns), np.uint8)
+        self.ring_x[:] = np.iinfo(np.int64).min
+
+    # Make sure the ring buffer holds columns x0 to x0 + columns - 1. Only columns that came into view or whose tiles
+    # changed get worked out
+    def fill(self, x0):
+        tilemap = self.game.tilemap
+        if tilemap.version != self.version:
+            changes = tilemap.changes_since(self.version)
+            if changes is None or tilemap.bounds[1] < self.y0 or tilemap.bounds[3] + tilemap.overhang > self.y1:
+                self.clear()
+            else:
+                self.version = tilemap.version
+                for first, last in changes:
+                    self.ring_x[(self.ring_x >= first) & (self.ring_x <= last)] = np.iinfo(np.int64).min
+        for x in range(x0, x0 + self.columns):
+            slot = x % self.columns
+            if self.ring_x[slot] != x:
+                keys, solid = tilemap.column(x, self.y0, self.y1)
+                self.ring[:, slot] = [self.tile_class(key, cell) for key, cell in zip(keys, solid)]
+                self.ring_x[slot] = x
+
+    # Class of every entity store type, for the types the store has seen so far
+    def entity_classes(self, store):
+        if len(self.type_classes) != len(store.types):
+            self.type_classes = np.array([ENEMY if name in ENEMY_TYPES else COIN if name in PICKUP_TYPES else EMPTY for name in store.types], np.uint8)
+        return self.type_classes
+
+    # The (rows, columns) array of tile classes around the player. The same array is filled in again on every call, so copy it to keep it
+    def observe(self):
+        game = self.game
+        tilemap, store, spawners = game.tilemap, game.entities, game.spawners
+        ts = tilemap.tilesize
+        player = game.player
+        x0 = int(player.pos[0] + player.size[0] / 2) // ts - self.columns // 2
+        y0 = int(player.pos[1] + player.size[1] / 2) // ts - self.rows // 2
+        self.fill(x0)
+
+        # Tiles: the rows of the window inside the ring buffer, with the ring buffer unrolled so column x0 comes first
+        out = self.out
+        out[:] = EMPTY
+        first, last = max(y0, self.y0), min(y0 + self.rows - 1, self.y1)
+        if first <= last:
+            split = x0 % self.columns
+            rows = self.ring[first - self.y0:last - self.y0 + 1]
+            out[first - y0:last - y0 + 1, :self.columns - split] = rows[:, split:]
+            out[first - y0:last - y0 + 1, self.columns - split:] = rows[:, :split]
+
+        # Entities that are awake and can still be touched (not stomped or collected), by the cell under their middle
+        idx = np.flatnonzero((store.flags[:store.count] & (ALIVE | BATCH | TOUCH | SLEEP)) == (ALIVE | BATCH | TOUCH))
+        if len(idx):
+            classes = self.entity_classes(store)[store.type[idx]]
+            cells = np.floor((store.pos[idx] + store.size[idx] / 2) / ts).astype(np.int64) - (x0, y0)
+            inside = (classes != EMPTY) & (cells[:, 0] >= 0) & (cells[:, 0] < self.columns) & (cells[:, 1] >= 0) & (cells[:, 1] < self.rows)
+            out[cells[inside, 1], cells[inside, 0]] = classes[inside]
+
+        # Spawners in the window that haven't gone off yet
+        for i in range(*spawners.window(x0 * ts, (x0 + self.columns) * ts)):
+            if spawners.state[i] == IDLE:
+                spawner = spawners.spawners[i]
+                x, y = spawner['pos'][0] - x0, spawner['pos'][1] - y0
+                if 0 <= y < self.rows and 0 <= x < self.columns:
+                    out[y, x] = ENEMY if spawner['variant'] in ENEMIES else COIN if spawner['variant'] in PICKUPS else out[y, x]
+
+        out[self.rows // 2, self.columns // 2] = PLAYER
+        return out
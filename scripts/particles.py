@@ -0,0 +1,176 @@
+import numpy as np
+import pygame
+from collections import namedtuple
+from scripts.renderer import PARTICLES
+
+# Short lived visual effects (brick shards, coin sparkles, stomp dust) kept in a fixed size pool of NumPy arrays instead
+# of a Python object per particle, so a big chain of breaks doesn't churn the allocator. Live particles are packed at
+# the front of the arrays: emitting writes new ones after the last live one, and every tick moves the whole pool in a
+# few in place array operations, then packs the survivors into a second set of arrays of the same size and swaps the
+# two. Every step of that works in preallocated arrays, so nothing is allocated per particle or per tick however big the
+# pool gets.
+#
+# Drawing blits the particles that are on screen with one Surface.blits call onto a transparent surface the size of the
+# display, and hands the renderer just the part of it the particles cover as a single command. That keeps any number
+# of particles from crowding the rest of the frame out of the renderer's max_draws, and keeps the dirty rects down to
+# where the particles are. Past MAX_DRAWN on screen at once the screen is covered many times over anyway, so only the
+# youngest MAX_DRAWN get drawn.
+
+CAPACITY = 1 << 15 # Most particles alive at once. Emitting more than fit drops the extra ones
+MAX_DRAWN = 4096 # Most particles blitted per frame
+MAX_FALL = 6
+COLORKEY = (255, 0, 255) # Particle images are copied onto this with it keyed out, since keyed blits are a lot faster than per pixel alpha
+
+FIELDS = ['pos', 'prev_pos', 'velocity', 'gravity', 'life', 'image'] # Per particle arrays
+
+# What an emitter fires. Velocities are in pixels per tick, picked uniformly from velocity +- spread
+Emitter = namedtuple('Emitter', ['images', 'count', 'velocity', 'spread', 'life', 'gravity'])
+
+EMITTERS = {
+    'block break': Emitter(images='shard', count=8, velocity=(0, -3.5), spread=(1.5, 1.5), life=90, gravity=0.25),
+    'sparkle': Emitter(images='sparkle', count=6, velocity=(0, -0.6), spread=(0.8, 0.6), life=24, gravity=0.02),
+    'stomp': Emitter(images='dust', count=6, velocity=(0, -0.5), spread=(1.2, 0.3), life=16, gravity=0),
+}
+
+SPARKLE_COLORS = [(255, 255, 255), (255, 236, 120), (255, 200, 40)]
+DUST_COLORS = [(255, 255, 255), (220, 220, 220)]
+
+# Square dots of each color, for the effects without a sprite of their own
+def dots(colors, size):
+    images = []
+    for color in colors:
+        img = pygame.Surface((size, size)).convert()
+        img.fill(color)
+        images.append(img)
+    return images
+
+# The non empty cells of a horizontal strip of square sprites, as colorkeyed copies
+def strip(sheet):
+    size = sheet.get_height()
+    images = []
+    for x in range(0, sheet.get_width() - size + 1, size):
+        cell = sheet.subsurface((x, 0, size, size))
+        if cell.get_bounding_rect().w:
+            img = pygame.Surface((size, size)).convert()
+            img.fill(COLORKEY)
+            img.blit(cell, (0, 0))
+            img.set_colorkey(COLORKEY)
+            images.append(img)
+    return images
+
+class Particles:
+
+    def __init__(self, game, capacity=CAPACITY):
+        """
+        Args: game - game whose assets the particle images come from. Its seed seeds the particles' randomness
+              capacity - size of the pool
+        """
+        self.capacity = capacity
+        self.live = 0 # Particles alive, in rows 0 to live - 1
+        rows = capacity + 1 # The last row is where update() throws the dead ones when packing
+        self.pos = np.zeros((rows, 2), np.float32)
+        self.prev_pos = np.zeros((rows, 2), np.float32) # Position at the start of the last tick, for interpolating when rendering
+        self.velocity = np.zeros((rows, 2), np.float32)
+        self.gravity = np.zeros(rows, np.float32)
+        self.life = np.zeros(rows, np.int32) # Ticks left
+        self.image = np.zeros(rows, np.int16) # Index into self.images
+        self.spare = {name: np.zeros_like(getattr(self, name)) for name in FIELDS} # What the survivors get packed into
+
+        # Scratch space for update()
+        self.dead = np.zeros(capacity, bool)
+        self.moves = np.zeros(capacity, np.intp) # Row each particle goes to when packing
+        self.random = np.random.default_rng(game.seed)
+
+        # Every emitter's images in one list, so a particle only needs an index
+        groups = {
+            'shard': strip(game.assets['particles'][0]),
+            'sparkle': dots(SPARKLE_COLORS, 2),
+            'dust': dots(DUST_COLORS, 3),
+        }
+        self.images = []
+        self.groups = {} # Group name -> (first index into self.images, how many)
+        for name, images in groups.items():
+            self.groups[name] = (len(self.images), len(images))
+            self.images.extend(images)
+        self.margin = max(img.get_width() for img in self.images), max(img.get_height() for img in self.images)
+
+        self.layer = None # Surface the particles are drawn onto, made the size of the renderer's surface on first draw
+        self.drawn = None # Rect of self.layer the last draw covered
+
+    # Fire one of the EMITTERS at random points of the rect at pos with size (in pixels). Returns how many particles it made
+    def emit(self, name, pos, size=(0, 0)):
+        emitter = EMITTERS[name]
+        count = min(emitter.count, self.capacity - self.live)
+        if count <= 0:
+            return 0
+
+        new = slice(self.live, self.live + count)
+        rng = self.random
+        self.pos[new] = np.asarray(pos) + rng.random((count, 2)) * size
+        self.prev_pos[new] = self.pos[new]
+        self.velocity[new] = np.asarray(emitter.velocity) + rng.uniform(-1, 1, (count, 2)) * emitter.spread
+        self.gravity[new] = emitter.gravity
+        self.life[new] = rng.integers(emitter.life // 2, emitter.life + 1, count)
+        first, images = self.groups[emitter.images]
+        self.image[new] = first + rng.integers(0, images, count)
+        self.live += count
+        return count
+
+    # One tick for every live particle: gravity, movement, aging, then pack the survivors down over the ones that died
+    def update(self):
+        n = self.live
+        if not n:
+            return
+
+        pos, velocity, life = self.pos[:n], self.velocity[:n], self.life[:n]
+        self.prev_pos[:n] = pos
+        velocity[:, 1] += self.gravity[:n]
+        np.minimum(velocity[:, 1], MAX_FALL, out=velocity[:, 1])
+        pos += velocity
+        life -= 1
+
+        # Survivors go to the row after the survivors before them, the dead all go to the extra row at the end
+        dead = np.less_equal(life, 0, out=self.dead[:n])
+        survivors = n - np.count_nonzero(dead)
+        if survivors < n:
+            moves = np.greater(life, 0, out=self.moves[:n])
+            np.cumsum(moves, out=moves)
+            moves -= 1
+            np.copyto(moves, self.capacity, where=dead)
+            for name in FIELDS:
+                array, spare = getattr(self, name), self.spare[name]
+                spare[moves] = array[:n]
+                setattr(self, name, spare)
+                self.spare[name] = array
+            self.live = survivors
+
+    # Draw every live particle that's on screen, interpolated alpha of the way between the last two ticks. Returns how many were drawn
+    def draw(self, renderer, offset=(0, 0), alpha=1.0):
+        n = self.live
+        if not n:
+            return 0
+
+        width, height = renderer.surface.get_size()
+        prev = self.prev_pos[:n]
+        pos = (prev + (self.pos[:n] - prev) * alpha - offset).astype(np.int32)
+        visible = np.flatnonzero((pos[:, 0] > -self.margin[0]) & (pos[:, 0] < width) & (pos[:, 1] > -self.margin[1]) & (pos[:, 1] < height))
+        if not len(visible):
+            return 0
+        visible = visible[-MAX_DRAWN:] # Packing keeps the particles in the order they were emitted, so these are the youngest
+        pos = pos[visible]
+
+        if self.layer is None or self.layer.get_size() != (width, height):
+            self.layer = pygame.Surface((width, height), pygame.SRCALPHA)
+            self.drawn = None
+        if self.drawn is not None:
+            self.layer.fill((0, 0, 0, 0), self.drawn)
+
+        # Commands are streamed to blits rather than built into a list first, so thousands of tuples aren't alive at once
+        # (which sets off the garbage collector, and on a full collection that costs more than the blits)
+        self.layer.blits(zip(map(self.images.__getitem__, self.image[visible].tolist()), zip(pos[:, 0].tolist(), pos[:, 1].tolist())), doreturn=False)
+
+        low = pos.min(axis=0)
+        high = pos.max(axis=0) + self.margin
+        self.drawn = pygame.Rect(int(low[0]), int(low[1]), int(high[0] - low[0]), int(high[1] - low[1])).clip(self.layer.get_rect())
+        renderer.draw(self.layer.subsurface(self.drawn), self.drawn.topleft, layer=PARTICLES)
+        return len(visible)
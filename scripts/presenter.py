@@ -0,0 +1,79 @@
+import math
+import pygame
+
+# Gets the finished display surface onto the window. The scaled frame is written into a surface allocated once (the
+# window itself when the formats allow it) instead of a new one every frame, and only the parts of the window that
+# changed get passed on to display.update. When the window is a whole multiple of the display, the changed parts are
+# the only parts that get scaled too.
+
+class Presenter:
+
+    def __init__(self, screen, display):
+        """
+        Args: screen - the window surface from pygame.display.set_mode
+              display - surface the game renders onto, scaled up to fill the window
+        """
+        self.screen = screen
+        self.display = display
+        self.size = screen.get_size()
+        self.scale = (self.size[0] / display.get_width(), self.size[1] / display.get_height())
+
+        # Integer scale: every display pixel is exactly a k by k block of window pixels, so a region can be scaled on its own
+        k = self.size[0] // display.get_width()
+        self.factor = k if k and self.size == (display.get_width() * k, display.get_height() * k) else None
+
+        # Scale straight into the window if it takes it, otherwise into a buffer of the display's format that gets copied over
+        self.target = screen
+        try:
+            pygame.transform.scale(display, self.size, screen)
+        except ValueError:
+            self.target = pygame.Surface(self.size, 0, display)
+
+        self.full = True # Next present() shows the whole frame no matter what it's told changed
+
+    # Make the next present() show the whole frame (i.e. the window was uncovered or resized)
+    def invalidate(self):
+        self.full = True
+
+    # Window rect covering a display rect
+    def window_rect(self, rect):
+        x0, y0 = math.floor(rect[0] * self.scale[0]), math.floor(rect[1] * self.scale[1])
+        x1, y1 = math.ceil((rect[0] + rect[2]) * self.scale[0]), math.ceil((rect[1] + rect[3]) * self.scale[1])
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0).clip(self.target.get_rect())
+
+    # Show the display in the window. dirty is a list of display rects that changed since the last present (from the
+    # renderer), an empty list if nothing did, or None to show the whole frame
+    def present(self, dirty=None):
+        if self.full:
+            dirty = None
+            self.full = False
+        if dirty is not None and not dirty:
+            return
+
+        bounds = self.display.get_rect()
+        if dirty is not None:
+            dirty = [rect for rect in (bounds.clip(rect) for rect in dirty) if rect.w and rect.h]
+
+        if dirty is not None and self.factor is not None:
+            # Scale just the changed regions
+            k = self.factor
+            rects = []
+            for rect in dirty:
+                dest = pygame.Rect(rect.x * k, rect.y * k, rect.w * k, rect.h * k)
+                pygame.transform.scale(self.display.subsurface(rect), dest.size, self.target.subsurface(dest))
+                rects.append(dest)
+        else:
+            pygame.transform.scale(self.display, self.size, self.target)
+            rects = None if dirty is None else [self.window_rect(rect) for rect in dirty]
+
+        if self.target is not self.screen:
+            if rects is None:
+                self.screen.blit(self.target, (0, 0))
+            else:
+                for rect in rects:
+                    self.screen.blit(self.target, rect, rect)
+
+        if rects is None:
+            pygame.display.update()
+        elif rects:
+            pygame.display.update(rects)
@@ -0,0 +1,161 @@
+import csv, json, os, time
+from collections import deque
+import pygame
+from scripts.renderer import OVERLAY
+
+# Frame profiler. The game marks the end of each phase of a frame (events, updates, drawing, presenting) with lap(), and
+# the time since the previous mark is added to that phase. Counters (blits, rects, tile lookups) are added with count()
+# or by watch()ing a method, which wraps it with a call counter only while the profiler is on. Frames are kept as a time
+# series that can be shown as an overlay or exported as CSV or JSON. While it's off every call returns straight away,
+# and the watched methods are the originals.
+
+PROFILE_HISTORY = 3600 # Frames kept, a minute at 60 fps
+OVERLAY_WINDOW = 60 # Frames the overlay averages over
+OVERLAY_REFRESH = 15 # Frames between overlay redraws
+OVERLAY_FONT_SIZE = 14
+OVERLAY_COLOR = (255, 255, 255)
+OVERLAY_BACKGROUND = (0, 0, 0, 160)
+
+class Profiler:
+
+    def __init__(self, enabled=False, history=PROFILE_HISTORY):
+        """
+        Args: enabled - whether to start profiling right away
+              history - frames to keep for the overlay and exports, or None for no limit
+        """
+        self.enabled = False
+        self.frames = deque(maxlen=history) # Per frame dicts: phase or counter name -> milliseconds or count
+        self.names = {} # Every phase and counter name seen, in the order they first showed up -> whether it's a time
+        self.recorded = 0 # Frames recorded since the profiler was made
+        self.watches = [] # (owner, method name, counter, weight, original)
+        self.current = None # Frame being recorded
+        self.start = 0 # When the current frame began
+        self.last = 0 # Time of the last lap
+        self.overlay = None
+        self.font = None
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        for owner, name, counter, weight, original in self.watches:
+            setattr(owner, name, self.counted(original, counter, weight))
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.current = None
+        self.overlay = None
+        for owner, name, counter, weight, original in self.watches:
+            setattr(owner, name, original)
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    # Drop the recorded frames, and change how many are kept if history is given
+    def reset(self, history=0):
+        self.frames = deque(maxlen=self.frames.maxlen if history == 0 else history)
+        self.names = {}
+        self.overlay = None
+
+    # Count calls to owner.name (a class or instance method) under counter while profiling. weight, if given, gets the
+    # call's arguments and returns how much the call counts for (i.e. how many cells a batched lookup checks)
+    def watch(self, owner, name, counter, weight=None):
+        original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+        self.watches.append((owner, name, counter, weight, original))
+        if self.enabled:
+            setattr(owner, name, self.counted(original, counter, weight))
+
+    def counted(self, method, counter, weight):
+        def wrapper(*args, **kwargs):
+            if self.current is not None:
+                self.current[counter] = self.current.get(counter, 0) + (1 if weight is None else weight(*args, **kwargs))
+            return method(*args, **kwargs)
+        return wrapper
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.current = {}
+        self.start = self.last = time.perf_counter()
+
+    # Add the time since the last lap (or the start of the frame) to a phase
+    def lap(self, name):
+        if self.current is None:
+            return
+        now = time.perf_counter()
+        self.current[name] = self.current.get(name, 0) + (now - self.last) * 1000
+        self.last = now
+
+    def count(self, name, n=1):
+        if self.current is None:
+            return
+        self.current[name] = self.current.get(name, 0) + n
+
+    def end_frame(self):
+        if self.current is None:
+            return
+        self.current['frame'] = (time.perf_counter() - self.start) * 1000
+        for name, value in self.current.items():
+            self.names.setdefault(name, isinstance(value, float))
+        self.frames.append(self.current)
+        self.recorded += 1
+        self.current = None
+
+    # Average of every phase and counter over the last frames (all of them by default)
+    def averages(self, frames=None):
+        recent = list(self.frames)[-frames:] if frames else list(self.frames)
+        if not recent:
+            return {}
+        return {name: sum(frame.get(name, 0) for frame in recent) / len(recent) for name in self.names}
+
+    # Write the recorded frames to a file, CSV or JSON going by the extension. Returns the number of frames written
+    def export(self, path):
+        frames = list(self.frames)
+        names = list(self.names)
+        if os.path.splitext(path)[1].lower() == '.json':
+            f = open(path, 'w')
+            json.dump({'columns': names, 'frames': [[frame.get(name, 0) for name in names] for frame in frames]}, f)
+            f.close()
+        else:
+            f = open(path, 'w', newline='')
+            writer = csv.writer(f)
+            writer.writerow(['index'] + names)
+            for i, frame in enumerate(frames):
+                writer.writerow([i] + [frame.get(name, 0) for name in names])
+            f.close()
+        return len(frames)
+
+    # Push the overlay (averages over the last OVERLAY_WINDOW frames) onto a Renderer. The text is only redrawn every
+    # OVERLAY_REFRESH frames so showing it costs next to nothing
+    def draw(self, renderer, pos=(2, 2)):
+        if not self.enabled or not self.frames:
+            return
+        if self.overlay is None or self.recorded % OVERLAY_REFRESH == 0:
+            if self.font is None:
+                self.font = pygame.font.Font(None, OVERLAY_FONT_SIZE)
+            averages = self.averages(OVERLAY_WINDOW)
+            rows = [('fps', '{:.0f}'.format(1000 / averages['frame']) if averages['frame'] else 'n/a')]
+            for name, value in averages.items():
+                rows.append((name, '{:.2f} ms'.format(value) if self.names[name] else '{:.0f}'.format(value)))
+
+            # Names down the left, values lined up on the right
+            names = [self.font.render(name, False, OVERLAY_COLOR) for name, value in rows]
+            values = [self.font.render(value, False, OVERLAY_COLOR) for name, value in rows]
+            height = self.font.get_linesize()
+            name_width = max(text.get_width() for text in names)
+            width = name_width + 8 + max(text.get_width() for text in values)
+            self.overlay = pygame.Surface((width + 4, height * len(rows) + 4), pygame.SRCALPHA)
+            self.overlay.fill(OVERLAY_BACKGROUND)
+            blits = []
+            for i, (name, value) in enumerate(zip(names, values)):
+                blits.append((name, (2, 2 + i * height)))
+                blits.append((value, (2 + width - value.get_width(), 2 + i * height)))
+            self.overlay.blits(blits, doreturn=False)
+        renderer.draw(self.overlay, pos, layer=OVERLAY)
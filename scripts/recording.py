@@ -0,0 +1,109 @@
+import struct, time
+
+# Input recordings (.rpl). The simulation is deterministic given the level, the RNG seed and the input on every tick, so a
+# recording is just those: a header with the seed and map, and an event for every tick where the input changed. Held
+# directions stay as they were until the next event, jumps only count on the tick of their event. The final state hash
+# is stored too, so a replay can tell whether a new build still ends up in exactly the same place.
+#
+# Layout (little endian):
+#   header
+#   map path - utf-8 bytes
+#   events - per event: u32 tick, u32 milliseconds since recording started, u8 input bits
+
+MAGIC = b'SMBR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIIIH20s') # magic, version, flags, seed, ticks, milliseconds, event count, map path length, final state hash
+EVENT = struct.Struct('<IIB')
+
+STREAMING = 1 # Header flag: the level was streamed
+
+# Input bits
+LEFT = 1
+RIGHT = 2
+JUMP = 4
+
+def input_bits(left, right, jump):
+    return (LEFT if left else 0) | (RIGHT if right else 0) | (JUMP if jump else 0)
+
+class Recording:
+
+    def __init__(self, map_path='', seed=0, streaming=False):
+        self.map_path = map_path
+        self.seed = seed
+        self.streaming = streaming
+        self.events = [] # (tick, ms, input bits), in tick order
+        self.ticks = 0 # Ticks recorded
+        self.ms = 0 # Real time the recording took
+        self.state_hash = bytes(20) # State hash after the last tick, all zeros if it wasn't taken
+        self.next_event = 0 # Replay position in self.events
+        self.held = 0 # Input bits held at the replay position
+
+    @classmethod
+    def load(cls, path):
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+
+        magic, version, flags, seed, ticks, ms, count, path_length, state_hash = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(path + ' is not an input recording')
+        if version != VERSION:
+            raise ValueError('Unsupported recording version {} in {}'.format(version, path))
+        offset = HEADER.size
+        recording = cls(data[offset:offset + path_length].decode('utf-8'), seed, bool(flags & STREAMING))
+        offset += path_length
+        recording.events = [EVENT.unpack_from(data, offset + i * EVENT.size) for i in range(count)]
+        recording.ticks = ticks
+        recording.ms = ms
+        recording.state_hash = state_hash
+        return recording
+
+    def save(self, path):
+        map_path = self.map_path.encode('utf-8')
+        out = bytearray(HEADER.pack(MAGIC, VERSION, STREAMING if self.streaming else 0, self.seed, self.ticks, self.ms,
+                                    len(self.events), len(map_path), self.state_hash))
+        out += map_path
+        for event in self.events:
+            out += EVENT.pack(*event)
+
+        f = open(path, 'wb')
+        f.write(out)
+        f.close()
+
+    # Input on a tick during a replay, as (left, right, jump). Ticks have to be asked for in order
+    def input(self, tick):
+        jump = False
+        while self.next_event < len(self.events) and self.events[self.next_event][0] <= tick:
+            event_tick, ms, bits = self.events[self.next_event]
+            self.held = bits & (LEFT | RIGHT)
+            jump = event_tick == tick and (bits & JUMP) != 0
+            self.next_event += 1
+        return ((self.held & LEFT) != 0, (self.held & RIGHT) != 0, jump)
+
+    def rewind(self):
+        self.next_event = 0
+        self.held = 0
+
+    def finished(self, tick):
+        return tick >= self.ticks
+
+class Recorder:
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.start = time.perf_counter()
+        self.held = 0 # Input bits as of the last event
+
+    # Log the input the simulation used on a tick
+    def record(self, tick, left, right, jump):
+        bits = input_bits(left, right, jump)
+        if bits != self.held: # Jumps always count as a change
+            self.recording.events.append((tick, int((time.perf_counter() - self.start) * 1000), bits))
+            self.held = bits & (LEFT | RIGHT)
+        self.recording.ticks = tick + 1
+
+    # Finish the recording with the final state hash and write it out
+    def save(self, path, state_hash):
+        self.recording.ms = int((time.perf_counter() - self.start) * 1000)
+        self.recording.state_hash = state_hash
+        self.recording.save(path)
@@ -0,0 +1,100 @@
+import pygame
+
+# Draw list renderer. Instead of every part of the game blitting straight onto the display, they push draw commands
+# (image, position, layer, flip) here during the frame. flush() then puts the commands in layer order, drops the ones
+# that are off screen and draws the rest with one Surface.blits call, so draw order lives in one place and draw calls
+# can be counted and capped there. It also remembers the last frame's commands, so it can tell which parts of the
+# surface actually changed and the presenter only has to put those on screen.
+
+# Layers, drawn lowest first. Commands on the same layer are drawn in the order they were pushed
+BACKGROUND = 0
+TILES = 10
+ENTITIES = 20
+PARTICLES = 25 # Over the enemies, under the player
+PLAYER = 30
+OVERLAY = 40
+
+MAX_DIRTY_RECTS = 32 # More changed commands than this and the dirty rects get merged into one
+MAX_DIRTY_AREA = 0.5 # Fraction of the surface that can change before the whole frame is counted as dirty
+
+class Renderer:
+
+    def __init__(self, surface, max_draws=None):
+        """
+        Args: surface - surface everything gets drawn onto
+              max_draws - most commands drawn in one frame, or None for no limit. When there are more, the lowest layers
+                          get dropped first so the player and overlays always make it
+        """
+        self.surface = surface
+        self.max_draws = max_draws
+        self.layers = {} # Layer -> list of (image, position) commands
+        self.flipped = {} # Image -> horizontally flipped copy
+        self.draws = 0 # Commands drawn by the last flush
+        self.culled = 0 # Commands dropped by the last flush for being off screen
+        self.dropped = 0 # Commands dropped by the last flush for going over max_draws
+        self.last = None # Commands drawn by the last flush
+        self.dirty = None # Rects of the surface the last flush changed, or None if it could have changed all of it
+
+    def flip(self, img):
+        if img not in self.flipped:
+            self.flipped[img] = pygame.transform.flip(img, True, False)
+        return self.flipped[img]
+
+    def draw(self, img, pos, layer=TILES, flip=False):
+        if layer not in self.layers:
+            self.layers[layer] = []
+        self.layers[layer].append((self.flip(img) if flip else img, pos))
+
+    # Push a list of (image, position) commands onto one layer at once
+    def draw_batch(self, commands, layer=TILES):
+        if layer not in self.layers:
+            self.layers[layer] = []
+        self.layers[layer].extend(commands)
+
+    # Surface rects that differ between two frames' command lists. The commands both frames start and end with draw the
+    # same pixels, so only the ones in between (where the old and new frames were drawn) can have changed anything.
+    # Assumes the surface was cleared the same way both times
+    def diff(self, old, new):
+        if old is None:
+            return None
+        if old == new:
+            return []
+
+        start = 0
+        while start < len(old) and start < len(new) and old[start] == new[start]:
+            start += 1
+        end = 0
+        while end < len(old) - start and end < len(new) - start and old[-1 - end] == new[-1 - end]:
+            end += 1
+
+        width, height = self.surface.get_size()
+        rects = [pygame.Rect(pos, img.get_size()).inflate(2, 2) for img, pos in old[start:len(old) - end] + new[start:len(new) - end]] # Padded for positions that aren't whole pixels
+        if sum(rect.w * rect.h for rect in rects) > MAX_DIRTY_AREA * width * height:
+            return None
+        if len(rects) > MAX_DIRTY_RECTS:
+            return [rects[0].unionall(rects[1:])]
+        return rects
+
+    # Draw everything pushed since the last flush and start a new list
+    def flush(self):
+        width, height = self.surface.get_size()
+        commands = []
+        culled = 0
+        for layer in sorted(self.layers):
+            for img, pos in self.layers[layer]:
+                if pos[0] < width and pos[1] < height and pos[0] + img.get_width() > 0 and pos[1] + img.get_height() > 0:
+                    commands.append((img, pos))
+                else:
+                    culled += 1
+        self.layers = {}
+
+        self.dropped = 0
+        if self.max_draws is not None and len(commands) > self.max_draws:
+            self.dropped = len(commands) - self.max_draws
+            commands = commands[self.dropped:]
+
+        self.surface.blits(commands, doreturn=False)
+        self.dirty = self.diff(self.last, commands)
+        self.last = commands
+        self.draws = len(commands)
+        self.culled = culled
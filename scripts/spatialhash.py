@@ -0,0 +1,108 @@
+import math
+import numpy as np
+from itertools import combinations
+
+# Uniform grid broadphase for entity vs entity collisions. Every entity is listed in each grid cell its box touches, so
+# only entities sharing a cell get compared: the work grows with how many entities are near each other instead of with
+# the square of the entity count. Updates are incremental, only entities that moved into different cells touch the grid.
+
+CELL_SHIFT = 5
+CELL_SIZE = 1 << CELL_SHIFT # 32 pixels, as big as the biggest sprites
+
+class SpatialHash:
+
+    def __init__(self, capacity=64):
+        self.cells = {} # (cx, cy) -> set of entity ids in that cell
+        self.crowded = set() # Cells holding more than one entity, the only places pairs can come from
+        self.spans = np.zeros((capacity, 4), np.int64) # Per id: first cx, first cy, last cx, last cy of the cells it's in
+        self.present = np.zeros(capacity, bool) # Whether an id is in the grid
+        self.rects = np.zeros((capacity, 4)) # Per id: x, y, w, h in pixels as of the last update
+
+    def resize(self, capacity):
+        if capacity > len(self.present):
+            for name in ['spans', 'present', 'rects']:
+                old = getattr(self, name)
+                new = np.zeros((capacity,) + old.shape[1:], old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+
+    def insert(self, i, span):
+        for cx in range(span[0], span[2] + 1):
+            for cy in range(span[1], span[3] + 1):
+                cell = self.cells.setdefault((cx, cy), set())
+                cell.add(i)
+                if len(cell) == 2:
+                    self.crowded.add((cx, cy))
+
+    def remove(self, i):
+        if not self.present[i]:
+            return
+        span = self.spans[i].tolist()
+        for cx in range(span[0], span[2] + 1):
+            for cy in range(span[1], span[3] + 1):
+                cell = self.cells[(cx, cy)]
+                cell.discard(i)
+                if len(cell) == 1:
+                    self.crowded.discard((cx, cy))
+                elif not cell:
+                    del self.cells[(cx, cy)]
+        self.present[i] = False
+
+    # Bring the grid up to date with where the entities are now. ids is an array of the entities to keep in the grid and
+    # rects their (n, 4) boxes, anything else in the grid gets taken out
+    def update(self, ids, rects):
+        self.resize(int(ids.max(initial=-1)) + 1)
+        keep = np.zeros(len(self.present), bool)
+        keep[ids] = True
+        for i in np.flatnonzero(self.present & ~keep).tolist():
+            self.remove(i)
+
+        self.rects[ids] = rects
+        spans = np.empty((len(ids), 4), np.int64)
+        spans[:, 0] = np.floor(rects[:, 0]).astype(np.int64) >> CELL_SHIFT
+        spans[:, 1] = np.floor(rects[:, 1]).astype(np.int64) >> CELL_SHIFT
+        spans[:, 2] = (np.ceil(rects[:, 0] + rects[:, 2]).astype(np.int64) - 1) >> CELL_SHIFT
+        spans[:, 3] = (np.ceil(rects[:, 1] + rects[:, 3]).astype(np.int64) - 1) >> CELL_SHIFT
+
+        moved = ~self.present[ids] | (spans != self.spans[ids]).any(axis=1)
+        for i, span in zip(ids[moved].tolist(), spans[moved].tolist()):
+            self.remove(i)
+            self.insert(i, span)
+            self.spans[i] = span
+            self.present[i] = True
+
+    # Entity ids whose boxes overlap a rect (x, y, w, h in pixels)
+    def query(self, rect):
+        found = set()
+        for cx in range(math.floor(rect[0]) >> CELL_SHIFT, ((math.ceil(rect[0] + rect[2]) - 1) >> CELL_SHIFT) + 1):
+            for cy in range(math.floor(rect[1]) >> CELL_SHIFT, ((math.ceil(rect[1] + rect[3]) - 1) >> CELL_SHIFT) + 1):
+                found.update(self.cells.get((cx, cy), ()))
+        ids = np.array(sorted(found), np.int64)
+        boxes = self.rects[ids]
+        hits = (boxes[:, 0] < rect[0] + rect[2]) & (rect[0] < boxes[:, 0] + boxes[:, 2]) & (boxes[:, 1] < rect[1] + rect[3]) & (rect[1] < boxes[:, 1] + boxes[:, 3])
+        return ids[hits].tolist()
+
+    # Every pair of entities whose boxes overlap, as (a, b) with a < b. With ids, only the pairs involving one of those
+    # entities (i.e. only the player's pairs), which skips looking at crowds of entities that don't care about each other
+    def pairs(self, ids=None):
+        candidates = set()
+        if ids is None:
+            for cell in self.crowded:
+                candidates.update(combinations(sorted(self.cells[cell]), 2))
+        else:
+            for i in ids:
+                if not self.present[i]:
+                    continue
+                span = self.spans[i].tolist()
+                for cx in range(span[0], span[2] + 1):
+                    for cy in range(span[1], span[3] + 1):
+                        for j in self.cells[(cx, cy)]:
+                            if j != i:
+                                candidates.add((i, j) if i < j else (j, i))
+        if not candidates:
+            return []
+
+        pairs = np.array(sorted(candidates), np.int64)
+        a, b = self.rects[pairs[:, 0]], self.rects[pairs[:, 1]]
+        hits = (a[:, 0] < b[:, 0] + b[:, 2]) & (b[:, 0] < a[:, 0] + a[:, 2]) & (a[:, 1] < b[:, 1] + b[:, 3]) & (b[:, 1] < a[:, 1] + a[:, 3])
+        return [tuple(pair) for pair in pairs[hits].tolist()]
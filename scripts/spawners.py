@@ -0,0 +1,61 @@
+import bisect
+from scripts.entitystore import ALIVE
+
+# The level's spawner tiles sorted by x, so each tick only looks at the few near the camera instead of every one in the
+# level. The enemy or pickup of a spawner is added to the EntityStore once the camera gets within SPAWN_MARGIN of it,
+# and taken out again if it ends up more than DESPAWN_MARGIN off screen, which lets its spawner spawn it again the next
+# time the camera comes by. Enemies that were killed and pickups that were collected stay gone.
+
+SPAWN_MARGIN = 32 # Pixels past the edges of the screen at which spawners go off
+DESPAWN_MARGIN = 256 # Pixels past the edges of the screen before a spawned entity is removed. Has to be more than the store's SLEEP_MARGIN
+PLAYER = 0 # Spawner variant of the player
+
+# Spawner states
+IDLE = 0 # Waiting for the camera
+LIVE = 1 # Its entity is in the store
+DONE = 2 # Its entity was killed or collected, or it doesn't spawn anything
+
+class SpawnerIndex:
+
+    def __init__(self, spawners, tilesize):
+        """
+        Args: spawners - the tilemap's spawners, {'x;y': spawner tile}
+              tilesize - size of a tile in pixels
+        """
+        self.tilesize = tilesize
+        players = sorted(tuple(spawner['pos']) for spawner in spawners.values() if spawner['variant'] == PLAYER)
+        self.player = (players[0][0] * tilesize, players[0][1] * tilesize) if players else None # Pixel position of the leftmost player spawner
+
+        self.spawners = sorted((spawner for spawner in spawners.values() if spawner['variant'] != PLAYER), key=lambda spawner: tuple(spawner['pos']))
+        self.xs = [spawner['pos'][0] * tilesize for spawner in self.spawners] # Left edge in pixels, for bisecting
+        self.state = [IDLE] * len(self.spawners)
+        self.rows = {} # Index of a LIVE spawner -> store row of its entity
+
+    # Call every tick with the pixel columns on screen. Retires the spawners whose entity is gone, despawns entities that
+    # went too far off screen and spawns whatever the camera has come close to
+    def update(self, store, left, right):
+        for i, row in list(self.rows.items()):
+            if not (store.flags[row] & ALIVE) or store.spawner[row] != i: # Removed, maybe with the row already taken by something else
+                self.state[i] = DONE
+                del self.rows[i]
+            elif store.pos[row, 0] + store.size[row, 0] < left - DESPAWN_MARGIN or store.pos[row, 0] > right + DESPAWN_MARGIN:
+                store.remove(row)
+                self.state[i] = IDLE
+                del self.rows[i]
+
+        first = bisect.bisect_left(self.xs, left - SPAWN_MARGIN - self.tilesize)
+        last = bisect.bisect_right(self.xs, right + SPAWN_MARGIN)
+        for i in range(first, last):
+            if self.state[i] != IDLE:
+                continue
+            row = store.spawn(self.spawners[i])
+            if row is None:
+                self.state[i] = DONE
+                continue
+            store.spawner[row] = i
+            self.state[i] = LIVE
+            self.rows[i] = row
+
+    # Indices of the spawners with their left edge from pixel column left up to (not including) right, as a range
+    def window(self, left, right):
+        return bisect.bisect_left(self.xs, left), bisect.bisect_left(self.xs, right)
@@ -1,89 +1,714 @@
-import pygame, json
-from scripts.utils import get_image_variation
+import pygame, math
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
+from scripts.utils import Animation
+from scripts.renderer import Renderer, TILES
+from scripts.levelformat import LevelFile, LEVEL_EXT, EMPTY, read_map, write_map
 
 # Up to two tiles away
 NEIGHBOR_OFFSETS = [(0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1),
                     (0, -2), (-1, -2), (-2, -2), (-2, -1), (-2, 0), (-2, 1), (-2, 2), (-1, 2), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0), (2, -1), (2, -2), (1, -2)]
-PHYSICS_TILES = {'block'} # Set for assets where all tiles have collisions
-PHYSICS_TILES_VARIANTS = {
-    'decor': get_image_variation('Tilesets/decor', 'pipe')
-} # Dict for assets where only some assets have collisions, such as pipes in the decor assets
+
+# Tiles are stored in square chunks of CHUNK_SIZE x CHUNK_SIZE tiles, keyed by integer (chunk x, chunk y) tuples.
+# CHUNK_SIZE must be a power of two so tile -> chunk conversions are just shifts and masks (which also floor negative coordinates correctly)
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT # 16 tiles
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_CACHE_BUDGET = 32 * 1024 * 1024 # Bytes of baked chunk surfaces to keep around before evicting the least recently used ones
+OFFGRID_BUCKET_SIZE = 64 # Width and height in pixels of the buckets offgrid tiles are sorted into
+CHANGE_LOG = 256 # Collision changes remembered for changes_since, older ones mean starting over
+
+# Streaming binary levels: chunk columns within STREAM_MARGIN columns of the view are loaded, and columns more than
+# STREAM_EVICT_MARGIN columns away are dropped again (the gap between the two stops columns flickering in and out at the edge)
+STREAM_MARGIN = 2 # Has to reach past the entity store's SLEEP_MARGIN and the spawners' SPAWN_MARGIN, see stream()
+STREAM_EVICT_MARGIN = 4
+
+class Chunk:
+
+    def __init__(self, pos):
+        self.pos = tuple(pos) # Chunk coordinates, not tile coordinates
+        self.unpacked = [None] * (CHUNK_SIZE * CHUNK_SIZE) # Flat, row-major list of the tile dicts in this chunk (None if empty)
+        self.packed = None # (types, variants, type names) arrays from a binary level, turned into tile dicts the first time they're needed
+        self.count = 0 # Number of tiles in the chunk, so empty chunks can be dropped
+        self.solid = bytearray(CHUNK_SIZE * CHUNK_SIZE) # Collision grid: how many solid tiles cover each cell (pipes cover several cells)
+        self.solid_count = 0 # Sum of the solid grid, so chunks that only hold part of a neighbour's pipe aren't dropped
+
+    @property
+    def tiles(self):
+        if self.packed is not None:
+            types, variants, names = self.packed
+            x0, y0 = self.pos[0] << CHUNK_SHIFT, self.pos[1] << CHUNK_SHIFT
+            self.unpacked = [None if type_id == EMPTY else {'type': names[type_id], 'variant': variants[i], 'pos': [x0 + (i & CHUNK_MASK), y0 + (i >> CHUNK_SHIFT)]}
+                             for i, type_id in enumerate(types)]
+            self.packed = None
+        return self.unpacked
+
+# Keeps the static layers (offgrid and ongrid tiles) of each chunk pre-rendered onto one surface, so drawing the map is a
+# handful of big blits instead of one blit per tile. Surfaces are baked lazily the first time a chunk is drawn, thrown away
+# whenever something inside them changes, and evicted least recently used first once they go over the memory budget
+class ChunkCache:
+
+    def __init__(self, tilemap, budget=CHUNK_CACHE_BUDGET):
+        self.tilemap = tilemap
+        self.budget = budget
+        self.surfaces = OrderedDict() # (cx, cy) -> baked Surface (or None if nothing is drawn there), least recently used first
+        self.used = 0 # Bytes currently held by the baked surfaces
+
+    def clear(self):
+        self.surfaces.clear()
+        self.used = 0
+
+    # Throw away the baked surfaces of every chunk overlapping a rect in pixel coordinates, so they get rebaked next time they're drawn
+    def invalidate(self, rect):
+        size = CHUNK_SIZE * self.tilemap.tilesize
+        for cx in range(rect[0] // size, (rect[0] + max(rect[2], 1) - 1) // size + 1):
+            for cy in range(rect[1] // size, (rect[1] + max(rect[3], 1) - 1) // size + 1):
+                surf = self.surfaces.pop((cx, cy), 0)
+                if surf:
+                    self.used -= surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+    # Get the baked surface for a chunk, baking it if needed
+    def get(self, chunk_loc):
+        surf = self.surfaces.get(chunk_loc, 0)
+        if surf != 0:
+            self.surfaces.move_to_end(chunk_loc)
+            return surf
+
+        surf = self.bake(chunk_loc)
+        self.surfaces[chunk_loc] = surf
+        if surf:
+            self.used += surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+            # Evict least recently used chunks, but never the one just baked (it's about to be drawn)
+            while self.used > self.budget and len(self.surfaces) > 1:
+                old = self.surfaces.popitem(last=False)[1]
+                if old:
+                    self.used -= old.get_width() * old.get_height() * old.get_bytesize()
+        return surf
+
+    # Render every static tile overlapping the chunk onto a new surface. Returns None if there's nothing to draw
+    def bake(self, chunk_loc):
+        tilemap = self.tilemap
+        size = CHUNK_SIZE * tilemap.tilesize
+        origin = (chunk_loc[0] * size, chunk_loc[1] * size)
+        area = pygame.Rect(origin, (size, size))
+        blits = []
+
+        # Offgrid tiles go underneath the ongrid ones
+        for tile in tilemap.offgrid_in_rect(area):
+            blits.append((tilemap.image(tile['type'], tile['variant']), (int(tile['pos'][0]) - origin[0], int(tile['pos'][1]) - origin[1])))
+
+        # Tiles can be bigger than one tile (pipes, the castle), so also grab the ones just up and to the left that overhang into this chunk
+        x0, y0 = chunk_loc[0] << CHUNK_SHIFT, chunk_loc[1] << CHUNK_SHIFT
+        for tile in tilemap.tiles_in_rect(x0 - tilemap.overhang, y0 - tilemap.overhang, x0 + CHUNK_MASK, y0 + CHUNK_MASK):
+            blits.append((tilemap.image(tile['type'], tile['variant']), (tile['pos'][0] * tilemap.tilesize - origin[0],
+                                                                  tile['pos'][1] * tilemap.tilesize - origin[1])))
+
+        if not blits:
+            return None
+
+        surf = pygame.Surface((size, size), pygame.SRCALPHA)
+        surf.blits(blits, doreturn=False)
+        return surf.convert_alpha()
+
+# Read every chunk of chunk column cx out of a level: [((cx, cy), (types, variants) or None, offgrid records)].
+# Runs on the streaming loader thread, and copies the arrays so the disk reads happen here instead of on the frame that uses them
+def read_column(level, cx):
+    chunks = []
+    for chunk_loc, tile_offset, first, count in level.column(cx):
+        chunks.append((chunk_loc, level.chunk_arrays(tile_offset, copy=True), level.offgrid_records(first, count)))
+    return chunks
 
 class Tilemap:
 
-    def __init__(self, game, tilesize=16):
+    def __init__(self, game, tilesize=16, cache_budget=CHUNK_CACHE_BUDGET):
         self.game = game
         self.tilesize = tilesize
-        self.tilemap = {}
-        self.offgrid_tiles = []
+        self.chunks = {}
+        self.offgrid = {} # Offgrid tiles bucketed by position: (bx, by) -> {id(tile): (sequence number, tile, pixel rect)}
+        self.offgrid_count = 0 # Offgrid tiles loaded, shown in the profiler
+        self.offgrid_seq = 0 # Sequence number for the next offgrid tile, so they're drawn in the order they were placed
+        self.offgrid_reach = 0 # Biggest width or height of any offgrid tile, in pixels
         self.spawners = {}
         self.editor = False
+        self.overhang = 0 # How many tiles the biggest tile image reaches past its own tile, to the right and down
+        self.cache = ChunkCache(self, budget=cache_budget)
+        self.solid_shapes = {} # (type, variant) -> (width, height) in cells of the solid area, or None if the tile has no collisions
+        self.bounds = (0, 0, 0, 0) # Tile coordinates of the outermost on grid tiles: min x, min y, max x, max y
+        self.grid = None # (grid, x, y): every chunk's collision grid in one array for batched collisions, built when needed (see solid_grid)
+        self.version = 0 # Goes up whenever the collision grid changes, so whatever is worked out from the tiles knows to redo it
+        self.changes = deque(maxlen=CHANGE_LOG) # (version, x0, x1): tile columns (inclusive) each change of version was in, see changes_since
+        self.changes_from = 0 # Version changes are known from. Anything older has to start over
+
+        # Streaming (see open_level). Only used for binary levels opened with streaming=True
+        self.level = None
+        self.loader = None
+        self.columns = {} # Chunk column x -> (chunk locations, offgrid tiles) loaded for it
+        self.pending_columns = {} # Chunk column x -> future of read_column
+
+    # Image of a tile. The game loads some tile types as animations (offgrid coins), whose variants are the animation's
+    # frames, the same images the editor loads as a plain folder
+    def image(self, tile_type, variant):
+        images = self.game.assets[tile_type]
+        if isinstance(images, Animation):
+            images = images.images
+        return images[variant]
+
+    # Pixel rect covered by a tile's image, ongrid or offgrid
+    def tile_area(self, tile, ongrid=True):
+        img = self.image(tile['type'], tile['variant'])
+        if ongrid:
+            return (tile['pos'][0] * self.tilesize, tile['pos'][1] * self.tilesize, img.get_width(), img.get_height())
+        return (int(tile['pos'][0]), int(tile['pos'][1]), img.get_width(), img.get_height())
+
+    # Get the tile at tile coordinates x, y (or None if there isn't one)
+    def tile_at(self, x, y):
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            return None
+        return chunk.tiles[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+    # Size in cells of the area a tile blocks, or None if it doesn't collide. Which tiles collide comes from the physics
+    # flags in the asset manifest. Multi-tile solids (pipes) are rounded up to whole cells
+    def solid_shape(self, tile_type, variant):
+        key = (tile_type, variant)
+        if key not in self.solid_shapes:
+            flags = self.game.assets.physics(tile_type)
+            if variant < len(flags) and 'solid' in flags[variant]:
+                img = self.image(tile_type, variant)
+                self.solid_shapes[key] = (max(1, math.ceil(img.get_width() / self.tilesize)), max(1, math.ceil(img.get_height() / self.tilesize)))
+            else:
+                self.solid_shapes[key] = None
+        return self.solid_shapes[key]
+
+    # Add (delta=1) or remove (delta=-1) the footprint of a tile at tile coordinates x0, y0 from the collision grid
+    def mark_solid(self, tile_type, variant, x0, y0, delta):
+        shape = self.solid_shape(tile_type, variant)
+        if shape is None:
+            return
+
+        self.grid = None
+        self.log_change(x0, x0 + shape[0] - 1)
+        for x in range(x0, x0 + shape[0]):
+            for y in range(y0, y0 + shape[1]):
+                chunk_loc = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+                chunk = self.chunks.get(chunk_loc)
+                if chunk is None:
+                    chunk = self.chunks[chunk_loc] = Chunk(chunk_loc)
+                chunk.solid[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)] += delta
+                chunk.solid_count += delta
+                if not chunk.count and not chunk.solid_count:
+                    del self.chunks[chunk_loc]
+
+    # Bump the version for a change to the collision grid in tile columns x0 to x1 (inclusive). A change next to the last
+    # one is merged into it, so taking out a whole chunk is one entry
+    def log_change(self, x0, x1):
+        self.version += 1
+        if self.changes and self.changes[-1][1] <= x1 + 1 and x0 - 1 <= self.changes[-1][2]:
+            _, last0, last1 = self.changes.pop()
+            x0, x1 = min(x0, last0), max(x1, last1)
+        elif len(self.changes) == self.changes.maxlen:
+            self.changes_from = self.changes[0][0]
+        self.changes.append((self.version, x0, x1))
+
+    # Tile columns the collision grid changed in since version, as (x0, x1) ranges (inclusive), or None if that's too long
+    # ago to tell or a level was loaded since, and everything worked out from the tiles has to start over
+    def changes_since(self, version):
+        if version is None or version < self.changes_from:
+            return None
+        return [(x0, x1) for changed, x0, x1 in self.changes if changed > version]
+
+    # Check the collision grid at tile coordinates x, y
+    def is_solid(self, x, y):
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            return False
+        return chunk.solid[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)] != 0
+
+    # Add a tile to the map, replacing anything already at its position. Position is taken from tile['pos']
+    def set_tile(self, tile):
+        x, y = int(tile['pos'][0]), int(tile['pos'][1])
+        self.remove_tile(x, y) # Clears whatever was there from the collision grid and baked chunks
+        chunk_loc = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(chunk_loc)
+        if chunk is None:
+            chunk = self.chunks[chunk_loc] = Chunk(chunk_loc)
+
+        chunk.tiles[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)] = tile
+        chunk.count += 1
+        self.mark_solid(tile['type'], tile['variant'], x, y, 1)
+
+        area = self.tile_area(tile)
+        self.overhang = max(self.overhang, (area[2] - 1) // self.tilesize, (area[3] - 1) // self.tilesize)
+        self.cache.invalidate(area)
+
+    # Add a whole chunk of tiles straight from a binary level's arrays, without making a dict for every tile
+    def set_packed_chunk(self, chunk_loc, types, variants, names):
+        chunk = self.chunks.get(chunk_loc)
+        if chunk is None:
+            chunk = self.chunks[chunk_loc] = Chunk(chunk_loc)
+        chunk.packed = (types, variants, names)
+
+        type_list, variant_list = types.tolist(), variants.tolist()
+        chunk.count = len(type_list) - type_list.count(EMPTY)
+
+        # Work out each kind of tile in the chunk once. Types whose every variant here fills just its own cell (blocks) are
+        # marked a cell each, everything else that collides (pipes) has to be marked tile by tile
+        shapes = {} # Type id -> solid shapes of its variants in the chunk
+        for type_id, variant in set(zip(type_list, variant_list)):
+            if type_id != EMPTY:
+                shapes.setdefault(type_id, set()).add(self.solid_shape(names[type_id], variant))
+                img = self.image(names[type_id], variant)
+                self.overhang = max(self.overhang, (img.get_width() - 1) // self.tilesize, (img.get_height() - 1) // self.tilesize)
+        cell_solid = {EMPTY: 0}
+        shaped = set()
+        for type_id, kinds in shapes.items():
+            cell_solid[type_id] = 1 if kinds == {(1, 1)} else 0
+            if not cell_solid[type_id] and kinds != {None}:
+                shaped.add(type_id)
+
+        solid = bytes(map(cell_solid.__getitem__, type_list))
+        self.grid = None
+        self.log_change(chunk_loc[0] << CHUNK_SHIFT, (chunk_loc[0] << CHUNK_SHIFT) + CHUNK_MASK)
+        if chunk.solid_count: # Part of a neighbour's pipe is already in here
+            chunk.solid = bytearray(a + b for a, b in zip(chunk.solid, solid))
+        else:
+            chunk.solid = bytearray(solid)
+        chunk.solid_count += sum(solid)
+
+        x0, y0 = chunk_loc[0] << CHUNK_SHIFT, chunk_loc[1] << CHUNK_SHIFT
+        for type_id in shaped:
+            for i in compress(range(len(type_list)), map(type_id.__eq__, type_list)):
+                self.mark_solid(names[type_id], variant_list[i], x0 + (i & CHUNK_MASK), y0 + (i >> CHUNK_SHIFT), 1)
+
+        size = CHUNK_SIZE * self.tilesize
+        self.cache.invalidate((chunk_loc[0] * size, chunk_loc[1] * size, size + self.overhang * self.tilesize, size + self.overhang * self.tilesize))
+
+    # Remove the tile at tile coordinates x, y. Returns the removed tile, or None if there wasn't one
+    def remove_tile(self, x, y):
+        chunk_loc = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(chunk_loc)
+        if chunk is None:
+            return None
+
+        index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        tile = chunk.tiles[index]
+        if tile is not None:
+            chunk.tiles[index] = None
+            chunk.count -= 1
+            self.mark_solid(tile['type'], tile['variant'], x, y, -1)
+            if not chunk.count and not chunk.solid_count and chunk_loc in self.chunks:
+                del self.chunks[chunk_loc]
+            self.cache.invalidate(self.tile_area(tile))
+        return tile
+
+    # Bucket of the offgrid tiles at a position in pixels
+    def offgrid_bucket(self, pos):
+        return (math.floor(pos[0]) // OFFGRID_BUCKET_SIZE, math.floor(pos[1]) // OFFGRID_BUCKET_SIZE)
+
+    # Add and remove offgrid tiles, keeping the baked chunks up to date. Tiles are drawn in order of seq, which defaults to
+    # after every tile already added (streamed tiles pass their place in the level instead, since columns arrive in any order)
+    def add_offgrid(self, tile, seq=None):
+        if seq is None:
+            seq = self.offgrid_seq
+        area = self.tile_area(tile, ongrid=False)
+        self.offgrid.setdefault(self.offgrid_bucket(tile['pos']), {})[id(tile)] = (seq, tile, pygame.Rect(area))
+        self.offgrid_seq = max(self.offgrid_seq, seq + 1)
+        self.offgrid_count += 1
+        self.offgrid_reach = max(self.offgrid_reach, area[2], area[3])
+        self.cache.invalidate(area)
+
+    # Remove an offgrid tile (the tile dict itself, i.e. one returned by offgrid_in_rect). Returns whether it was in the map
+    def remove_offgrid(self, tile):
+        key = self.offgrid_bucket(tile['pos'])
+        bucket = self.offgrid.get(key)
+        entry = None if bucket is None else bucket.pop(id(tile), None)
+        if entry is None:
+            return False
+        if not bucket:
+            del self.offgrid[key]
+        self.offgrid_count -= 1
+        self.cache.invalidate(entry[2])
+        return True
+
+    # Offgrid tiles overlapping a rect in pixels, in the order they were placed. Only looks in the buckets the rect
+    # touches, plus the ones up and to the left whose tiles could reach into it
+    def offgrid_in_rect(self, rect):
+        rect = pygame.Rect(rect)
+        size = OFFGRID_BUCKET_SIZE
+        found = []
+        for bx in range((rect.x - self.offgrid_reach) // size, (rect.right - 1) // size + 1):
+            for by in range((rect.y - self.offgrid_reach) // size, (rect.bottom - 1) // size + 1):
+                bucket = self.offgrid.get((bx, by))
+                if bucket:
+                    for entry in bucket.values():
+                        if rect.colliderect(entry[2]):
+                            found.append(entry)
+        found.sort(key=lambda entry: entry[0])
+        return [entry[1] for entry in found]
+
+    # Offgrid tiles under a point in pixels, i.e. for clicking on them in the editor
+    def offgrid_at(self, pos):
+        return self.offgrid_in_rect((math.floor(pos[0]), math.floor(pos[1]), 1, 1))
+
+    # Every offgrid tile, in the order they were placed
+    @property
+    def offgrid_tiles(self):
+        entries = [entry for bucket in self.offgrid.values() for entry in bucket.values()]
+        entries.sort(key=lambda entry: entry[0])
+        return [entry[1] for entry in entries]
+
+    # Get all tiles inside a rectangle of tile coordinates (inclusive on both ends)
+    def tiles_in_rect(self, x0, y0, x1, y1):
+        for cx in range(x0 >> CHUNK_SHIFT, (x1 >> CHUNK_SHIFT) + 1):
+            for cy in range(y0 >> CHUNK_SHIFT, (y1 >> CHUNK_SHIFT) + 1):
+                chunk = self.chunks.get((cx, cy))
+                if chunk is None:
+                    continue
+
+                # Clip the rectangle to this chunk, in chunk-local coordinates
+                lx0 = max(x0 - (cx << CHUNK_SHIFT), 0)
+                lx1 = min(x1 - (cx << CHUNK_SHIFT), CHUNK_MASK)
+                ly0 = max(y0 - (cy << CHUNK_SHIFT), 0)
+                ly1 = min(y1 - (cy << CHUNK_SHIFT), CHUNK_MASK)
+                tiles = chunk.tiles
+                for ly in range(ly0, ly1 + 1):
+                    row = ly << CHUNK_SHIFT
+                    for tile in tiles[row + lx0:row + lx1 + 1]:
+                        if tile is not None:
+                            yield tile
+
+    # One column of tiles, from y0 to y1 (inclusive): (type, variant) of the on grid tile in each cell (None if there isn't
+    # one) and whether each cell is solid. Reads packed chunks without unpacking them
+    def column(self, x, y0, y1):
+        keys = [None] * (y1 - y0 + 1)
+        solid = [False] * (y1 - y0 + 1)
+        lx = x & CHUNK_MASK
+        for cy in range(y0 >> CHUNK_SHIFT, (y1 >> CHUNK_SHIFT) + 1):
+            chunk = self.chunks.get((x >> CHUNK_SHIFT, cy))
+            if chunk is None:
+                continue
+
+            if chunk.packed is not None:
+                types, variants, names = chunk.packed
+                cells = [None if type_id == EMPTY else (names[type_id], variant) for type_id, variant in zip(types[lx::CHUNK_SIZE].tolist(), variants[lx::CHUNK_SIZE].tolist())]
+            else:
+                cells = [None if tile is None else (tile['type'], tile['variant']) for tile in chunk.unpacked[lx::CHUNK_SIZE]]
+            first = max(y0 - (cy << CHUNK_SHIFT), 0)
+            last = min(y1 - (cy << CHUNK_SHIFT), CHUNK_MASK)
+            for ly in range(first, last + 1):
+                i = (cy << CHUNK_SHIFT) + ly - y0
+                keys[i] = cells[ly]
+                solid[i] = chunk.solid[(ly << CHUNK_SHIFT) | lx] != 0
+        return keys, solid
+
+    # Iterate over every on grid tile in the map
+    def iter_tiles(self):
+        for chunk in self.chunks.values():
+            for tile in chunk.tiles:
+                if tile is not None:
+                    yield tile
 
     # Get tiles directly around the position (i.e. tiles directly next to the player)
-    def tiles_around(self, pos): 
+    def tiles_around(self, pos):
         tiles = []
         tile_loc = (int(pos[0]) // self.tilesize, int(pos[1]) // self.tilesize)
         for offset in NEIGHBOR_OFFSETS:
-            tile_position = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] + offset[1]) # Convert neighboring tile position to a string to search the tilemap dict
-
-            if tile_position in self.tilemap: # If the neighboring tile position is actually a tile in the tile map
-                tiles.append(self.tilemap[tile_position])
+            tile = self.tile_at(tile_loc[0] + offset[0], tile_loc[1] + offset[1])
+            if tile is not None: # If the neighboring tile position is actually a tile in the tile map
+                tiles.append(tile)
 
         return tiles
-    
-    # Get rects of nearby tiles, for collision purposes
-    def tile_rects_around(self, pos):
-        rects = []
-        for tile in self.tiles_around(pos):
-            if tile['type'] in PHYSICS_TILES:
-                rects.append(pygame.Rect(tile['pos'][0] * self.tilesize, tile['pos'][1] * self.tilesize, self.tilesize, self.tilesize))
-
-            if tile['type'] in PHYSICS_TILES_VARIANTS and tile['variant'] in PHYSICS_TILES_VARIANTS[tile['type']]:
-                rects.append(pygame.Rect(tile['pos'][0] * self.tilesize, tile['pos'][1] * self.tilesize, self.game.assets[tile['type']][tile['variant']].get_width(), self.game.assets[tile['type']][tile['variant']].get_width()))
-
-        return rects
-
-    def render(self, surface, offset=(0, 0)):       
-                
-        # Render offgrid tiles
-        for tile in self.offgrid_tiles:
-            surface.blit(self.game.assets[tile['type']][tile['variant']],
-                        (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
-
-        # Optimized way of rendering, only try to render what's currently on the display coordinates
-        for x in range(offset[0] // self.tilesize - 5, (offset[0] + surface.get_width()) // self.tilesize + 1):
-            for y in range(offset[1] // self.tilesize, (offset[1] + surface.get_height()) // self.tilesize + 1):
-                
-                # Render ongrid tiles and spawners
-                loc = str(x) + ';' + str(y)
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    surface.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] * self.tilesize - offset[0],
-                                                                           tile['pos'][1] * self.tilesize - offset[1]))
-                if self.editor: 
-                    if loc in self.spawners:
-                        tile = self.spawners[loc]
-                        surface.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] * self.tilesize - offset[0],
-                                                                                    tile['pos'][1] * self.tilesize - offset[1]))
-                    
-    # Load map
-    def load(self, path):
-        f = open(path, 'r')
-        map_data = json.load(f)
-        f.close()
-
-        self.tilemap = map_data['tilemap']
-        self.tilesize = map_data['tilesize']
-        self.offgrid_tiles = map_data['offgrid']
-        self.spawners = map_data['spawners']
-
-    # Save map
-    def save(self, path):
-        f = open(path, 'w')
-        json.dump({
-            'tilemap': self.tilemap,
+
+    # Move a box (x, y, w, h in pixels) dx pixels along the x axis, stopping at the first solid cell it would run into.
+    # Every column between the leading edge and where it ends up is checked, so fast movement can't tunnel through thin walls,
+    # and every row the box covers is checked, so boxes bigger than a tile collide properly. Returns (new x, whether it hit something)
+    def sweep_x(self, x, y, w, h, dx):
+        ts = self.tilesize
+        row0, row1 = int(y // ts), math.ceil((y + h) / ts) - 1
+        if dx > 0:
+            for col in range(int((x + w) // ts), math.ceil((x + w + dx) / ts)):
+                for row in range(row0, row1 + 1):
+                    if self.is_solid(col, row):
+                        return col * ts - w, True
+        elif dx < 0:
+            for col in range(math.ceil(x / ts) - 1, int((x + dx) // ts) - 1, -1):
+                for row in range(row0, row1 + 1):
+                    if self.is_solid(col, row):
+                        return (col + 1) * ts, True
+        return x + dx, False
+
+    # Same as sweep_x, along the y axis. Returns (new y, whether it hit something)
+    def sweep_y(self, x, y, w, h, dy):
+        ts = self.tilesize
+        col0, col1 = int(x // ts), math.ceil((x + w) / ts) - 1
+        if dy > 0:
+            for row in range(int((y + h) // ts), math.ceil((y + h + dy) / ts)):
+                for col in range(col0, col1 + 1):
+                    if self.is_solid(col, row):
+                        return row * ts - h, True
+        elif dy < 0:
+            for row in range(math.ceil(y / ts) - 1, int((y + dy) // ts) - 1, -1):
+                for col in range(col0, col1 + 1):
+                    if self.is_solid(col, row):
+                        return (row + 1) * ts, True
+        return y + dy, False
+
+    # The collision grids of every chunk as one 2D array (rows are y), plus the tile coordinates of its top left corner.
+    # Rebuilt only after the collision grid changes, so batched collisions can index it directly every tick
+    def solid_grid(self):
+        if self.grid is None:
+            if not self.chunks:
+                self.grid = (np.zeros((1, 1), np.uint8), 0, 0)
+                return self.grid
+
+            cx0, cy0 = min(loc[0] for loc in self.chunks), min(loc[1] for loc in self.chunks)
+            cx1, cy1 = max(loc[0] for loc in self.chunks), max(loc[1] for loc in self.chunks)
+            grid = np.zeros(((cy1 - cy0 + 1) * CHUNK_SIZE, (cx1 - cx0 + 1) * CHUNK_SIZE), np.uint8)
+            for chunk_loc, chunk in self.chunks.items():
+                if chunk.solid_count:
+                    x, y = (chunk_loc[0] - cx0) * CHUNK_SIZE, (chunk_loc[1] - cy0) * CHUNK_SIZE
+                    grid[y:y + CHUNK_SIZE, x:x + CHUNK_SIZE] = np.frombuffer(chunk.solid, np.uint8).reshape(CHUNK_SIZE, CHUNK_SIZE)
+            self.grid = (grid, cx0 << CHUNK_SHIFT, cy0 << CHUNK_SHIFT)
+        return self.grid
+
+    # Check the collision grid for arrays of tile coordinates at once
+    def is_solid_batch(self, xs, ys):
+        grid, gx, gy = self.solid_grid()
+        xs, ys = xs - gx, ys - gy
+        inside = (xs >= 0) & (xs < grid.shape[1]) & (ys >= 0) & (ys < grid.shape[0])
+        return inside & (grid[np.clip(ys, 0, grid.shape[0] - 1), np.clip(xs, 0, grid.shape[1] - 1)] != 0)
+
+    # sweep_x and sweep_y for many boxes in one go. pos and size are (n, 2) arrays, d is how far each box moves along
+    # the axis (0 for x, 1 for y). Works through the cells one step at a time for all the boxes together, in the same order
+    # as the single box sweeps, so it gives the same results. Returns (new coordinates along the axis, whether each box hit something)
+    def sweep_batch(self, axis, pos, size, d):
+        ts = self.tilesize
+        a, b = pos[:, axis], pos[:, 1 - axis] # Along and across the axis
+        length, width = size[:, axis], size[:, 1 - axis]
+        forward = d > 0
+
+        # First and last line of cells to check along the axis (inclusive), and rows of cells the boxes cover across it
+        start = np.where(forward, np.floor((a + length) / ts), np.ceil(a / ts) - 1).astype(np.int64)
+        end = np.where(forward, np.ceil((a + length + d) / ts) - 1, np.floor((a + d) / ts)).astype(np.int64)
+        step = np.where(forward, 1, -1)
+        lines = np.where(d != 0, (end - start) * step + 1, 0)
+        row0 = np.floor(b / ts).astype(np.int64)
+        rows = np.ceil((b + width) / ts).astype(np.int64) - row0
+
+        new = a + d
+        hit = np.zeros(len(a), bool)
+        for k in range(int(lines.max(initial=0))):
+            line = start + k * step
+            blocked = np.zeros(len(a), bool)
+            for r in range(int(rows.max(initial=0))):
+                cells = (line, row0 + r) if axis == 0 else (row0 + r, line)
+                blocked |= (r < rows) & self.is_solid_batch(*cells)
+            blocked &= (k < lines) & ~hit # Only the first solid line counts
+            new = np.where(blocked, np.where(forward, line * ts - length, (line + 1) * ts), new)
+            hit |= blocked
+        return new, hit
+
+    # Push the map's draw commands onto a Renderer
+    def draw(self, renderer, offset=(0, 0)):
+        width, height = renderer.surface.get_size()
+
+        # Static tiles are drawn one baked chunk at a time, only for the chunks currently on the display
+        size = CHUNK_SIZE * self.tilesize
+        for cx in range(offset[0] // size, (offset[0] + width - 1) // size + 1):
+            for cy in range(offset[1] // size, (offset[1] + height - 1) // size + 1):
+                surf = self.cache.get((cx, cy))
+                if surf:
+                    renderer.draw(surf, (cx * size - offset[0], cy * size - offset[1]), layer=TILES)
+
+        # Render spawners (only visible in the editor)
+        if self.editor:
+            x0, y0 = offset[0] // self.tilesize - 5, offset[1] // self.tilesize
+            x1, y1 = (offset[0] + width) // self.tilesize, (offset[1] + height) // self.tilesize
+            for tile in self.spawners.values():
+                if x0 <= tile['pos'][0] <= x1 and y0 <= tile['pos'][1] <= y1:
+                    renderer.draw(self.image(tile['type'], tile['variant']), (tile['pos'][0] * self.tilesize - offset[0],
+                                                                                    tile['pos'][1] * self.tilesize - offset[1]), layer=TILES)
+
+    # Draw the map straight onto a surface
+    def render(self, surface, offset=(0, 0)):
+        renderer = Renderer(surface)
+        self.draw(renderer, offset=offset)
+        renderer.flush()
+
+    # Load map, either JSON or binary (.lvl). With streaming, binary levels are only opened and chunks load as stream() asks
+    # for them, JSON maps are always loaded whole
+    def load(self, path, streaming=False):
+        if path.endswith(LEVEL_EXT):
+            level = LevelFile(path)
+            if streaming and level.chunk_shift == CHUNK_SHIFT:
+                self.open_level(level)
+            else:
+                self.load_level(level)
+        else:
+            self.load_data(read_map(path))
+
+    # Start loading the asset groups the level uses, if the game loads assets on demand
+    def request_assets(self, types):
+        request = getattr(self.game.assets, 'request', None)
+        if request is not None:
+            request(*types)
+
+    def clear(self, tilesize):
+        self.tilesize = tilesize
+        self.chunks = {}
+        self.grid = None
+        self.version += 1
+        self.changes.clear()
+        self.changes_from = self.version
+        self.offgrid = {}
+        self.offgrid_count = 0
+        self.offgrid_seq = 0
+        self.offgrid_reach = 0
+        self.spawners = {}
+        self.bounds = (0, 0, 0, 0)
+        self.level = None
+        self.columns = {}
+        self.pending_columns = {}
+        self.cache.clear()
+        self.solid_shapes = {}
+        self.overhang = 0
+
+    # Load map data in the JSON layout
+    def load_data(self, map_data):
+        self.request_assets(set(tile['type'] for tiles in (map_data['tilemap'].values(), map_data['offgrid']) for tile in tiles))
+
+        self.clear(map_data['tilesize'])
+        bounds = None
+        for tile in map_data['tilemap'].values(): # Keys are "x;y" strings, the position is also stored in the tile itself
+            self.set_tile(tile)
+            x, y = int(tile['pos'][0]), int(tile['pos'][1])
+            bounds = (x, y, x, y) if bounds is None else (min(bounds[0], x), min(bounds[1], y), max(bounds[2], x), max(bounds[3], y))
+        self.bounds = bounds or (0, 0, 0, 0)
+        for tile in map_data['offgrid']:
+            self.add_offgrid(tile)
+        self.spawners = map_data.get('spawners', {})
+
+    # Load a binary level. Chunks keep pointing at the level's arrays until their tiles are needed as dicts
+    def load_level(self, level):
+        if level.chunk_shift != CHUNK_SHIFT: # Saved with a different chunk size, the arrays can't be used as they are
+            self.load_data(level.to_data())
+            return
+
+        self.request_assets(level.strings)
+        self.clear(level.tilesize)
+        self.bounds = level.bounds
+        for chunk_loc, tile_offset, first, count in level.entries():
+            arrays = level.chunk_arrays(tile_offset)
+            if arrays is not None:
+                self.set_packed_chunk(chunk_loc, arrays[0], arrays[1], level.strings)
+        for tile in level.offgrid():
+            self.add_offgrid(tile)
+        self.spawners = level.spawners()
+
+    # Open a binary level for streaming. Only the header and spawners are read here, the level bounds come from the header,
+    # and chunks are loaded a column at a time on a background thread as the view gets close to them (see stream()).
+    # Meant for playing long levels, the editor loads levels whole so saving writes everything back out
+    def open_level(self, level):
+        self.request_assets(level.strings)
+        self.clear(level.tilesize)
+        self.bounds = level.bounds
+        self.spawners = level.spawners()
+        self.level = level
+        if self.loader is None:
+            self.loader = ThreadPoolExecutor(max_workers=1)
+
+    # Keep the chunk columns around the view (x0 to x1, in pixels) loaded and drop the ones far away from it, so memory
+    # stays the same however long the level is. Columns are read in the background and put into the map once they're
+    # ready, without blocking. With wait, every column within STREAM_MARGIN of the view is waited for, so what's loaded only
+    # depends on where the view is and not on how fast the loader was (before the first frame, and for lockstep runs,
+    # where entities that are awake or spawning just off screen must see the same tiles every time). Returns the offgrid
+    # tiles that were added and the ones that were dropped
+    def stream(self, x0, x1, wait=False):
+        if self.level is None:
+            return [], []
+
+        size = CHUNK_SIZE * self.tilesize
+        view0, view1 = int(x0) // size, (int(x1) - 1) // size
+        first = max(view0 - STREAM_MARGIN, (self.bounds[0] >> CHUNK_SHIFT) - 1)
+        last = min(view1 + STREAM_MARGIN, (self.bounds[2] >> CHUNK_SHIFT) + 1) # One column past the bounds for offgrid tiles hanging off the edge
+        for cx in range(first, last + 1):
+            if cx not in self.columns and cx not in self.pending_columns:
+                self.pending_columns[cx] = self.loader.submit(read_column, self.level, cx)
+
+        added = []
+        for cx in [cx for cx in self.pending_columns if wait or self.pending_columns[cx].done()]:
+            added += self.add_column(cx, self.pending_columns.pop(cx).result())
+
+        dropped = []
+        for cx in [cx for cx in self.columns if cx < view0 - STREAM_EVICT_MARGIN or cx > view1 + STREAM_EVICT_MARGIN]:
+            dropped += self.remove_column(cx)
+        return added, dropped
+
+    # Put a column read by read_column into the map
+    def add_column(self, cx, chunks):
+        chunk_locs = []
+        offgrid = []
+        for chunk_loc, arrays, records in chunks:
+            if arrays is not None:
+                self.set_packed_chunk(chunk_loc, arrays[0], arrays[1], self.level.strings)
+                chunk_locs.append(chunk_loc)
+            for seq, tile in records:
+                self.add_offgrid(tile, seq=seq)
+                offgrid.append(tile)
+        self.columns[cx] = (chunk_locs, offgrid)
+        return offgrid
+
+    # Take a streamed column back out of the map: its tiles, their collisions and its offgrid tiles. Returns the offgrid
+    # tiles it was loaded with
+    def remove_column(self, cx):
+        chunk_locs, offgrid = self.columns.pop(cx)
+        for chunk_loc in chunk_locs:
+            self.remove_chunk(chunk_loc)
+
+        for tile in offgrid:
+            self.remove_offgrid(tile) # Already gone if it was taken out of the map since (i.e. turned into a pickup)
+        return offgrid
+
+    # Remove every on grid tile of a chunk. The chunk itself stays if a neighbour's pipe still covers some of its cells
+    def remove_chunk(self, chunk_loc):
+        chunk = self.chunks.get(chunk_loc)
+        if chunk is None:
+            return
+
+        if chunk.packed is not None:
+            types, variants, names = chunk.packed
+            cells = [(i, names[type_id], variants[i]) for i, type_id in enumerate(types) if type_id != EMPTY]
+        else:
+            cells = [(i, tile['type'], tile['variant']) for i, tile in enumerate(chunk.unpacked) if tile is not None]
+        chunk.packed = None
+        chunk.unpacked = [None] * (CHUNK_SIZE * CHUNK_SIZE)
+        chunk.count = 0
+
+        x0, y0 = chunk_loc[0] << CHUNK_SHIFT, chunk_loc[1] << CHUNK_SHIFT
+        for i, tile_type, variant in cells:
+            self.mark_solid(tile_type, variant, x0 + (i & CHUNK_MASK), y0 + (i >> CHUNK_SHIFT), -1)
+        if not chunk.solid_count and self.chunks.get(chunk_loc) is chunk:
+            del self.chunks[chunk_loc]
+
+        size = CHUNK_SIZE * self.tilesize
+        self.cache.invalidate((chunk_loc[0] * size, chunk_loc[1] * size, size + self.overhang * self.tilesize, size + self.overhang * self.tilesize))
+
+    # Map data in the JSON layout
+    def to_data(self):
+        tilemap = {}
+        for tile in self.iter_tiles():
+            tilemap[str(tile['pos'][0]) + ';' + str(tile['pos'][1])] = tile # Keep the "x;y" string keys of the map format
+
+        return {
+            'tilemap': tilemap,
             'tilesize': self.tilesize,
             'offgrid': self.offgrid_tiles,
             'spawners': self.spawners
-        }, f)
-        f.close()
\ No newline at end of file
+        }
+
+    # Save map, either JSON or binary (.lvl) depending on the extension
+    def save(self, path):
+        write_map(self.to_data(), path)
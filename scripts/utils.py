@@ -1,6 +1,8 @@
 import pygame, os
+from scripts.atlas import Atlas
 
 BASE_IMG_PATH = 'data/images/'
+ATLAS = Atlas(BASE_IMG_PATH) # Packed sprite folders, built by buildAtlas.py. Used whenever it's up to date
 
 def load_image(path, colorkey=None): # If using directly, include filename in path
     img = pygame.image.load(BASE_IMG_PATH + path).convert_alpha() # Since image has transparency already in image, use convert_alpha() instead of convert()
@@ -8,6 +10,10 @@ def load_image(path, colorkey=None): # If using directly, include filename in pa
     return img
 
 def load_images(path, colorkey=None):
+    images = ATLAS.images(path, colorkey=colorkey)
+    if images is not None:
+        return images
+
     images = []
     for image in sorted(os.listdir(BASE_IMG_PATH + path)):
         if image[0] == '.': # skip hidden files
@@ -24,7 +30,10 @@ def get_image_variation(path, string):
     """
     variation_nums = []
     count = 0
-    for image in sorted(os.listdir(BASE_IMG_PATH + path)):
+    names = ATLAS.names(path) # Avoid listing the directory if the atlas manifest already knows what's in it
+    if names is None:
+        names = sorted(os.listdir(BASE_IMG_PATH + path))
+    for image in names:
         if image[0] == '.' or image == None: # skip hidden files and None values
            pass
         elif string.lower() in image.lower(): 
@@ -35,6 +44,13 @@ def get_image_variation(path, string):
 
     return variation_nums
 
+# Names of the animation folders inside a folder (i.e. 'idle', 'run' in 'Characters/player')
+def load_folders(path):
+    folders = ATLAS.groups(path)
+    if folders is None:
+        folders = next(os.walk(BASE_IMG_PATH + path))[1] # Gets directory names from the directory to walk
+    return folders
+
 # This class handles sprite sheets
 # This was taken from https://www.pygame.org/wiki/Spritesheet
 # I've added some code to fail if the file wasn't found..
@@ -66,25 +82,61 @@ class Spritesheet:
         return self.load_images_at(tups, colorkey=colorkey)
 
 
+# Frame data for one animation, shared by every entity that plays it. Flipped copies of the frames are made once up front
+# (and scaled or tinted copies on first use), so entities pick a ready made Surface instead of transforming one every frame
 class Animation:
     
     def __init__(self, images, img_dur=5, loop=True):
         self.images = images
+        self.flipped = [pygame.transform.flip(img, True, False) for img in images]
         self.img_duration = img_dur
-        self.done = False
         self.loop = loop
+        self.length = img_dur * len(images) # Length of the animation in frames of the game
+        self.variants = {} # (kind, arg, flip) -> list of transformed frames
+
+    # Get (and cache) a copy of the frames scaled to size
+    def scaled(self, size, flip=False):
+        key = ('scale', tuple(size), flip)
+        if key not in self.variants:
+            self.variants[key] = [pygame.transform.scale(img, size) for img in (self.flipped if flip else self.images)]
+        return self.variants[key]
+
+    # Get (and cache) a copy of the frames multiplied by a color, i.e. for damage flashes or palette swaps
+    def tinted(self, color, flip=False):
+        key = ('tint', tuple(color), flip)
+        if key not in self.variants:
+            frames = []
+            for img in (self.flipped if flip else self.images):
+                img = img.copy()
+                img.fill(color, special_flags=pygame.BLEND_RGBA_MULT)
+                frames.append(img)
+            self.variants[key] = frames
+        return self.variants[key]
+
+    def img(self, frame=0, flip=False):
+        return (self.flipped if flip else self.images)[frame // self.img_duration]
+
+# Playback state of an Animation for one entity (which frame it's on). Changing animation just points it at a different
+# shared Animation, nothing gets copied or allocated
+class AnimationState:
+
+    def __init__(self, animation=None):
+        self.animation = animation
         self.frame = 0 # Frame of the game
+        self.done = False
+
+    def set(self, animation):
+        self.animation = animation
+        self.frame = 0
+        self.done = False
 
-    def copy(self):
-        return Animation(self.images, self.img_duration, self.loop)
-    
     def update(self): # Update the frame
-        if self.loop:
-            self.frame = (self.frame + 1) % (self.img_duration * len(self.images))
+        if self.animation.loop:
+            self.frame = (self.frame + 1) % self.animation.length
         else:
-            self.frame = min(self.frame + 1, self.img_duration * len(self.images) - 1)
-            if self.frame >= self.img_duration * len(self.images) - 1:
+            self.frame = min(self.frame + 1, self.animation.length - 1)
+            if self.frame >= self.animation.length - 1:
                 self.done = True
 
-    def img(self):
-        return self.images[int(self.frame / self.img_duration)]
\ No newline at end of file
+    def img(self, flip=False):
+        return self.animation.img(self.frame, flip)
@@ -0,0 +1,18 @@
+from scripts.atlas import Atlas, build, load_physics, physics_flags, folder_names
+from scripts.utils import BASE_IMG_PATH
+
+# The manifest carries the declared physics flags, and a folder missing from the atlas gets the same ones from the declarations
+def test_manifest_physics_flags(tmp_path):
+    atlas_path = str(tmp_path) + '/'
+    build(BASE_IMG_PATH, atlas_path)
+    atlas = Atlas(BASE_IMG_PATH, atlas_path)
+    declarations = load_physics(BASE_IMG_PATH)
+    assert declarations
+    for path in declarations:
+        assert atlas.folder(path) is not None
+        assert atlas.physics(path) == physics_flags(declarations, path, folder_names(BASE_IMG_PATH + path))
+        assert Atlas(BASE_IMG_PATH, atlas_path + 'missing/').physics(path) == atlas.physics(path)
+
+    pipes = atlas.physics('Tilesets/decor')
+    assert [name for name, flags in zip(folder_names(BASE_IMG_PATH + 'Tilesets/decor'), pipes) if 'solid' in flags] == ['pipe.png', 'pipe_base.png']
+    assert all('solid' in flags for flags in atlas.physics('Tilesets/blocks'))
@@ -0,0 +1,28 @@
+import json, os
+from scripts.levelformat import write_map, read_map
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def level_01():
+    with open(os.path.join(ROOT, 'maps', 'level_01.json')) as f:
+        return json.load(f)
+
+# JSON -> .lvl -> JSON gives back the offgrid list in the same order, not just the same tiles
+def test_round_trip_keeps_offgrid_order(tmp_path):
+    map_data = level_01()
+    # Overlapping decor placed right to left, across chunk boundaries, so sorting by chunk would change the order
+    map_data['offgrid'] += [{'type': 'decor', 'variant': i % 3, 'pos': [600.5 - i * 100, 40.25 + (i % 2) * 300]} for i in range(6)]
+    path = str(tmp_path / 'level.lvl')
+    write_map(map_data, path)
+    loaded = read_map(path)
+
+    assert loaded['offgrid'] == map_data['offgrid']
+    assert loaded['tilemap'] == map_data['tilemap']
+    assert loaded['spawners'] == map_data['spawners']
+
+def test_round_trip_twice_is_identical(tmp_path):
+    first, second = str(tmp_path / 'a.lvl'), str(tmp_path / 'b.lvl')
+    write_map(level_01(), first)
+    write_map(read_map(first), second)
+    with open(first, 'rb') as a, open(second, 'rb') as b:
+        assert a.read() == b.read()
@@ -0,0 +1,36 @@
+import os, shutil, subprocess, sys
+from scripts.levelformat import read_map
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def map_tool(*args):
+    return subprocess.run([sys.executable, 'mapTool.py', '--jobs', '1'] + list(args), cwd=ROOT, capture_output=True, text=True)
+
+def copy_maps(tmp_path):
+    maps = tmp_path / 'maps'
+    shutil.copytree(os.path.join(ROOT, 'maps'), maps)
+    return maps
+
+def tiles(map_data):
+    return list(map_data['tilemap'].values()) + map_data['offgrid'] + list(map_data.get('spawners', {}).values())
+
+# The example in mapTool.py's header
+def test_documented_command_line(tmp_path):
+    maps = copy_maps(tmp_path)
+    result = map_tool('--retype', 'coins', 'coin/collect', '--delete-variant', 'decor', '5', str(maps))
+    assert result.returncode == 0, result.stdout + result.stderr
+    for path in maps.glob('*.json'):
+        assert not [tile for tile in tiles(read_map(str(path))) if tile['type'] == 'decor' and tile['variant'] == 5]
+
+def test_delete_type_before_map_path(tmp_path):
+    path = str(copy_maps(tmp_path) / 'level_01.json')
+    before = read_map(path)
+    result = map_tool('--dry-run', '--delete', 'items', path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert read_map(path) == before
+
+def test_delete_type(tmp_path):
+    path = str(copy_maps(tmp_path) / 'level_01.json')
+    result = map_tool('--delete', 'decor', path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert not [tile for tile in tiles(read_map(path)) if tile['type'] == 'decor']
@@ -0,0 +1,25 @@
+import json, os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A map with a coin placed as an offgrid tile (what the editor does) loads, and the coin can be collected
+def test_offgrid_coin(tmp_path):
+    from MarioGame import Game
+
+    with open(os.path.join(ROOT, 'maps', 'level_01.json')) as f:
+        map_data = json.load(f)
+    path = tmp_path / 'coin.json'
+    path.write_text(json.dumps(map_data))
+    game = Game(map_path=str(path), headless=True, seed=0)
+    x, y = (float(v) for v in game.player.pos)
+    map_data['offgrid'].append({'type': 'coin/collect', 'variant': 0, 'pos': [x + 24, y]})
+    path.write_text(json.dumps(map_data))
+
+    game.reset()
+    store = game.entities
+    assert [store.types[store.type[i]] for i in range(store.count) if store.flags[i]].count('coin') == 1
+    assert not [tile for tile in game.tilemap.offgrid_tiles if tile['type'] == 'coin/collect']
+
+    for tick in range(60):
+        game.step(right=True)
+    assert game.player.collected.get('coin') == 1
@@ -0,0 +1,142 @@
+import json, os, random, time
+import scripts.tilemap
+from scripts.levelformat import write_map
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Inputs for a run: run right and jump every so often
+def run(game, ticks):
+    for tick in range(ticks):
+        game.movement[1] = True
+        game.jump_queued = tick % 40 == 0
+        game.update()
+    return game.tilemap.version, game.state_hash()
+
+# Lockstep runs of a streamed level end up in the same state however slow the loader thread is
+def test_lockstep_streaming_ignores_loader_timing(tmp_path, monkeypatch):
+    from MarioGame import Game
+
+    with open(os.path.join(ROOT, 'maps', 'level_01.json')) as f:
+        path = str(tmp_path / 'level.lvl')
+        write_map(json.load(f), path)
+
+    read_column = scripts.tilemap.read_column
+    delays = random.Random(0)
+    def slow_read_column(level, cx):
+        time.sleep(delays.random() * 0.05)
+        return read_column(level, cx)
+
+    results = []
+    for slow in [False, True]:
+        if slow:
+            monkeypatch.setattr(scripts.tilemap, 'read_column', slow_read_column)
+        game = Game(map_path=path, headless=True, streaming=True, seed=0)
+        game.lockstep = True
+        results.append(run(game, 600))
+    assert results[0] == results[1]
+
+# Pickups taken from streamed columns leave the store with their column and come back with it, so they don't pile up
+def test_streamed_pickups_are_dropped_with_their_column(tmp_path):
+    from MarioGame import Game
+    from scripts.entitystore import PICKUP_TYPES
+
+    width = 400
+    tilemap = {}
+    for x in range(width):
+        for y in (18, 19):
+            tilemap['{};{}'.format(x, y)] = {'type': 'block', 'variant': 0, 'pos': [x, y]}
+    offgrid = [{'type': 'coin/collect', 'variant': 0, 'pos': [x * 16.0, 32.0]} for x in range(0, width, 2)]
+    spawners = {'2;17': {'type': 'spawners', 'variant': 0, 'pos': [2, 17]}}
+    path = str(tmp_path / 'coins.lvl')
+    write_map({'tilemap': tilemap, 'tilesize': 16, 'offgrid': offgrid, 'spawners': spawners}, path)
+
+    game = Game(map_path=path, headless=True, streaming=True, seed=0)
+    store = game.entities
+    def pickups():
+        return sum(1 for i in range(store.count) if store.flags[i] and store.types[store.type[i]] in PICKUP_TYPES)
+
+    # Every coin of a loaded column is a pickup, and nothing else is left
+    def loaded_coins():
+        chunk_pixels = 16 << scripts.tilemap.CHUNK_SHIFT
+        return sum(1 for tile in offgrid if int(tile['pos'][0]) // chunk_pixels in game.tilemap.columns)
+
+    view = game.display.get_width()
+    most = 0
+    for x in list(range(0, width * 16 - view, 16)) + list(range(width * 16 - view, -1, -16)): # Over to the end and back
+        streamed, dropped = game.tilemap.stream(x, x + view, wait=True)
+        store.take_pickups(game.tilemap, streamed)
+        store.drop_pickups(dropped)
+        assert pickups() == loaded_coins()
+        most = max(most, store.count)
+    assert most < len(offgrid) / 2
+
+# The observer follows a streamed level loading and dropping columns by redoing just those columns, not starting over
+def test_observer_keeps_up_with_streaming(tmp_path, monkeypatch):
+    from MarioGame import Game
+    from scripts.observation import TileObserver
+
+    with open(os.path.join(ROOT, 'maps', 'level_01.json')) as f:
+        path = str(tmp_path / 'level.lvl')
+        write_map(json.load(f), path)
+
+    game = Game(map_path=path, headless=True, streaming=True, seed=0)
+    game.lockstep = True
+    observer = TileObserver(game)
+    clears = []
+    clear = observer.clear
+    monkeypatch.setattr(observer, 'clear', lambda: (clears.append(game.tilemap.version), clear()))
+
+    tilemap, ts = game.tilemap, game.tilemap.tilesize
+    for tick in range(600):
+        game.movement[1] = True
+        game.jump_queued = tick % 40 == 0
+        game.update()
+        out = observer.observe()
+        x0 = int(game.player.pos[0] + game.player.size[0] / 2) // ts - observer.columns // 2
+        y0 = int(game.player.pos[1] + game.player.size[1] / 2) // ts - observer.rows // 2
+        for x in range(observer.columns):
+            keys, solid = tilemap.column(x0 + x, y0, y0 + observer.rows - 1)
+            for y, (key, cell) in enumerate(zip(keys, solid)):
+                if out[y, x] <= 4: # Tile classes, not entities or the player
+                    assert out[y, x] == observer.tile_class(key, cell)
+    assert len(clears) == 1
+
+# Spans and links kept up to date as a streamed level loads and drops columns (and blocks change) match ones worked out from scratch
+def test_navigation_keeps_up_with_streaming(tmp_path):
+    from MarioGame import Game
+    from scripts.navigation import Navigation, UNUSED
+
+    width = 300
+    tilemap = {}
+    for x in range(width):
+        for y in ((18, 19) if x % 37 < 34 else ()) + ((10, 11, 12) if x % 11 == 0 else ()): # Ground with gaps, and pillars
+            tilemap['{};{}'.format(x, y)] = {'type': 'block', 'variant': 0, 'pos': [x, y]}
+    path = str(tmp_path / 'level.lvl')
+    write_map({'tilemap': tilemap, 'tilesize': 16, 'offgrid': [], 'spawners': {}}, path)
+
+    def spans(nav):
+        return {i: (int(nav.x0[i]), int(nav.x1[i]), int(nav.y[i]), int(nav.ledges[i])) for i in range(nav.count) if nav.x0[i] != UNUSED}
+    def links(nav):
+        nav.hops_to(-1)
+        span, table = spans(nav), nav.links
+        return sorted((span[int(table['from'][k])], span[int(table['to'][k])], int(table['takeoff'][k]), int(table['landing'][k]), int(table['kind'][k]))
+                      for k in range(nav.link_count) if table['from'][k] >= 0)
+
+    game = Game(map_path=path, headless=True, streaming=True, seed=0)
+    nav = game.navigation
+    view = game.display.get_width()
+    edits = random.Random(0)
+    for step, x in enumerate(list(range(0, width * 16 - view, 32)) + list(range(width * 16 - view, -1, -32))): # Over to the end and back
+        game.tilemap.stream(x, x + view, wait=True)
+        if step % 3 == 0:
+            block = [x // 16 + edits.randrange(view // 16), edits.randrange(8, 19)]
+            if edits.random() < 0.5:
+                game.tilemap.set_tile({'type': 'block', 'variant': 0, 'pos': block})
+            else:
+                game.tilemap.remove_tile(*block)
+        nav.refresh()
+        if step % 2 == 0:
+            fresh = Navigation(game.tilemap)
+            fresh.refresh()
+            assert sorted(spans(nav).values()) == sorted(spans(fresh).values())
+            assert links(nav) == links(fresh)